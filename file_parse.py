@@ -8,7 +8,7 @@ import base64
 import asyncio
 import traceback
 
-from typing import List, Dict
+from typing import List, Dict, Optional
 from loguru import logger
 from datetime import datetime, timezone
 
@@ -24,113 +24,144 @@ import src.config_util as cfg
 from src.connect.connection import PgConnection
 from src.connect.minio import save_to_minio
 from src.jungle.schema.entity import ParseStatus, DocType
-from src.error.errors import RepeatedParseException, FileUrlException, UploadBosException
+from src.error.errors import RepeatedParseException, FileUrlException, UploadBosException, ScanPdfException
 
+from src.jungle.batching import map_documents
+from src.jungle.cache import get_result_cache, cache_key
 from src.jungle.convert import convert_single_pdf
 from src.jungle.logger import configure_logging
+from src.jungle.metrics import DocumentMetrics, stage
 from src.jungle.models import load_all_models
-from src.jungle.cleaners.ner import JiebaSeg, SpacyEngSeg, parse_doc_labels
+from src.jungle.settings import settings
+
+
+def page_range_options(file_data: Dict) -> Dict:
+    """
+    start_page and max_pages of a parse request, preview parses the first PREVIEW_PAGES pages
+    """
+    if file_data.get("preview", False):
+        return {"start_page": 0, "max_pages": settings.PREVIEW_PAGES}
+    start_page = file_data.get("start_page")
+    max_pages = file_data.get("max_pages")
+    return {
+        "start_page": int(start_page) if start_page is not None else None,
+        "max_pages": int(max_pages) if max_pages is not None else None,
+    }
 
 
 class FileParse:
     """
     FileParse
     """
-    def __init__(self):
+    def __init__(self, model_lst=None):
         """
-        init load all model
+        init load all model, or reuse model_lst loaded before (e.g. by the pre-fork parent)
         """
-        self.model_lst = load_all_models()
-        #self.zh_seg = JiebaSeg()
-        #self.en_seg = SpacyEngSeg()
+        self.model_lst = model_lst if model_lst is not None else load_all_models()
+        self.result_cache = get_result_cache()
+
+    @property
+    def zh_seg(self):
+        """jieba segmenter of the file name labels, the engine is shared by the process"""
+        from src.jungle.cleaners.ner import JiebaSeg
+        return JiebaSeg()
+
+    @property
+    def en_seg(self):
+        """spacy segmenter of the file name labels, the engine is shared by the process"""
+        from src.jungle.cleaners.ner import SpacyEngSeg
+        return SpacyEngSeg()
 
     def parse_files(self, file_datas: List[Dict]):
         """
-        parse files
+        parse files, with dynamic batching enabled the files are parsed concurrently and share model batches
+        """
+        return map_documents(self.parse_file_status, file_datas)
+
+    def parse_file_status(self, file_data: Dict) -> Dict:
         """
-        res = []
-        for file_data in file_datas:
-            labels = []
-            try:
-                labels = self.parse_file(file_data)
-                res.append({
-                    "file_id": file_data["file_id"],
-                    "type": file_data.get("type", ""),
-                    "file_name": file_data.get("file_name", ""),
-                    "file_type": file_data.get("file_type", ""),
-                    "kg_id": file_data.get("kg_id", ""),
-                    "catalog_id": file_data.get("catalog_id", ""),
-                    "account_id": file_data.get("account_id", ""),
-                    "user_id": file_data.get("user_id", ""),
-                    "parse_status": 2,
-                    "parse_fail": "",
-                    "label": labels
-                })
-
-            except RepeatedParseException as e:
-                logger.error(f"repeated parse, error: {e}")
-                logger.error(traceback.format_exc())
-                res.append({
-                    "file_id": file_data["file_id"],
-                    "type": file_data.get("type", ""),
-                    "file_name": file_data.get("file_name", ""),
-                    "file_type": file_data.get("file_type", ""),
-                    "kg_id": file_data.get("kg_id", ""),
-                    "catalog_id": file_data.get("catalog_id", ""),
-                    "account_id": file_data.get("account_id", ""),
-                    "user_id": file_data.get("user_id", ""),
-                    "parse_status": ParseStatus.PROCESSING,
-                    "parse_fail": "文档解析中，请勿重复提交解析。"
-                })
-
-            except FileUrlException as e:
-                logger.error(f"repeated parse, error: {e}")
-                logger.error(traceback.format_exc())
-                res.append({
-                    "file_id": file_data["file_id"],
-                    "type": file_data.get("type", ""),
-                    "file_name": file_data.get("file_name", ""),
-                    "file_type": file_data.get("file_type", ""),
-                    "kg_id": file_data.get("kg_id", ""),
-                    "catalog_id": file_data.get("catalog_id", ""),
-                    "account_id": file_data.get("account_id", ""),
-                    "user_id": file_data.get("user_id", ""),
-                    "parse_status": ParseStatus.FAILED,
-                    "parse_fail": "下载文件失败，请查看 fileurl 是否有效！"
-                })
-
-            except UploadBosException as e:
-                logger.error(f"repeated parse, error: {e}")
-                logger.error(traceback.format_exc())
-                res.append({
-                    "file_id": file_data["file_id"],
-                    "type": file_data.get("type", ""),
-                    "file_name": file_data.get("file_name", ""),
-                    "file_type": file_data.get("file_type", ""),
-                    "kg_id": file_data.get("kg_id", ""),
-                    "catalog_id": file_data.get("catalog_id", ""),
-                    "account_id": file_data.get("account_id", ""),
-                    "user_id": file_data.get("user_id", ""),
-                    "parse_status": ParseStatus.FAILED,
-                    "parse_fail": "抱歉，文档解析结果存储失败，我们正在加急处理，很抱歉影响您的体验！"
-                })
-
-            except Exception as e:
-                logger.error(f"parse file failed: {file_data}, error: {e}")
-                logger.error(traceback.format_exc())
-                res.append({
-                    "file_id": file_data["file_id"],
-                    "type": file_data.get("type", ""),
-                    "file_name": file_data.get("file_name", ""),
-                    "file_type": file_data.get("file_type", ""),
-                    "kg_id": file_data.get("kg_id", ""),
-                    "catalog_id": file_data.get("catalog_id", ""),
-                    "account_id": file_data.get("account_id", ""),
-                    "user_id": file_data.get("user_id", ""),
-                    "parse_status": ParseStatus.FAILED,
-                    "parse_fail": "PDF文件中包含了特殊的加密保护或非标准的对象结构，建议您查看文档后重新上传解析。"
-                })
-        return res
+        parse one file and return its parse status
+        """
+        labels = []
+        try:
+            labels = self.parse_file(file_data)
+            return {
+                "file_id": file_data["file_id"],
+                "type": file_data.get("type", ""),
+                "file_name": file_data.get("file_name", ""),
+                "file_type": file_data.get("file_type", ""),
+                "kg_id": file_data.get("kg_id", ""),
+                "catalog_id": file_data.get("catalog_id", ""),
+                "account_id": file_data.get("account_id", ""),
+                "user_id": file_data.get("user_id", ""),
+                "parse_status": 2,
+                "parse_fail": "",
+                "label": labels
+            }
+
+        except RepeatedParseException as e:
+            logger.error(f"repeated parse, error: {e}")
+            logger.error(traceback.format_exc())
+            return {
+                "file_id": file_data["file_id"],
+                "type": file_data.get("type", ""),
+                "file_name": file_data.get("file_name", ""),
+                "file_type": file_data.get("file_type", ""),
+                "kg_id": file_data.get("kg_id", ""),
+                "catalog_id": file_data.get("catalog_id", ""),
+                "account_id": file_data.get("account_id", ""),
+                "user_id": file_data.get("user_id", ""),
+                "parse_status": ParseStatus.PROCESSING,
+                "parse_fail": "文档解析中，请勿重复提交解析。"
+            }
+
+        except FileUrlException as e:
+            logger.error(f"repeated parse, error: {e}")
+            logger.error(traceback.format_exc())
+            return {
+                "file_id": file_data["file_id"],
+                "type": file_data.get("type", ""),
+                "file_name": file_data.get("file_name", ""),
+                "file_type": file_data.get("file_type", ""),
+                "kg_id": file_data.get("kg_id", ""),
+                "catalog_id": file_data.get("catalog_id", ""),
+                "account_id": file_data.get("account_id", ""),
+                "user_id": file_data.get("user_id", ""),
+                "parse_status": ParseStatus.FAILED,
+                "parse_fail": "下载文件失败，请查看 fileurl 是否有效！"
+            }
+
+        except UploadBosException as e:
+            logger.error(f"repeated parse, error: {e}")
+            logger.error(traceback.format_exc())
+            return {
+                "file_id": file_data["file_id"],
+                "type": file_data.get("type", ""),
+                "file_name": file_data.get("file_name", ""),
+                "file_type": file_data.get("file_type", ""),
+                "kg_id": file_data.get("kg_id", ""),
+                "catalog_id": file_data.get("catalog_id", ""),
+                "account_id": file_data.get("account_id", ""),
+                "user_id": file_data.get("user_id", ""),
+                "parse_status": ParseStatus.FAILED,
+                "parse_fail": "抱歉，文档解析结果存储失败，我们正在加急处理，很抱歉影响您的体验！"
+            }
+
+        except Exception as e:
+            logger.error(f"parse file failed: {file_data}, error: {e}")
+            logger.error(traceback.format_exc())
+            return {
+                "file_id": file_data["file_id"],
+                "type": file_data.get("type", ""),
+                "file_name": file_data.get("file_name", ""),
+                "file_type": file_data.get("file_type", ""),
+                "kg_id": file_data.get("kg_id", ""),
+                "catalog_id": file_data.get("catalog_id", ""),
+                "account_id": file_data.get("account_id", ""),
+                "user_id": file_data.get("user_id", ""),
+                "parse_status": ParseStatus.FAILED,
+                "parse_fail": "PDF文件中包含了特殊的加密保护或非标准的对象结构，建议您查看文档后重新上传解析。"
+            }
 
     def parse_pdf_http(self, file_data: Dict):
         """
@@ -138,13 +169,15 @@ class FileParse:
         """
 
         try:
-            json_tree, markdown, debug_images = self.parse_pdf(file_data)
+            metrics = DocumentMetrics()
+            json_tree, markdown, debug_images = self.parse_pdf(file_data, metrics=metrics)
             return {
                 "json_tree": json_tree,
                 "markdown": markdown,
                 "parse_status": 2,
                 "parse_fail": "",
-                "debug_images": debug_images}   
+                "debug_images": debug_images,
+                "metrics": metrics.to_dict()}   
         except FileUrlException as e:
             logger.error(f"file url error, error: {e}")
             logger.error(traceback.format_exc())
@@ -167,38 +200,26 @@ class FileParse:
             }
 
 
-    def parse_pdf(self, file_data: Dict):
+    def parse_pdf(self, file_data: Dict, progress=None, metrics: Optional[DocumentMetrics] = None):
         """
-        parse pdf
+        parse pdf, progress receives the per stage page counts of convert_single_pdf,
+        metrics the per stage times and counts. file_data may select the pages with start_page and max_pages,
+        or ask for a preview of the first pages
         """
-        
-        if file_data.get('url', ""):
-            byte_content = download(file_data["url"])
-            if not byte_content: 
-                logger.error(f"file url error, mq: {file_data}")
-                raise FileUrlException
-        elif file_data.get('file_content', ""):
-            pdf_stream = file_data['file_content']
-            if isinstance(pdf_stream, str):
-                byte_content = base64.b64decode(pdf_stream)
-        else:
-            raise FileUrlException
-
         debug_image = file_data.get("debug_image", False)
         if debug_image:
-            structure, language, knowledge_type, debug_images = convert_single_pdf(byte_content, 
-                                                                    self.model_lst,
-                                                                    debug=debug_image)
+            byte_content = self._pdf_bytes(file_data)
+            with (metrics or DocumentMetrics()).activate():
+                structure, language, knowledge_type, debug_images = convert_single_pdf(byte_content, 
+                                                                        self.model_lst,
+                                                                        debug=debug_image,
+                                                                        **page_range_options(file_data))
             json_tree =  structure.to_tree(filename=file_data.get("file_name", ""))
             markdown = structure.to_markdown()
             return json_tree, markdown, debug_images
         else:
-            structure, language, knowledge_type = convert_single_pdf(byte_content, 
-                                                                    self.model_lst,
-                                                                    debug=False)
-            json_tree =  structure.to_tree(filename=file_data.get("file_name", ""))
-            markdown = structure.to_markdown()
-            return json_tree, markdown, []
+            result = self.parse_pdf_result(file_data, progress=progress, metrics=metrics)
+            return result["json_tree"], result["markdown"], []
 
         # pdf_stream = file_data["file_content"]
         # if isinstance(pdf_stream, str):
@@ -209,6 +230,29 @@ class FileParse:
         # return json_tree, markdown
 
 
+    def parse_pdf_result(self, file_data: Dict, progress=None, metrics: Optional[DocumentMetrics] = None) -> Dict:
+        """
+        the convert result of the pdf of file_data, with language and knowledge type, see parse_pdf and convert
+        """
+        return self.convert(self._pdf_bytes(file_data), file_data.get("file_name", ""), progress=progress,
+                            metrics=metrics, **page_range_options(file_data))
+
+    @staticmethod
+    def _pdf_bytes(file_data: Dict) -> bytes:
+        """pdf bytes of file_data, downloaded from url or decoded from file_content"""
+        if file_data.get('url', ""):
+            byte_content = download(file_data["url"])
+            if not byte_content: 
+                logger.error(f"file url error, mq: {file_data}")
+                raise FileUrlException
+        elif file_data.get('file_content', ""):
+            pdf_stream = file_data['file_content']
+            if isinstance(pdf_stream, str):
+                byte_content = base64.b64decode(pdf_stream)
+        else:
+            raise FileUrlException
+        return byte_content
+
     def parse_file(self, file_data: Dict):
         """
         parse file
@@ -272,27 +316,38 @@ class FileParse:
             raise FileUrlException
 
         # common ocr parse
-        structure, language, knowledge_type = convert_single_pdf(byte_content, self.model_lst)
+        result = self.convert(byte_content, file_data["file_name"], **page_range_options(file_data))
+        return self.store_result(file_data, result)
+
+    def store_result(self, file_data: Dict, result: Dict) -> List:
+        """
+        save the convert result of file_data to minio, parse the labels of its file name and mark it parsed.
+        the sync parse_file and the async parse jobs both finish here, returns the labels
+        """
+        language = result["language"]
+        knowledge_type = result["knowledge_type"]
         
-        markdown = structure.to_markdown().encode('utf-8')
+        markdown = result["markdown"].encode('utf-8')
         
         if len(markdown) < 6:
             raise ScanPdfException
 
         try:
 
-            json_tree_byte =  json.dumps(structure.to_tree(filename=file_data["file_name"])).encode('utf-8')
+            json_tree_byte =  json.dumps(result["json_tree"]).encode('utf-8')
             json_tree_url = save_to_minio(json_tree_byte, 
-                            file_data["user_id"],
-                                file_data["account_id"],
+                            file_data.get("user_id", ""),
+                                file_data.get("account_id", ""),
                             f"{file_data['file_id']}_tree.json")
             #mock a url , 
             markdown_url = save_to_minio(markdown, 
-                                        file_data["user_id"], 
-                                        file_data["account_id"], 
+                                        file_data.get("user_id", ""), 
+                                        file_data.get("account_id", ""), 
                                         f"{file_data['file_id']}_markdown.md")
 
-            labels, label_map = parse_doc_labels(file_data["file_name"], zh_seg=self.zh_seg, en_seg=self.en_seg)
+            # spacy and jieba are only imported when labels are parsed
+            from src.jungle.cleaners.ner import parse_doc_labels
+            labels, label_map = parse_doc_labels(file_data.get("file_name", ""), zh_seg=self.zh_seg, en_seg=self.en_seg)
 
 
         except Exception as e:
@@ -332,9 +387,9 @@ class FileParse:
                 sql, 
                 [file_data["file_id"], 
                 file_data.get("kg_id", ""),
-                file_data["file_type"],
-                file_data["file_name"], 
-                file_data["url"], 
+                file_data.get("file_type", "pdf"),
+                file_data.get("file_name", ""), 
+                file_data.get("url", ""), 
                 language,
                 knowledge_type,
                 ParseStatus.SUCCESS,
@@ -349,6 +404,41 @@ class FileParse:
         return labels
     
     #def parse_file_http(self, file_data: Dict)
+
+    def convert(self, byte_content: bytes, file_name: str, progress=None,
+                metrics: Optional[DocumentMetrics] = None, start_page: Optional[int] = None,
+                max_pages: Optional[int] = None) -> Dict:
+        """
+        convert pdf bytes to markdown and json tree, only max_pages pages from start_page if given.
+        results are cached as json by file content, model fingerprint and page range.
+        the per stage times and counts of this call are returned under "metrics"
+        """
+        if metrics is None:
+            metrics = DocumentMetrics()
+        with metrics.activate():
+            key = None
+            if self.result_cache is not None:
+                with stage("result_cache"):
+                    key = cache_key(byte_content, start_page, max_pages)
+                    result = self.result_cache.get(key)
+                if result is not None:
+                    logger.info(f"result cache hit: {key}")
+                    # the json tree is the only output which depends on the file name
+                    result["json_tree"] = dict(result["json_tree"], file_name=file_name)
+                    return dict(result, metrics=metrics.to_dict())
+
+            structure, language, knowledge_type = convert_single_pdf(byte_content, self.model_lst, progress=progress,
+                                                                     start_page=start_page, max_pages=max_pages)
+            with stage("output"):
+                result = {
+                    "language": language,
+                    "knowledge_type": knowledge_type,
+                    "json_tree": structure.to_tree(filename=file_name),
+                    "markdown": structure.to_markdown(),
+                }
+            if key is not None:
+                self.result_cache.put(key, result)
+        return dict(result, metrics=metrics.to_dict())
     
     @classmethod
     def _get_object_name(cls, conn: PgConnection, file_id: str):
@@ -12,12 +12,15 @@ from loguru import logger
 
 
 from src.jungle.schema.entity import FragmentStatus
+from src.jungle.batching import map_documents
+from src.jungle.metrics import REGISTRY, start_metrics_server
+from src.jungle.settings import settings
 
 from src.jungle.convert import convert_single_pdf
 from src.jungle.logger import configure_logging
 from src.jungle.models import load_all_models
-from src.jungle.cleaners.ner import JiebaSeg, SpacyEngSeg, parse_doc_labels
 from src.file_parse import FileParse
+from src.parse_jobs import start_job_queue, get_job_queue
 
 
 class HTTPResponse(object):
@@ -25,12 +28,14 @@ class HTTPResponse(object):
     http response
     """
 
-    def __init__(self):
+    def __init__(self, pdf_parser=None):
         
         # self.model_lst = load_all_models()
         # self.zh_seg = JiebaSeg()
         # self.en_seg = SpacyEngSeg()
-        self.pdf_parser = FileParse()
+        self.pdf_parser = pdf_parser if pdf_parser is not None else FileParse()
+        if settings.METRICS_PORT:
+            start_metrics_server(settings.METRICS_PORT)
 
     def _parse_pdf(self, book_data):
         """
@@ -46,41 +51,78 @@ class HTTPResponse(object):
         
         return parsed_data
 
-    def get_file_parse_response(self, query_data):
+    def start_jobs(self):
+        """
+        start the process wide parse job queue for submit_file_parse, called once by the server
+        """
+        return start_job_queue(self.pdf_parser)
+
+    def submit_file_parse(self, query_data):
         """
+        queue the files for parsing and return at once, poll get_file_parse_job for the result
         :params query_data: dict
         """
-        books_status = []
-        books = query_data.get("files", [])
-        for book_data in books:
-            info = {
-                "type": book_data["type"],
-                "file_id": book_data["file_id"],
-                "parse_status": book_data.get("parse_status", 0),
-                "parse_fail": "",
-                "label": [],
-                "abstract": "",
-                "abstract_ch": "",
-                "conclusion": "",
-                "conclusion_ch": "",
-                "drug": [],
-                "disease": [],
-                "doc_type": [],
-                "department": []
-            }
-            
+        jobs = []
+        for book_data in query_data.get("files", []):
             try:
-                parse_data = self._parse_pdf(book_data)
-                info["parse_status"] = parse_data["parse_status"]
-                info["parse_fail"] = parse_data["parse_fail"]
-                info["label"] = parse_data["label"]
-                for k, v in parse_data.get("label_map", {}).items():
-                    info[k] = list(v)
-                logger.info(f"[File-parse] status: {json.dumps(info, ensure_ascii=False)}")
+                job_id = get_job_queue().submit(book_data)
+                jobs.append({"file_id": job_id, "parse_status": 0, "parse_fail": ""})
             except Exception as e:
-                info["parse_status"] = 3 # 0未解析，2成功，3失败
-                info["parse_fail"] = f"parse error: {str(e)}"
-                logger.warning(f"[File-parse] status: {json.dumps(info, ensure_ascii=False)}")
-            
-            books_status.append(info)
-        return books_status
+                jobs.append({"file_id": book_data.get("file_id", ""), "parse_status": 3,
+                             "parse_fail": f"submit error: {str(e)}"})
+                logger.warning(f"[File-parse] submit failed: {e}")
+        return jobs
+
+    def get_file_parse_job(self, job_id):
+        """
+        status, per stage progress and result urls of a submitted file
+        """
+        return get_job_queue().get(job_id)
+
+    def get_metrics(self):
+        """
+        per stage times, counts and batch sizes of this process, in the prometheus text format
+        """
+        return REGISTRY.prometheus_text()
+
+    def get_file_parse_response(self, query_data):
+        """
+        :params query_data: dict
+        """
+        books = query_data.get("files", [])
+        return map_documents(self._book_status, books)
+
+    def _book_status(self, book_data):
+        """
+        parse one book and build its status
+        :params book_data: dict
+        """
+        info = {
+            "type": book_data["type"],
+            "file_id": book_data["file_id"],
+            "parse_status": book_data.get("parse_status", 0),
+            "parse_fail": "",
+            "label": [],
+            "abstract": "",
+            "abstract_ch": "",
+            "conclusion": "",
+            "conclusion_ch": "",
+            "drug": [],
+            "disease": [],
+            "doc_type": [],
+            "department": []
+        }
+        
+        try:
+            parse_data = self._parse_pdf(book_data)
+            info["parse_status"] = parse_data["parse_status"]
+            info["parse_fail"] = parse_data["parse_fail"]
+            info["label"] = parse_data["label"]
+            for k, v in parse_data.get("label_map", {}).items():
+                info[k] = list(v)
+            logger.info(f"[File-parse] status: {json.dumps(info, ensure_ascii=False)}")
+        except Exception as e:
+            info["parse_status"] = 3 # 0未解析，2成功，3失败
+            info["parse_fail"] = f"parse error: {str(e)}"
+            logger.warning(f"[File-parse] status: {json.dumps(info, ensure_ascii=False)}")
+        return info
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+dynamic batching across documents parsed at the same time.
+the first model call of a kind becomes the leader, it waits a short time for the calls of the other
+in-flight documents, runs them as one merged call and scatters the results back to every caller.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, Optional, Hashable
+
+from loguru import logger
+
+from src.jungle.metrics import record_batches
+from src.jungle.settings import settings
+
+
+class _Request(object):
+    """
+    items of one model call, waiting to be merged into a batch
+    """
+    def __init__(self, item_lists: List[list]):
+        self.item_lists = item_lists
+        self.size = len(item_lists[0])
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+        self.batch_items = self.size
+
+
+class BatchScheduler(object):
+    """
+    merge model calls of concurrent documents into shared batches
+    """
+    def __init__(self, max_wait: float):
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._leading = set()
+        self._active_documents = 0
+
+    @contextmanager
+    def document(self):
+        """
+        mark a document in flight, a leader stops waiting once every in-flight document has submitted
+        """
+        with self._cond:
+            self._active_documents += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active_documents -= 1
+                self._cond.notify_all()
+
+    def run(self, key: Hashable, func: Callable, item_lists: List[list], batch_size: int) -> list:
+        """
+        run func(*item_lists) merged with the calls of other documents having the same key,
+        func must return one result per item
+        """
+        request = _Request(item_lists)
+        with self._cond:
+            self._pending.setdefault(key, []).append(request)
+            self._cond.notify_all()
+            leader = key not in self._leading
+            if leader:
+                self._leading.add(key)
+                deadline = time.monotonic() + self.max_wait
+                while True:
+                    requests = self._pending[key]
+                    if sum(r.size for r in requests) >= batch_size or len(requests) >= self._active_documents:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                requests = self._pending.pop(key)
+                self._leading.discard(key)
+
+        if leader:
+            self._run_batch(key, func, requests, batch_size)
+        request.done.wait()
+        if request.exception is not None:
+            raise request.exception
+        # the registry counts the merged batch once, in _run_batch
+        record_batches(key[0], request.batch_items, batch_size, registry=False)
+        return request.result
+
+    @staticmethod
+    def _run_batch(key: Hashable, func: Callable, requests: List[_Request], batch_size: int):
+        """run the merged call and scatter the results"""
+        try:
+            merged = [sum((r.item_lists[i] for r in requests), []) for i in range(len(requests[0].item_lists))]
+            for r in requests:
+                r.batch_items = len(merged[0])
+            record_batches(key[0], len(merged[0]), batch_size, document=False)
+            if len(requests) > 1:
+                logger.info(f"dynamic batch {key[0]}: {len(requests)} calls, {len(merged[0])} items")
+            results = func(*merged)
+            start = 0
+            for r in requests:
+                r.result = results[start:start + r.size]
+                start += r.size
+        except Exception as e:
+            for r in requests:
+                r.exception = e
+        finally:
+            for r in requests:
+                r.done.set()
+
+
+@lru_cache(maxsize=1)
+def get_batch_scheduler() -> Optional[BatchScheduler]:
+    """
+    the process wide scheduler, None if dynamic batching is disabled
+    """
+    if not settings.DYNAMIC_BATCHING:
+        return None
+    return BatchScheduler(settings.BATCHING_MAX_WAIT)
+
+
+def run_batched(key: Hashable, func: Callable, item_lists: List[list], batch_size: int) -> list:
+    """
+    call func(*item_lists), merged with concurrent documents when dynamic batching is enabled.
+    key identifies calls which can be merged, e.g. the stage name and the model id,
+    the batch sizes used are recorded under the stage name
+    """
+    scheduler = get_batch_scheduler()
+    if scheduler is None or len(item_lists[0]) == 0:
+        record_batches(key[0], len(item_lists[0]), batch_size)
+        return func(*item_lists)
+    return scheduler.run(key, func, [list(items) for items in item_lists], batch_size)
+
+
+def document_in_flight():
+    """
+    context marking a document in flight for the batch scheduler, does nothing when dynamic batching is disabled
+    """
+    scheduler = get_batch_scheduler()
+    if scheduler is None:
+        return nullcontext()
+    return scheduler.document()
+
+
+def map_documents(func: Callable, items: list) -> list:
+    """
+    apply func to every document, concurrently when dynamic batching is enabled so their model calls share batches
+    """
+    scheduler = get_batch_scheduler()
+    if scheduler is None or len(items) <= 1:
+        return [func(item) for item in items]
+
+    def run(item):
+        """run one document"""
+        with document_in_flight():
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=settings.BATCHING_MAX_DOCUMENTS) as executor:
+        return list(executor.map(run, items))
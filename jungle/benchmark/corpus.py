@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+deterministic benchmark corpus, synthesised offline with fitz.
+the same seed gives byte identical files, so timings of different runs are comparable.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import os
+import random
+from typing import Dict, List, Optional
+
+import fitz
+
+
+# bump when the documents change, so stale corpus files are not reused
+CORPUS_VERSION = 1
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 56
+
+WORDS = (
+    "the patient treatment clinical study results of and in with for dose therapy group control "
+    "randomized trial outcome risk analysis data were was significant increase decrease compared "
+    "between after before primary secondary endpoint follow up months year years median mean "
+    "response rate survival adverse events reported baseline cohort"
+).split()
+
+CJK_CHARS = (
+    "患者治疗临床研究结果的和在与对于剂量疗法组对照随机试验风险分析数据显著增加减少比较之间"
+    "前后主要次要终点随访月年中位平均反应率生存不良事件报告基线队列指南推荐意见证据等级专家共识"
+)
+
+
+def _sentence(rng: random.Random, cjk: bool = False) -> str:
+    """one pseudo sentence"""
+    if cjk:
+        return "".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(15, 40))) + "。"
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, cjk: bool = False) -> str:
+    """one pseudo paragraph"""
+    separator = "" if cjk else " "
+    return separator.join(_sentence(rng, cjk) for _ in range(rng.randint(3, 6)))
+
+
+def _fill_columns(page, rng: random.Random, title: str, columns: int, cjk: bool = False):
+    """a heading and paragraphs flowing through columns"""
+    fontname = "china-s" if cjk else "helv"
+    page.insert_text((MARGIN, MARGIN + 14), title, fontsize=16, fontname=fontname)
+    gap = 20
+    column_width = (PAGE_WIDTH - 2 * MARGIN - gap * (columns - 1)) / columns
+    for column in range(columns):
+        x0 = MARGIN + column * (column_width + gap)
+        y0 = MARGIN + 36
+        while y0 < PAGE_HEIGHT - MARGIN - 40:
+            rect = fitz.Rect(x0, y0, x0 + column_width, PAGE_HEIGHT - MARGIN)
+            # insert_textbox returns the height left, negative if the text did not fit
+            left = page.insert_textbox(rect, _paragraph(rng, cjk), fontsize=10, fontname=fontname)
+            if left < 0:
+                break
+            y0 = rect.y1 - left + 8
+
+
+def _header_footer(page, pnum: int, title: str):
+    """running header and page number, for the header footer filter"""
+    page.insert_text((MARGIN, 30), title, fontsize=8, fontname="helv")
+    page.insert_text((PAGE_WIDTH / 2, PAGE_HEIGHT - 24), str(pnum + 1), fontsize=8, fontname="helv")
+
+
+def _table(page, rng: random.Random, top: float, rows: int, cols: int) -> float:
+    """a ruled table, returns its bottom"""
+    cell_width = (PAGE_WIDTH - 2 * MARGIN) / cols
+    cell_height = 18
+    for row in range(rows + 1):
+        y = top + row * cell_height
+        page.draw_line((MARGIN, y), (PAGE_WIDTH - MARGIN, y), width=0.5)
+    for col in range(cols + 1):
+        x = MARGIN + col * cell_width
+        page.draw_line((x, top), (x, top + rows * cell_height), width=0.5)
+    for row in range(rows):
+        for col in range(cols):
+            if row == 0:
+                text = rng.choice(WORDS).capitalize()
+            else:
+                text = f"{rng.uniform(0, 100):.1f}"
+            page.insert_text((MARGIN + col * cell_width + 4, top + row * cell_height + 13), text,
+                             fontsize=9, fontname="helv")
+    return top + rows * cell_height
+
+
+def text_pdf(num_pages: int, columns: int = 1, cjk: bool = False, seed: int = 0, toc: bool = False) -> bytes:
+    """
+    born digital text pages in one or more columns, toc adds a chapter outline as books have
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    outline = []
+    for pnum in range(num_pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        if cjk:
+            title = f"第{pnum + 1}节 " + "".join(rng.choice(CJK_CHARS) for _ in range(6))
+        else:
+            title = f"{pnum // 10 + 1}.{pnum % 10 + 1} " + " ".join(rng.choice(WORDS) for _ in range(4)).title()
+        _header_footer(page, pnum, "Benchmark Corpus")
+        _fill_columns(page, rng, title, columns, cjk)
+        if toc and pnum % 10 == 0:
+            outline.append([1, f"Chapter {pnum // 10 + 1}", pnum + 1])
+    if outline:
+        doc.set_toc(outline)
+    return _to_bytes(doc)
+
+
+def table_pdf(num_pages: int, seed: int = 0) -> bytes:
+    """pages with a paragraph and two ruled tables each"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for pnum in range(num_pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        _header_footer(page, pnum, "Benchmark Tables")
+        page.insert_text((MARGIN, MARGIN + 14), f"Table {pnum + 1}", fontsize=14, fontname="helv")
+        page.insert_textbox(fitz.Rect(MARGIN, MARGIN + 30, PAGE_WIDTH - MARGIN, MARGIN + 150),
+                            _paragraph(rng), fontsize=10, fontname="helv")
+        bottom = _table(page, rng, MARGIN + 170, rows=rng.randint(6, 12), cols=rng.randint(3, 6))
+        _table(page, rng, bottom + 40, rows=rng.randint(6, 12), cols=rng.randint(3, 6))
+    return _to_bytes(doc)
+
+
+def scanned_pdf(num_pages: int, seed: int = 0, dpi: int = 150) -> bytes:
+    """
+    text pages rendered to images, without a text layer, so every page goes through OCR
+    """
+    source = fitz.open(stream=text_pdf(num_pages, seed=seed), filetype="pdf")
+    doc = fitz.open()
+    for source_page in source:
+        pixmap = source_page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_image(page.rect, pixmap=pixmap)
+    source.close()
+    return _to_bytes(doc)
+
+
+def _to_bytes(doc) -> bytes:
+    """save without dates or random ids, so the bytes only depend on the content"""
+    doc.set_metadata({})
+    data = doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+    return data
+
+
+# name -> (builder, arguments)
+CORPUS = {
+    "single_column": (text_pdf, {"num_pages": 20, "columns": 1, "seed": 1}),
+    "two_column": (text_pdf, {"num_pages": 20, "columns": 2, "seed": 2}),
+    "tables": (table_pdf, {"num_pages": 10, "seed": 3}),
+    "scanned": (scanned_pdf, {"num_pages": 5, "seed": 4}),
+    "cjk": (text_pdf, {"num_pages": 20, "cjk": True, "seed": 5}),
+    "book": (text_pdf, {"num_pages": 500, "columns": 1, "seed": 6, "toc": True}),
+}
+
+
+def build_corpus(out_dir: str, names: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    write the corpus documents to out_dir, existing files are reused, returns name -> path
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name in names or list(CORPUS):
+        builder, kwargs = CORPUS[name]
+        path = os.path.join(out_dir, f"{name}_v{CORPUS_VERSION}.pdf")
+        if not os.path.exists(path):
+            data = builder(**kwargs)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        paths[name] = path
+    return paths
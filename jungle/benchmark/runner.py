@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+end to end and per stage throughput benchmarks, and the comparison with a stored baseline.
+results are nested dicts of pages/s, latency percentiles and the memory of the runs, saved as json.
+the peak rss of a run is measured from its start, the peaks of the process and of its live children,
+the pdftext and render pool workers, are reset before every run and summed after it.
+rss_delta_mb is how far the run went above the rss it started with. the memory needs linux /proc,
+elsewhere it is None and not compared. a worker which exits during a run is left out of its peak.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import os
+import json
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pypdfium2 as pdfium
+from loguru import logger
+
+from src.jungle.convert import convert_single_pdf
+from src.jungle.metrics import DocumentMetrics
+from src.jungle.pdf.images import render_image
+from src.jungle.settings import settings
+from src.jungle.utils import font_black_list, remove_watermark
+from src.pdftext.extraction import dictionary_output
+
+
+# metrics where a higher value is better, all others are better lower
+HIGHER_IS_BETTER = {"pages_per_sec"}
+# metrics compared with the baseline, the others are informational
+COMPARED = {"pages_per_sec", "latency_p50", "latency_p95", "peak_rss_mb", "rss_delta_mb"}
+
+
+def _status_mb(field: str, pid: str = "self") -> Optional[float]:
+    """a memory field of /proc/<pid>/status in MB, None where /proc or the process is missing"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def child_pids() -> List[str]:
+    """pids of the live child processes of this process, e.g. the pdftext and render pool workers"""
+    parent = str(os.getpid())
+    pids = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name is in parentheses and may hold spaces, the parent pid is the second field after it
+        if stat.rsplit(")", 1)[-1].split()[1] == parent:
+            pids.append(entry)
+    return pids
+
+
+def _total_mb(field: str) -> Optional[float]:
+    """a memory field summed over this process and its children, None without /proc"""
+    total = _status_mb(field)
+    if total is None:
+        return None
+    for pid in child_pids():
+        total += _status_mb(field, pid) or 0.0
+    return total
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    peak resident memory of this process plus the peaks of its live children since the last reset_peak_rss.
+    None without /proc, ru_maxrss can not be reset between runs
+    """
+    return _total_mb("VmHWM")
+
+
+def current_rss_mb() -> Optional[float]:
+    """resident memory of this process and its live children now, None without /proc"""
+    return _total_mb("VmRSS")
+
+
+def reset_peak_rss():
+    """start the peak of peak_rss_mb again from the current rss of this process and its children, linux only"""
+    for pid in ["self"] + child_pids():
+        try:
+            with open(f"/proc/{pid}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def measure_run(func: Callable, *args) -> Tuple[float, Optional[float], Optional[float]]:
+    """(latency, peak rss, rss delta) of one call of func in secs and MB, the memory is None without /proc"""
+    rss = current_rss_mb()
+    reset_peak_rss()
+    start = time.perf_counter()
+    func(*args)
+    latency = time.perf_counter() - start
+    peak = peak_rss_mb()
+    if peak is None or rss is None:
+        return latency, None, None
+    return latency, peak, max(peak - rss, 0.0)
+
+
+def summarize_memory(peaks: List[Optional[float]], deltas: List[Optional[float]]) -> Dict:
+    """the highest peak rss and rss delta of a list of runs, None where the memory was not measured"""
+    peaks = [peak for peak in peaks if peak is not None]
+    deltas = [delta for delta in deltas if delta is not None]
+    return {
+        "peak_rss_mb": round(max(peaks), 1) if peaks else None,
+        "rss_delta_mb": round(max(deltas), 1) if deltas else None,
+    }
+
+
+def num_pages(data: bytes) -> int:
+    """page count of a pdf"""
+    doc = pdfium.PdfDocument(data)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def summarize(latencies: List[float], pages: int) -> Dict:
+    """throughput and latency percentiles of a list of document latencies"""
+    total = sum(latencies)
+    return {
+        "documents": len(latencies),
+        "pages": pages,
+        "pages_per_sec": round(pages / total, 3) if total else 0.0,
+        "latency_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_p95": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def run_full(paths: Dict[str, str], model_lst: List, repeat: int = 1) -> Dict:
+    """
+    convert every document repeat times through convert_single_pdf,
+    per document and overall throughput, with the wall time of every stage
+    """
+    results = {}
+    all_latencies = []
+    all_peaks = []
+    all_deltas = []
+    all_pages = 0
+    stage_walls = defaultdict(float)
+    for name, path in paths.items():
+        with open(path, "rb") as f:
+            data = f.read()
+        pages = num_pages(data)
+        latencies = []
+        peaks = []
+        deltas = []
+        for _ in range(repeat):
+            metrics = DocumentMetrics()
+            with metrics.activate():
+                latency, peak, delta = measure_run(convert_single_pdf, data, model_lst)
+            latencies.append(latency)
+            peaks.append(peak)
+            deltas.append(delta)
+            for stage_name, stage_metrics in metrics.to_dict().items():
+                stage_walls[stage_name] += stage_metrics["wall"]
+        results[name] = summarize(latencies, pages * repeat)
+        results[name].update(summarize_memory(peaks, deltas))
+        logger.info(f"[benchmark] {name}: {results[name]}")
+        all_latencies.extend(latencies)
+        all_peaks.extend(peaks)
+        all_deltas.extend(deltas)
+        all_pages += pages * repeat
+
+    results["all"] = summarize(all_latencies, all_pages)
+    results["all"].update(summarize_memory(all_peaks, all_deltas))
+    results["all"]["stage_wall"] = {name: round(wall, 3) for name, wall in sorted(stage_walls.items())}
+    return results
+
+
+def _render(data: bytes, doc):
+    """render every page"""
+    for page_idx in range(len(doc)):
+        render_image(doc[page_idx], dpi=settings.IMAGE_DPI)
+
+
+def _pdftext(data: bytes, doc):
+    """pdftext extraction of every page"""
+    dictionary_output(data, keep_chars=True, workers=settings.PDFTEXT_POOL_WORKERS, diagnostics=True,
+                      font_black_list=font_black_list)
+
+
+def _watermark(data: bytes, doc):
+    """watermark removal"""
+    remove_watermark(data)
+
+
+# stage name -> func(pdf bytes, pdfium document), the stages which run without models
+MICRO_BENCHMARKS: Dict[str, Callable] = {
+    "watermark": _watermark,
+    "pdftext": _pdftext,
+    "render": _render,
+}
+
+
+def run_micro(paths: Dict[str, str], repeat: int = 1) -> Dict:
+    """
+    time the model free stages on their own, pages/s, latency and memory per stage and document
+    """
+    results = {}
+    for stage_name, func in MICRO_BENCHMARKS.items():
+        results[stage_name] = {}
+        for name, path in paths.items():
+            with open(path, "rb") as f:
+                data = f.read()
+            doc = pdfium.PdfDocument(data)
+            latencies = []
+            peaks = []
+            deltas = []
+            for _ in range(repeat):
+                latency, peak, delta = measure_run(func, data, doc)
+                latencies.append(latency)
+                peaks.append(peak)
+                deltas.append(delta)
+            results[stage_name][name] = summarize(latencies, len(doc) * repeat)
+            results[stage_name][name].update(summarize_memory(peaks, deltas))
+            doc.close()
+        logger.info(f"[benchmark] {stage_name}: {results[stage_name]}")
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.1, path: str = "") -> List[str]:
+    """
+    regressions of results against baseline, a metric regresses when it is worse by more than tolerance.
+    metrics missing from either side are skipped
+    """
+    regressions = []
+    for key, base_value in baseline.items():
+        if key not in results:
+            continue
+        value = results[key]
+        name = f"{path}/{key}" if path else key
+        if isinstance(base_value, dict) and isinstance(value, dict):
+            regressions.extend(compare(value, base_value, tolerance, name))
+            continue
+        if key not in COMPARED or not base_value or value is None:
+            continue
+        if key in HIGHER_IS_BETTER:
+            worse = value < base_value * (1 - tolerance)
+        else:
+            worse = value > base_value * (1 + tolerance)
+        if worse:
+            regressions.append(f"{name}: {value} vs baseline {base_value}")
+    return regressions
+
+
+def load_json(path: str) -> Dict:
+    """load a results or baseline file"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(results: Dict, path: str):
+    """save results, e.g. as the new baseline"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+startup profile: import time of the service modules per library, from python -X importtime
+in a fresh interpreter, and the time to load the models.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import os
+import re
+import sys
+import time
+import subprocess
+from collections import defaultdict
+from typing import Dict, List
+
+# import time:       self [us] |  cumulative | imported package
+IMPORT_TIME_LINE = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+
+def parse_import_times(stderr: str) -> List[Dict]:
+    """the lines of -X importtime, as module, self and cumulative seconds and nesting depth"""
+    modules = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        modules.append({
+            "module": module,
+            "self": int(self_us) / 1e6,
+            "cumulative": int(cumulative_us) / 1e6,
+            "depth": (len(indent) - 1) // 2,
+        })
+    return modules
+
+
+def import_profile(module: str, top: int = 20) -> Dict:
+    """
+    import module in a fresh interpreter, the total import time, the time spent in every
+    library (the own time of its modules) and the slowest top level imports
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../..")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True, env=env)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {process.stderr.splitlines()[-1:]}")
+
+    modules = parse_import_times(process.stderr)
+    libraries = defaultdict(float)
+    for entry in modules:
+        libraries[entry["module"].split(".")[0]] += entry["self"]
+    top_level = sorted((entry for entry in modules if entry["depth"] == 0),
+                       key=lambda entry: entry["cumulative"], reverse=True)
+    return {
+        "module": module,
+        "wall_seconds": round(wall, 3),
+        "import_seconds": round(sum(entry["self"] for entry in modules), 3),
+        "libraries": {name: round(seconds, 3) for name, seconds in
+                      sorted(libraries.items(), key=lambda item: item[1], reverse=True)[:top]},
+        "top_level": {entry["module"]: round(entry["cumulative"], 3) for entry in top_level[:top]},
+    }
+
+
+def model_profile(lazy: bool) -> Dict:
+    """
+    seconds until load_all_models returns, eager loads every checkpoint concurrently,
+    lazy only creates the registry and starts the preloads in the background
+    """
+    from src.jungle.models import load_all_models
+
+    start = time.perf_counter()
+    load_all_models(lazy=lazy)
+    return {"lazy": lazy, "load_seconds": round(time.perf_counter() - start, 3)}
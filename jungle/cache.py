@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+content addressed parse result cache.
+the key is the sha256 of the file bytes plus a fingerprint of the model checkpoints
+and the config that changes the parse result, so a new checkpoint or config never hits old results.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from datetime import datetime
+from typing import Optional, Dict
+
+from loguru import logger
+
+import src.config_util as cfg
+from src.jungle.settings import settings
+
+
+# bump when the cached payload or the parse output changes without a checkpoint or config change
+CACHE_VERSION = 3
+_SUFFIX = ".json"
+_CHUNK_SIZE = 1 << 20
+
+PARSE_RESULT_CACHE_DDL = """
+CREATE TABLE IF NOT EXISTS parse_result_cache (
+    cache_key varchar PRIMARY KEY,
+    result text NOT NULL,
+    update_time timestamp
+)
+"""
+
+
+def _file_digest(path: str) -> str:
+    """sha256 of the file content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _path_fingerprint(path: str) -> list:
+    """
+    relative name, size and content hash of a checkpoint file, or of every file under a checkpoint directory.
+    mtimes are left out, so redeploying the same weights keeps the cache
+    """
+    if os.path.isfile(path):
+        return [(os.path.basename(path), os.path.getsize(path), _file_digest(path))]
+
+    items = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            items.append((os.path.relpath(file_path, path), os.path.getsize(file_path), _file_digest(file_path)))
+    return sorted(items)
+
+
+@lru_cache(maxsize=1)
+def model_fingerprint() -> str:
+    """
+    fingerprint of the model checkpoints and the config which change the parse result.
+    the checkpoints are hashed once per process
+    """
+    checkpoints = [
+        cfg.CPU_LAYOUT_MODEL_PATH if cfg.DEVICE == "cpu" else cfg.GPU_LAYOUT_MODEL_PATH,
+        cfg.READING_ORDER_MODEL_PATH,
+        cfg.OCR_MODEL_PATH,
+        cfg.LINE_DETECTION_MODEL_PATH,
+        cfg.PDF_EXTRACTION_MODEL,
+    ]
+    if cfg.SHOULD_PARSE_TABLE:
+        checkpoints.append(cfg.TABLE_MODEL_PATH)
+
+    config = {
+        "version": CACHE_VERSION,
+        "device": cfg.DEVICE,
+        "should_parse_table": cfg.SHOULD_PARSE_TABLE,
+        "should_match_table_to_para": cfg.SHOULD_MATCH_TABLE_TO_PARA,
+        "image_dpi": settings.IMAGE_DPI,
+        "detector_dpi": settings.SURYA_DETECTOR_DPI,
+        "ocr_dpi": settings.SURYA_OCR_DPI,
+        "layout_dpi": settings.SURYA_LAYOUT_DPI,
+        "order_dpi": settings.SURYA_ORDER_DPI,
+        "ocr_engine": settings.OCR_ENGINE,
+        "ocr_all_pages": settings.OCR_ALL_PAGES,
+        "ocr_coverage_check": settings.OCR_COVERAGE_CHECK,
+        "bad_span_types": settings.BAD_SPAN_TYPES,
+        "checkpoints": [_path_fingerprint(path) for path in checkpoints],
+    }
+    return hashlib.sha256(repr(config).encode("utf-8")).hexdigest()
+
+
+def cache_key(byte_content: bytes, start_page: Optional[int] = None, max_pages: Optional[int] = None) -> str:
+    """
+    cache key of a file, sha256 of its bytes and the model fingerprint, and the pages parsed if not all
+    """
+    key = f"{hashlib.sha256(byte_content).hexdigest()}_{model_fingerprint()[:16]}"
+    if start_page or max_pages:
+        key = f"{key}_{start_page or 0}_{max_pages or 0}"
+    return key
+
+
+class ResultCache(ABC):
+    """
+    parse result cache interface, values are json serializable dicts
+    """
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict]:
+        """get cached result, None on miss"""
+
+    @abstractmethod
+    def put(self, key: str, value: Dict):
+        """store result"""
+
+
+class DiskResultCache(ResultCache):
+    """
+    local disk cache, one json file per key, least recently used files are evicted above max_bytes
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # size of the cache folder as of the last scan plus what this process wrote since, None before the first scan
+        self._total_bytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        """file path of key"""
+        return os.path.join(self.cache_dir, key + _SUFFIX)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """get cached result, a hit refreshes the mtime used for lru eviction"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"drop broken cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def put(self, key: str, value: Dict):
+        """write to a temp file and rename, so readers never see a partial entry"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            path = self._path(key)
+            try:
+                # an overwritten entry no longer counts
+                size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size
+            scan = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if scan:
+            self.evict()
+
+    def evict(self):
+        """remove least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.name.endswith(_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+            self._total_bytes = total
+
+    @staticmethod
+    def _remove(path: str):
+        """remove file if it still exists"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class PgResultCache(ResultCache):
+    """
+    cache shared by all servers, stored as json text in the table parse_result_cache,
+    which is created on first use, see PARSE_RESULT_CACHE_DDL
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    def _ensure_table(self):
+        """create the cache table once per process"""
+        from src import connect
+
+        with self._lock:
+            if self._table_ready:
+                return
+            with connect.conn_pool as conn:
+                conn.execute(PARSE_RESULT_CACHE_DDL)
+            self._table_ready = True
+
+    def get(self, key: str) -> Optional[Dict]:
+        """get cached result"""
+        from src import connect
+
+        self._ensure_table()
+        with connect.conn_pool as conn:
+            r = conn.fetchone("SELECT result FROM parse_result_cache WHERE cache_key=%s", [key])
+        if r:
+            return json.loads(r.result)
+        return None
+
+    def put(self, key: str, value: Dict):
+        """store result"""
+        from src import connect
+
+        self._ensure_table()
+        sql = """
+        INSERT INTO
+            parse_result_cache (cache_key, result, update_time)
+        VALUES
+            (%s, %s, %s)
+        ON CONFLICT (cache_key) DO
+            UPDATE SET
+                result = EXCLUDED.result,
+                update_time = EXCLUDED.update_time;
+        """
+        with connect.conn_pool as conn:
+            conn.execute(sql, [key, json.dumps(value, ensure_ascii=False), datetime.now()])
+
+
+class TieredResultCache(ResultCache):
+    """
+    local cache in front of a shared cache, shared hits are copied to the local cache.
+    cache errors are logged and treated as misses, a broken cache never fails a parse
+    """
+    def __init__(self, local: Optional[ResultCache] = None, shared: Optional[ResultCache] = None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key: str) -> Optional[Dict]:
+        """get from the local cache, then the shared cache"""
+        for i, cache in enumerate([self.local, self.shared]):
+            if cache is None:
+                continue
+            try:
+                value = cache.get(key)
+            except Exception as e:
+                logger.warning(f"result cache get failed: {e}")
+                continue
+            if value is not None:
+                if i == 1 and self.local is not None:
+                    self._put(self.local, key, value)
+                return value
+        return None
+
+    def put(self, key: str, value: Dict):
+        """store in every cache"""
+        for cache in [self.local, self.shared]:
+            if cache is not None:
+                self._put(cache, key, value)
+
+    @staticmethod
+    def _put(cache: ResultCache, key: str, value: Dict):
+        """store, ignore cache errors"""
+        try:
+            cache.put(key, value)
+        except Exception as e:
+            logger.warning(f"result cache put failed: {e}")
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    build the result cache from settings, None if caching is disabled
+    """
+    local = None
+    shared = None
+    if settings.RESULT_CACHE_DIR:
+        local = DiskResultCache(settings.RESULT_CACHE_DIR, int(settings.RESULT_CACHE_MAX_GB * 1024 ** 3))
+    if settings.RESULT_CACHE_SHARED:
+        shared = PgResultCache()
+
+    if local is None and shared is None:
+        return None
+    return TieredResultCache(local, shared)
@@ -18,6 +18,8 @@ from src.jungle.schema.entity import KnowledgeType, Language
 from src.jungle.schema.page import Page
 from typing import Union, BinaryIO, List
 
+# Only the first pages are inspected to decide the document type and language
+FIRST_N_PAGE = 5
 
 class DocumentType(object):
     """s
@@ -89,9 +91,7 @@ class DocumentType(object):
             chinese_count = len(re.findall(r'[\u4e00-\u9fa5]', text))
             return chinese_count
 
-        first_n_page = 5
-        
-        first_n_page = min(first_n_page, len(pages))
+        first_n_page = min(FIRST_N_PAGE, len(pages))
         text = ""
         for i in range(first_n_page):
             text += pages[i].prelim_text
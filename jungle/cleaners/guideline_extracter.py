@@ -7,18 +7,17 @@ extract mete data from guideline
 usage:
     
 """
-from LAC import LAC
-import nltk
-from nltk import word_tokenize
-from nltk import pos_tag
 from src.jungle.structure.structure import BaseStructure
 from src.jungle.schema.entity import GuidelineEntities
 from src.jungle.schema.entity import Language
 from src.jungle.title.utils import contain_chinese
+from src.jungle.nlp import lac_run, spacy_pipe
 import re
-import spacy
 
-nltk.data.path.append('src/checkpoints/dict/nltk_data')
+NLTK_DATA_PATH = 'src/checkpoints/dict/nltk_data'
+SPACY_MODEL = 'en_core_web_sm'
+# the english author check reads entities and pos tags only
+SPACY_UNUSED_PIPES = ["parser", "lemmatizer"]
 
 
 class GuidelineExtracter(object):
@@ -28,7 +27,7 @@ class GuidelineExtracter(object):
     def __init__(self):
         """
             初始化函数，用于初始化类属性和方法。
-        初始化了一些正则表达式模式，以及LAC分词器、spaCy NLP处理工具等。
+        初始化了一些正则表达式模式，LAC分词器和spaCy由nlp_engine在进程内共享。
         
         Args:
             None.
@@ -60,9 +59,6 @@ class GuidelineExtracter(object):
         self.REFERENCE_PATTERN = re.compile(r"^\[\s*\d+\s*].+")
         self.USENESS_PATTERN = re.compile(
             r"\s*\·?\s*标?准?\s*\·?\s*指?南?\·?\s*共?识?\·*?\s*综?述?\·\s*\·?译?文?\·?\·?临?床?研?究?\·?")
-        self.lac_seg = LAC(mode='seg')
-        self.lac_pos = LAC(mode='lac')
-        self.nlp = spacy.load('en_core_web_sm')
         self.organition = None
         self.chinese_abstract = None
         self.english_abstract = None
@@ -146,7 +142,11 @@ class GuidelineExtracter(object):
         if self.WEBPAGE_PATTERN.search(text):
             return False
 
-        tokens = word_tokenize(text)
+        import nltk
+
+        if NLTK_DATA_PATH not in nltk.data.path:
+            nltk.data.path.append(NLTK_DATA_PATH)
+        tokens = nltk.word_tokenize(text)
         if len(tokens) > 5 and len(tokens) < 100:
             return True
         return False
@@ -162,17 +162,24 @@ class GuidelineExtracter(object):
         return False
 
 
-    def is_chinese_author(self, text: str) -> bool:
+    def is_chinese_author(self, text: str, tags=None) -> bool:
         """
-        return True if text is author of paper
+        return True if text is author of paper, tags are the LAC tags of text, computed if not given
         """
+        # the pattern decides without the tags
+        if self.CHINESE_AUTHOR_PATTERN.search(text):
+            return True
+        if not text.strip():
+            return False
+
         number_person_token = 0
         number_org_token = 0
         number_noun_token = 0
         number_token = 0.0001
-        doc = self.lac_pos.run(text)
+        if tags is None:
+            tags = lac_run("lac", [text])[0][1]
 
-        for tag in doc[1]:
+        for tag in tags:
             if tag in ["PER", "ORG"]:
                 number_person_token += 1
             
@@ -185,22 +192,25 @@ class GuidelineExtracter(object):
         if number_person_token / number_token > 0.6:
 
             return True
-
-        if self.CHINESE_AUTHOR_PATTERN.search(text):
-            return True
         return False
 
 
-    def is_english_author(self, text):
+    def is_english_author(self, text, doc=None):
         """
-        return True if text is author of paper
+        return True if text is author of paper, doc is the spacy doc of text, computed if not given
         """
         if contain_chinese(text): #包含中文字符
             return False
+        # the pattern decides without the doc
+        if self.ENGLISH_AUTHOR_PATTERN.search(text):
+            return True
+        if not text.strip():
+            return False
 
         number_person_token = 0
         number_token = 0.0001
-        doc = self.nlp(text)
+        if doc is None:
+            doc = spacy_pipe(SPACY_MODEL, [text], disable=SPACY_UNUSED_PIPES)[0]
         for token in doc:
             if token.ent_type_ in ["PERSON", "ORG"]:
                 number_person_token += 1
@@ -209,10 +219,6 @@ class GuidelineExtracter(object):
                 number_token += 1
         if number_person_token / number_token > 0.6:
             return True
-
-        if self.ENGLISH_AUTHOR_PATTERN.search(text):
-            return True
-        
         return False
 
 
@@ -257,12 +263,46 @@ class GuidelineExtracter(object):
             }
 
 
+    def lac_tags(self, texts):
+        """
+        LAC tags of texts in batches, texts which match the author pattern or are empty are not run,
+        the tags do not change their result
+        """
+        tags = [[] for _ in texts]
+        idxs = [i for i, text in enumerate(texts) if text.strip() and not self.CHINESE_AUTHOR_PATTERN.search(text)]
+        for i, (words, text_tags) in zip(idxs, lac_run("lac", [texts[i] for i in idxs])):
+            tags[i] = text_tags
+        return tags
+
+
+    def english_docs(self, texts):
+        """
+        spacy docs of the texts the english author check has to read, None for the others
+        """
+        docs = [None for _ in texts]
+        idxs = [i for i, text in enumerate(texts)
+                if text.strip() and not contain_chinese(text) and not self.ENGLISH_AUTHOR_PATTERN.search(text)]
+        for i, doc in zip(idxs, spacy_pipe(SPACY_MODEL, [texts[i] for i in idxs], disable=SPACY_UNUSED_PIPES)):
+            docs[i] = doc
+        return docs
+
+
     def funnel(self, text: str, page_id: int, lang: Language=Language.CHINESE.value):
         """
         funnel all text to one type of text
         """
         if page_id > 1: #meta data normally in page 0 and 1
             return {"is_meta": False, "meta_name": ""}
+        meta_json = self.funnel_patterns(text, lang)
+        if meta_json["is_meta"]:
+            return meta_json
+        return self.funnel_authors(text)
+
+
+    def funnel_patterns(self, text: str, lang: Language=Language.CHINESE.value):
+        """
+        the pattern checks of funnel, they come before the NLP checks and do not depend on them
+        """
         if self.is_chinese_abstract(text):
             self.chinese_abstract = text
             return {"is_meta": True, "meta_name": GuidelineEntities.CHINESE_ABSTRACT.value}
@@ -285,10 +325,17 @@ class GuidelineExtracter(object):
 
             self.english_title = text
             return {"is_meta": True, "meta_name": GuidelineEntities.ENGLISH_TITLE.value}
-        elif self.is_chinese_author(text):
+        return {"is_meta": False, "meta_name": ""}
+
+
+    def funnel_authors(self, text: str, tags=None, doc=None):
+        """
+        the NLP checks of funnel, with the LAC tags and spacy doc of text when they are computed in batches
+        """
+        if self.is_chinese_author(text, tags):
             self.chinese_author = text if not self.chinese_author else self.chinese_author + ";" + text
             return {"is_meta": True, "meta_name": GuidelineEntities.CHINESE_AUTHOR.value}
-        elif self.is_english_author(text):
+        elif self.is_english_author(text, doc):
             self.english_author = text if not self.english_author else self.english_author + ";" + text
             return {"is_meta": True, "meta_name": GuidelineEntities.ENGLISH_AUTHOR.value}
 
@@ -302,10 +349,26 @@ class GuidelineExtracter(object):
 
     def extract(self, structure: BaseStructure):
         """
-        extract meta data from structure
+        extract meta data from structure.
+        the pattern checks run first over all elements, then LAC and spacy run in batches over the
+        elements left, the english docs only for texts which are not chinese authors
         """
+        candidates = []
         for element in structure:
-            meta_json = self.funnel(element.text, element.page_id)
+            if element.page_id > 1: #meta data normally in page 0 and 1
+                continue
+            meta_json = self.funnel_patterns(element.text)
+            if meta_json["is_meta"]:
+                element.meta_name = meta_json["meta_name"]
+            else:
+                candidates.append(element)
+
+        texts = [element.text for element in candidates]
+        tags = self.lac_tags(texts)
+        is_chinese_author = [self.is_chinese_author(text, text_tags) for text, text_tags in zip(texts, tags)]
+        docs = self.english_docs([text if not chinese else "" for text, chinese in zip(texts, is_chinese_author)])
+        for element, text_tags, doc in zip(candidates, tags, docs):
+            meta_json = self.funnel_authors(element.text, text_tags, doc)
             if meta_json["is_meta"]:
                 element.meta_name = meta_json["meta_name"]
 
@@ -34,6 +34,23 @@ def filter_common_elements(lines, page_count, threshold=.6):
     return bad_span_ids
 
 
+def header_footer_candidates(page, max_selected_lines=2):
+    """
+    first and last nonblank lines of a page, the only lines a header or footer can come from
+    """
+    nonblank_lines = page.get_nonblank_lines()
+    return nonblank_lines[:max_selected_lines], nonblank_lines[-max_selected_lines:]
+
+
+def filter_header_footer_candidates(first_lines, last_lines, page_count):
+    """
+    find header footer spans from candidate lines collected over page_count pages
+    """
+    bad_span_ids = filter_common_elements(first_lines, page_count)
+    bad_span_ids += filter_common_elements(last_lines, page_count)
+    return bad_span_ids
+
+
 def filter_header_footer(all_page_blocks, max_selected_lines=2):
     """
     filter header footer
@@ -41,13 +58,11 @@ def filter_header_footer(all_page_blocks, max_selected_lines=2):
     first_lines = []
     last_lines = []
     for page in all_page_blocks:
-        nonblank_lines = page.get_nonblank_lines()
-        first_lines.extend(nonblank_lines[:max_selected_lines])
-        last_lines.extend(nonblank_lines[-max_selected_lines:])
+        page_first_lines, page_last_lines = header_footer_candidates(page, max_selected_lines)
+        first_lines.extend(page_first_lines)
+        last_lines.extend(page_last_lines)
 
-    bad_span_ids = filter_common_elements(first_lines, len(all_page_blocks))
-    bad_span_ids += filter_common_elements(last_lines, len(all_page_blocks))
-    return bad_span_ids
+    return filter_header_footer_candidates(first_lines, last_lines, len(all_page_blocks))
 
 
 def replace_leading_trailing_digits(string, replacement):
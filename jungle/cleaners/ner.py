@@ -16,6 +16,8 @@ spacy英文分词
 import sys
 sys.path.append(".")
 import re
+import weakref
+from contextlib import contextmanager
 import spacy
 from spacy.matcher import PhraseMatcher
 from loguru import logger
@@ -24,6 +26,7 @@ import jieba
 import jieba.posseg as pseg
 import src.config_util as cfg 
 from loguru import logger
+from src.jungle.nlp import nlp_engine, register_engine
 
 
 # class Singleton(object):
@@ -38,42 +41,50 @@ from loguru import logger
 #         return cls._instance
 
 
+SPACY_MODEL = "en_core_web_sm"
+
+# spacy pipeline of the shared pool -> {user dict path: matcher on its vocab}
+_spacy_matchers = weakref.WeakKeyDictionary()
+
+
 class SpacyEngSeg():
     """
-    Spacy 英文分词
+    Spacy 英文分词, 模型来自nlp_engine共享的spacy实例池, 每个实例上各建一个用户词典匹配器
     """
-    _spacy_seg_instance = None
-    _spacy_matcher_instance = None
-
-    def get_spacy_seg_instance(self):
-        """get instande"""
-        return self._spacy_seg_instance
-
-    def get_spacy_matcher_instance(self):
-        """get instance"""
-        return self._spacy_matcher_instance
+    @contextmanager
+    def spacy_instance(self):
+        """(nlp, matcher) borrowed from the spacy pool, only used by this thread until the block exits"""
+        with nlp_engine("spacy", SPACY_MODEL) as nlp:
+            matchers = _spacy_matchers.setdefault(nlp, {})
+            if self.user_dict_path not in matchers:
+                # the borrowing thread is the only one using nlp, no other thread builds its matcher
+                matchers[self.user_dict_path] = SpacyEngSeg.load_spacy_matcher(nlp, self.user_dict_path)
+            yield nlp, matchers[self.user_dict_path]
     
     def __init__(self,
                  user_dict_path=cfg.spacy_user_dict):
         """init"""
-        if not self._spacy_seg_instance:
-            logger.info("Loading spacy seg model and user dict, please wait ...")
-            # 基础分词器
-            nlp = spacy.load("en_core_web_sm")
-            self._spacy_seg_instance = nlp
-            # 匹配器
-            matcher = PhraseMatcher(nlp.vocab)
-            label2words = self.load_user_dict(user_dict_path)
-            for label, words in label2words.items():
-                patterns = [nlp.make_doc(text) for text in words]
-                matcher.add(label, patterns) # label -> patterns
-            self._spacy_matcher_instance = matcher
-            logger.info("Loading Successfully !")
-
+        self.user_dict_path = user_dict_path
         # 默认标签 分别是: 药品 疾病 机构名 靶名
         self.default_tag_list = ["drug", "disease", "org", "target"]
 
-    def load_user_dict(self, user_dict_path):
+    @staticmethod
+    def load_spacy_matcher(nlp, user_dict_path):
+        """
+        在spacy分词器nlp上加载用户词典的匹配器
+        """
+        logger.info("Loading spacy user dict, please wait ...")
+        # 匹配器
+        matcher = PhraseMatcher(nlp.vocab)
+        label2words = SpacyEngSeg.load_user_dict(user_dict_path)
+        for label, words in label2words.items():
+            patterns = [nlp.make_doc(text) for text in words]
+            matcher.add(label, patterns) # label -> patterns
+        logger.info("Loading Successfully !")
+        return matcher
+
+    @staticmethod
+    def load_user_dict(user_dict_path):
         """
         加载用户词典,和jieba格式一致
         txt每一行格式: "{word} {num} {label}"
@@ -99,19 +110,20 @@ class SpacyEngSeg():
             return []
         entity_list = []
         try:
-            # 先做一次分词
-            doc = self._spacy_seg_instance(text)
-            # 根据分词结果按照matcher进行匹配合并
-            matches = self._spacy_matcher_instance(doc)
-            for match_id, start, end in matches:
-                # label
-                label = self._spacy_matcher_instance.vocab[match_id].text
-                if label not in tag_list:
-                    continue
-                # text
-                span = doc[start:end]
-                entity = span.text # 自动合并字符串
-                entity_list.append([entity, label])
+            with self.spacy_instance() as (nlp, matcher):
+                # 先做一次分词
+                doc = nlp(text)
+                # 根据分词结果按照matcher进行匹配合并
+                matches = matcher(doc)
+                for match_id, start, end in matches:
+                    # label
+                    label = matcher.vocab[match_id].text
+                    if label not in tag_list:
+                        continue
+                    # text
+                    span = doc[start:end]
+                    entity = span.text # 自动合并字符串
+                    entity_list.append([entity, label])
         except Exception as e:
             logger.warning(f"recognize_entity error: {str(e)}")
         return entity_list
@@ -133,9 +145,6 @@ class JiebaSeg(Singleton):
     """
     Jieba Seg
     """
-    _jieba_tokenizer_instance = None
-    _jieba_postokenizer_instance = None
-
     def get_jieba_instance(self):
         """get instance"""
         return self._jieba_tokenizer_instance
@@ -147,22 +156,28 @@ class JiebaSeg(Singleton):
     def __init__(self,
                  user_dict_path=cfg.jieba_user_dict):
         """init"""
-        if not self._jieba_tokenizer_instance:
-            # 基础分词器
-            base_obj = jieba.Tokenizer()
-            base_obj.load_userdict(user_dict_path)
-            base_obj.tmp_dir = "./"
-            self._jieba_tokenizer_instance = base_obj
-
-        if not self._jieba_postokenizer_instance:
-            # 词性分词器
-            pos_jieba_obj = pseg.POSTokenizer(self._jieba_tokenizer_instance)
-            pos_jieba_obj.initialize()
-            self._jieba_postokenizer_instance = pos_jieba_obj
+        # jieba 分词可以多线程调用, 进程内只加载一次
+        with nlp_engine("jieba", user_dict_path) as (tokenizer, pos_tokenizer):
+            self._jieba_tokenizer_instance = tokenizer
+            self._jieba_postokenizer_instance = pos_tokenizer
 
         # 默认标签 分别是: 药品 疾病 机构名 靶名
         self.default_tag_list = ["drug", "disease", "org", "target"]
 
+    @staticmethod
+    def load_jieba(user_dict_path):
+        """
+        加载jieba分词器和词性分词器
+        """
+        # 基础分词器
+        base_obj = jieba.Tokenizer()
+        base_obj.load_userdict(user_dict_path)
+        base_obj.tmp_dir = "./"
+        # 词性分词器
+        pos_jieba_obj = pseg.POSTokenizer(base_obj)
+        pos_jieba_obj.initialize()
+        return base_obj, pos_jieba_obj
+
     def add_words(self, dict_path):
         """
         add words
@@ -253,6 +268,9 @@ class JiebaSeg(Singleton):
         return self._jieba_tokenizer_instance.cut(text)
 
 
+register_engine("jieba", JiebaSeg.load_jieba, thread_safe=True)
+
+
 def is_chinese_or_english(content):
     """
     判断中文
@@ -328,8 +346,10 @@ if __name__ == "__main__":
     seg1 = SpacyEngSeg()
     seg2 = SpacyEngSeg()
     print(seg1 is seg2)
-    a1 = seg1.get_spacy_seg_instance()
-    a2 = seg2.get_spacy_seg_instance()
+    with seg1.spacy_instance() as (a1, _):
+        pass
+    with seg2.spacy_instance() as (a2, _):
+        pass
     print(a1 is a2)
     
     print(seg1.recognize_entity(
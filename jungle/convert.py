@@ -16,42 +16,49 @@ import warnings
 warnings.filterwarnings("ignore", category=UserWarning) # Filter torch pytree user warnings
 
 import pypdfium2 as pdfium # Needs to be at the top to avoid warnings
-import pypdfium2.raw as pdfium_c
 from PIL import Image
 from loguru import logger
 
-from src.jungle.utils import flush_cuda_memory, check_font_is_support, \
-        remove_watermark, debug_pdf
+from src.jungle.utils import flush_cuda_memory, debug_pdf
 from src.jungle.tables.rock_table import format_tables
 from src.jungle.debug.data import dump_bbox_debug_data
-from src.jungle.layout.layout import layout, annotate_block_types
+from src.jungle.layout.layout import layout, annotate_block_types, get_batch_size as get_layout_batch_size
 from src.jungle.layout.order import order, sort_blocks_in_reading_order
 from src.jungle.ocr.lang import replace_langs_with_codes, validate_langs
 from src.jungle.ocr.detection import line_detection
 from src.jungle.ocr.recognition import run_ocr
 from src.jungle.pdf.extract_text import get_text_blocks
-from src.jungle.cleaners.headers import filter_header_footer
+from src.jungle.cleaners.headers import header_footer_candidates, filter_header_footer_candidates
 #from src.jungle.equations.equations import replace_equations
-from src.jungle.pdf.utils import find_filetype
+from src.jungle.pdf.utils import find_filetype, PDFIUM_LOCK
+from src.jungle.pdf.session import DocumentSession
+from src.jungle.pipeline import run_pipeline, run_sequential
+from src.jungle.metrics import stage
+from src.jungle.model_registry import use_model
+from src.jungle.page_cache import get_page_cache
 from src.jungle.postprocessors.editor import edit_full_text
 from src.jungle.cleaners.code import identify_code_blocks, indent_blocks
 from src.jungle.cleaners.bullets import replace_bullets
 from src.jungle.cleaners.headings import split_heading_blocks
 from src.jungle.cleaners.fontstyle import find_bold_italic
-from src.jungle.postprocessors.markdown import merge_spans, merge_lines
+from src.jungle.postprocessors.markdown import merge_spans, merge_lines, release_line_chars
 from src.jungle.postprocessors.matcher import match_table, table_association
 from src.jungle.cleaners.text import cleanup_text
 from src.jungle.images.extract import extract_images
 from src.jungle.images.save import images_to_dict
 from src.jungle.title.title_level import DynamicTitleParser
 from src.jungle.schema.entity import KnowledgeType, Language
-from src.jungle.ocr.heuristics import no_text_found
-from src.jungle.cleaners.document_type import DocumentType
+from src.jungle.ocr.heuristics import no_text_found, detect_bad_ocr
+from src.jungle.cleaners.document_type import DocumentType, FIRST_N_PAGE
 from src.jungle.cleaners.guideline_extracter import GuidelineExtracter
 from src.jungle.structure.toc_title import MetaCateLog
+from src.jungle.structure import AttrNorm
 
-from typing import List, Dict, Tuple, Optional, Union
+from functools import partial
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Optional, Union, Callable
 from src.jungle.settings import settings
+from src.pdftext.settings import settings as pdftext_settings
 import src.config_util as cfg
 import ftfy
 
@@ -71,171 +78,511 @@ def contain_garbage(pages):
     return meaningness_text / all_text 
 
 
-def get_num_unicode_map_error(doc):
+def page_text_unusable(page):
     """
-    get num unicode map error using pdfium
+    whether the text layer of a single page is missing, garbled or wrongly mapped,
+    judged by the diagnostics pdftext gathered while extracting the page chars
     """
-    blocks = []
-    num_unicode_map_error = 0
-    char_nums = 0
-    for page_idx in range(len(doc)):
-        page = doc.get_page(page_idx)
-        text_page = page.get_textpage()
-        total_chars = text_page.count_chars()
-        char_nums += total_chars
-        for i in range(total_chars):
-            char = pdfium_c.FPDFText_GetUnicode(text_page, i)
-            has_unicodemap_error = pdfium_c.FPDFText_HasUnicodeMapError(text_page, i)
-            if has_unicodemap_error != 0:
-                num_unicode_map_error += 1
-    return num_unicode_map_error / (char_nums + 0.00001)
+    if detect_bad_ocr(page.prelim_text):
+        return True
+    if page.diagnostics is None:
+        return contain_garbage([page]) > 0.5
+    return page.diagnostics["garbage"] > 0.5 or \
+        page.diagnostics["unicode_map_error"] > pdftext_settings.UNICODE_MAP_ERROR_RATIO or \
+        page.diagnostics["blacklisted_chars"] > settings.BLACKLISTED_FONT_MAX_CHARS
 
 
-def convert_single_pdf(
-        document: Union[str, bytes],
-        model_lst: List,
-        langs: Optional[List[str]] = None,
-        batch_multiplier: int = 1,
-        debug: bool = False
-) -> Tuple[str, Dict[str, Image.Image], Dict]:
-    """convert single pdf to markdown"""
-    if langs is None:
-        langs = ["Chinese"] 
-    # Set language needed for OCR
-    if langs is None:
-        langs = [settings.DEFAULT_LANG]
-
-    langs = replace_langs_with_codes(langs)
-    validate_langs(langs)
-
-    # Find the filetype
-    filetype = find_filetype(document)
+def select_ocr_pages(pages):
+    """
+    per page OCR routing, returns the positions of the pages that need line detection and
+    the positions of the pages whose text layer is unusable, the font check included.
+    the other pages keep their pdftext spans, unless OCR_COVERAGE_CHECK finds text lines missing from the text layer
+    """
+    if no_text_found(pages):
+        forced_idxs = list(range(len(pages)))
+    else:
+        forced_idxs = [i for i, page in enumerate(pages) if page_text_unusable(page)]
 
-    # Setup output metadata
-    out_meta = {
-        "languages": langs,
-    }
+    if settings.OCR_COVERAGE_CHECK or settings.OCR_ALL_PAGES:
+        detect_idxs = list(range(len(pages)))
+    else:
+        detect_idxs = forced_idxs
+    return detect_idxs, forced_idxs
 
 
-    # Get initial text blocks from the pdf
-    logger.info(f"remove watermark")
+def ocr_and_layout(doc, pages, model_lst, langs, detect_idxs, forced_idxs, batch_multiplier=1, rasters=None):
+    """
+    run line detection and OCR on the selected pages, then layout prediction.
+    with a raster store the page rasters are attached for the stage and detached after it
+    """
+    if rasters is None:
+        return _ocr_and_layout(doc, pages, model_lst, langs, detect_idxs, forced_idxs, batch_multiplier)
+    rasters.attach(pages)
+    new_pages = []
     try:
-        document = remove_watermark(document)
-    except:
-        pass
-    doc = pdfium.PdfDocument(document)
-    logger.info(f"length of pdfs is {len(doc)}")
-
-    pages, toc = get_text_blocks(
-        doc,
-        document
-    )
-    
+        new_pages = _ocr_and_layout(doc, pages, model_lst, langs, detect_idxs, forced_idxs, batch_multiplier)
+        return new_pages
+    finally:
+        # OCR replaces pages by new ones holding the same rasters
+        rasters.detach(list(pages) + list(new_pages))
 
-    num_unicode_map_error = get_num_unicode_map_error(doc)
-    pdf_font_is_support = check_font_is_support(document)
 
+def _ocr_and_layout(doc, pages, model_lst, langs, detect_idxs, forced_idxs, batch_multiplier=1):
+    """
+    ocr_and_layout with the rasters set on the pages
+    """
     layout_model, order_model, detection_model, ocr_model, table_model = model_lst
 
-    # No text found on any page then we need to OCR
-    if no_text_found(pages) or contain_garbage(pages) > 0.5 or num_unicode_map_error > 0.009 or not pdf_font_is_support: 
-        logger.info("No text has been found, or unicode map error is found, "
-                    "so OCR will be used to get text, which may take some time.")
+    if detect_idxs:
+        logger.info(f"{len(forced_idxs)} of {len(pages)} pages have no usable text layer, "
+                    f"line detection on {len(detect_idxs)} pages, OCR may take some time.")
 
-        line_detection(doc, pages, detection_model, batch_multiplier=batch_multiplier)
+        with stage("detection", pages=len(detect_idxs)), use_model(detection_model) as detection_predictor:
+            line_detection(doc, [pages[i] for i in detect_idxs], detection_predictor, batch_multiplier=batch_multiplier)
         flush_cuda_memory()
 
         # OCR pages as needed
-
-        pages, ocr_stats = run_ocr(doc, pages, langs, ocr_model, batch_multiplier=batch_multiplier)
+        with stage("ocr") as counts, use_model(ocr_model) as ocr_predictor:
+            pages, ocr_stats = run_ocr(doc, pages, langs, ocr_predictor, batch_multiplier=batch_multiplier,
+                                       detected_idxs=detect_idxs, forced_idxs=forced_idxs)
+            counts["ocr_pages"] = ocr_stats["ocr_pages"]
+        logger.info(f"ocr stats: {ocr_stats}")
         flush_cuda_memory()
  
 
     logger.info(f"start layout prediction, ")
-    mean_intersection_pct = layout(doc, pages, layout_model, batch_multiplier=batch_multiplier)
+    with stage("layout", pages=len(pages)), use_model(layout_model) as layout_predictor:
+        mean_intersection_pct = layout(doc, pages, layout_predictor, batch_multiplier=batch_multiplier)
     logger.info(f"finish layout prediction, {mean_intersection_pct}")
-    
-
     flush_cuda_memory()
-    # Find headers and footers
-    bad_span_ids = filter_header_footer(pages)
-    out_meta["block_stats"] = {"header_footer": len(bad_span_ids)}
+    return pages
+
 
-    # Add block types in
-    #annotate_block_types(pages)
-    # assign_textline_to_layout(pages)
-    # Dump debug data if flags are set
-    dump_bbox_debug_data(doc, document, pages)
+def order_and_tables(doc, pages, model_lst, batch_multiplier=1, rasters=None):
+    """
+    predict reading order, then table structure if enabled.
+    with a raster store every raster is attached for the order stage, only those of pages with tables for tables
+    """
+    layout_model, order_model, detection_model, ocr_model, table_model = model_lst
 
     # Find reading order for blocks
     logger.info("start reading order prediction")
-    order(doc, pages, order_model, batch_multiplier=batch_multiplier)
+    with stage("order", pages=len(pages)), use_model(order_model) as order_predictor, \
+            attached_rasters(rasters, pages):
+        order(doc, pages, order_predictor, batch_multiplier=batch_multiplier)
     logger.info("finish reading order prediction")
     #sort_blocks_in_reading_order(pages)
     flush_cuda_memory()
 
-
     if cfg.SHOULD_PARSE_TABLE:
         logger.info("start table structure prediction")
-        pages = format_tables(pages, table_model)
+        table_pages = [page for page in pages
+                       if any(block.block_type == AttrNorm.TABLE.value for block in page.blocks)]
+        num_tables = sum(block.block_type == AttrNorm.TABLE.value for page in table_pages for block in page.blocks)
+        # the table model is only loaded when there is a table
+        with stage("tables", pages=len(pages), tables=num_tables), \
+                use_model(table_model if num_tables else None) as table_predictor, \
+                attached_rasters(rasters, table_pages):
+            pages = format_tables(pages, table_predictor)
         logger.info("finish table structure prediction")
+    return pages
+
+
+@contextmanager
+def attached_rasters(rasters, pages):
+    """page rasters attached to pages for a stage, nothing to do without a raster store"""
+    if rasters is None:
+        yield pages
+        return
+    rasters.attach(pages)
+    try:
+        yield pages
+    finally:
+        rasters.detach(pages)
 
+
+def release_page_data(pages, rasters=None):
+    """
+    drop the page rasters and character data once every stage that needs them has run
+    """
     for page in pages:
-        for block in page.blocks:
-            block.filter_spans(bad_span_ids)
-            block.filter_bad_span_types()
-
-    if debug:
-        images = debug_pdf(pages)
-
-    # filtered, eq_stats = replace_equations(
-    #     doc,
-    #     pages,
-    #     texify_model,
-    #     batch_multiplier=batch_multiplier
-    # )
-    # flush_cuda_memory()
-    # out_meta["block_stats"]["equations"] = eq_stats
-
-    # Extract images and figures
-    #if settings.EXTRACT_IMAGES:
-    #    extract_images(doc, pages)
-
-    # Split out headers
-    split_heading_blocks(pages)
-    find_bold_italic(pages)
-
-    # Copy to avoid changing original data
-    merged_lines = merge_spans(pages)
-    structure = merge_lines(merged_lines)
+        page.page_image = None
+        page.char_blocks = None
+        page.text_lines = None
+    if rasters is not None:
+        rasters.release([page.pnum for page in pages])
+
+
+def collect_candidates(candidates):
+    """
+    header footer candidate lines of all pages, candidates maps page number to (first lines, last lines)
+    """
+    first_lines = []
+    last_lines = []
+    for pnum in sorted(candidates):
+        page_first_lines, page_last_lines = candidates[pnum]
+        first_lines.extend(page_first_lines)
+        last_lines.extend(page_last_lines)
+    return first_lines, last_lines
+
+
+def candidate_span_ids(candidates):
+    """
+    ids of the spans of the header and footer candidate lines, the only spans removed after the merge stage
+    """
+    return {span.span_id for first_lines, last_lines in candidates.values()
+            for line in first_lines + last_lines for span in line.spans}
 
-    if cfg.SHOULD_PARSE_TABLE:
-        structure = match_table(structure)
-    if cfg.SHOULD_MATCH_TABLE_TO_PARA:
-        structure = table_association(structure)
+
+def merge_cached_pages(pages, candidates, cached_entries):
+    """
+    put the pages restored from the page cache back between the freshly parsed pages
+    """
+    for pnum, entry in cached_entries.items():
+        candidates[pnum] = (entry["first_lines"], entry["last_lines"])
+    pages = pages + [entry["page"] for entry in cached_entries.values()]
+    return sorted(pages, key=lambda page: page.pnum)
+
+
+def report_progress(progress, stage, num_pages):
+    """
+    tell the progress callback that num_pages more pages passed stage
+    """
+    if progress is not None:
+        progress(stage, num_pages)
+
+
+def select_pages(num_pages: int, start_page: Optional[int] = None, max_pages: Optional[int] = None) -> range:
+    """
+    page numbers parsed, max_pages from start_page (all pages by default).
+    a document without pages has an empty range unless start_page is given
+    """
+    if start_page is not None and (start_page < 0 or start_page >= num_pages):
+        raise ValueError(f"start_page {start_page} out of range, the document has {num_pages} pages")
+    if max_pages is not None and max_pages < 0:
+        raise ValueError(f"max_pages {max_pages} is negative")
+    start_page = start_page or 0
+    end_page = num_pages if not max_pages else min(start_page + max_pages, num_pages)
+    return range(start_page, end_page)
+
+
+def extract_window(doc, session, page_cache, page_keys, progress, window_pnums):
+    """
+    pdftext extraction and rendering of one page window, the only window stage calling pdfium.
+    pages found in the page cache are restored instead
+    """
+    start_page = window_pnums[0]
+    logger.info(f"extract page window {start_page} - {window_pnums[-1] + 1}")
+    cached_entries = {}
+    if page_cache is not None:
+        cached_entries = page_cache.load(page_keys, window_pnums)
+    page_idxs = [pnum for pnum in window_pnums if pnum not in cached_entries]
+    with PDFIUM_LOCK:
+        pages, toc = get_text_blocks(doc, session.data, page_idxs=page_idxs, session=session)
+    report_progress(progress, "extract", len(window_pnums))
+    return {"start_page": start_page, "pages": pages, "toc": toc, "cached_entries": cached_entries}
+
+
+def layout_window(doc, model_lst, langs, batch_multiplier, rasters, progress, window):
+    """
+    OCR if needed and layout of one page window, header and footer candidates are taken here,
+    before reading order changes the block order
+    """
+    pages = window["pages"]
+    if pages:
+        detect_idxs, forced_idxs = select_ocr_pages(pages)
+        pages = ocr_and_layout(doc, pages, model_lst, langs, detect_idxs, forced_idxs, 
+                               batch_multiplier=batch_multiplier, rasters=rasters)
+
+    window["pages"] = pages
+    window["candidates"] = {page.pnum: header_footer_candidates(page) for page in pages}
+    report_progress(progress, "layout", len(pages) + len(window["cached_entries"]))
+    return window
+
+
+def order_window(doc, document, model_lst, batch_multiplier, rasters, page_cache, page_keys, progress, window):
+    """
+    reading order and tables of one page window, the last stage reading the chars. the lines keep their text
+    instead, and the parsed pages are stored in the page cache
+    """
+    if window["pages"]:
+        if not window["cached_entries"]:
+            with PDFIUM_LOCK:
+                dump_bbox_debug_data(doc, document, window["pages"], part=window["start_page"])
+        window["pages"] = order_and_tables(doc, window["pages"], model_lst, batch_multiplier=batch_multiplier,
+                                           rasters=rasters)
+        release_line_chars(window["pages"], candidate_span_ids(window["candidates"]))
+        if page_cache is not None:
+            page_cache.store(page_keys, window["pages"], window["candidates"])
+    report_progress(progress, "order", len(window["pages"]) + len(window["cached_entries"]))
+    return window
+
+
+def convert_page_windows(doc, session, model_lst, langs, page_window, batch_multiplier=1, debug=False,
+                         pipeline=False, page_cache=None, page_keys=None, progress=None, pnums=None,
+                         out_meta=None):
+    """
+    push fixed size page windows through extraction, rendering, layout, order and tables.
+    the rasters of a window are released once it passed the model stages and its lines keep their text instead
+    of their chars, only the header and footer candidate lines keep a copy of theirs. so the rasters and char
+    tables in memory grow with the window instead of the document, the text of the blocks with the document.
+    header and footer spans are only known after all pages are seen, so the blocks are filtered, split at
+    headings and merged at the end, like a document parsed at once. their count goes to out_meta["block_stats"].
+    with pipeline the stages run in their own threads, so consecutive windows are processed concurrently.
+    pnums are the pages parsed, all pages by default.
+    """
+    if pnums is None:
+        pnums = range(len(doc))
+    num_pages = len(pnums)
+    pages = []
+    candidates = {}
+    images = {"file_bytes": []}
+    toc = None
+
+    page_windows = [list(pnums[start:start + page_window]) for start in range(0, num_pages, page_window)]
+    stages = [
+        partial(extract_window, doc, session, page_cache, page_keys, progress),
+        partial(layout_window, doc, model_lst, langs, batch_multiplier, session.rasters, progress),
+        partial(order_window, doc, session.data, model_lst, batch_multiplier, session.rasters, page_cache, page_keys,
+                progress),
+    ]
+    if pipeline:
+        windows = run_pipeline(page_windows, stages, queue_size=settings.PIPELINE_QUEUE_SIZE)
+    else:
+        windows = run_sequential(page_windows, stages)
+
+    for window in windows:
+        window_pages = window.pop("pages")
+        if toc is None:
+            toc = window["toc"]
+        window_pages = merge_cached_pages(window_pages, window["candidates"], window.pop("cached_entries"))
+        candidates.update(window["candidates"])
+
+        for page in window_pages:
+            for block in page.blocks:
+                block.filter_bad_span_types()
+
+        if debug:
+            images["file_bytes"].extend(debug_pdf(window_pages, 
+                                                  get_image=lambda page: session.rasters.get(page.pnum))["file_bytes"])
+
+        release_page_data(window_pages, rasters=session.rasters)
+        pages.extend(window_pages)
+        del window_pages
+        flush_cuda_memory()
+
+    with stage("merge", pages=len(pages)):
+        first_lines, last_lines = collect_candidates(candidates)
+        bad_span_ids = filter_header_footer_candidates(first_lines, last_lines, num_pages)
+        if out_meta is not None:
+            out_meta["block_stats"] = {"header_footer": len(bad_span_ids)}
+        for page in pages:
+            for block in page.blocks:
+                block.filter_spans(bad_span_ids)
+
+        split_heading_blocks(pages)
+        find_bold_italic(pages)
+        merged_lines = merge_spans(pages)
+    report_progress(progress, "merge", len(pages))
+
+    return merged_lines, pages[:FIRST_N_PAGE], toc, images
+
+
+def convert_single_pdf(
+        document: Union[str, bytes],
+        model_lst: List,
+        langs: Optional[List[str]] = None,
+        batch_multiplier: int = 1,
+        debug: bool = False,
+        page_window: Optional[int] = None,
+        pipeline: Optional[bool] = None,
+        progress: Optional[Callable[[str, int], None]] = None,
+        start_page: Optional[int] = None,
+        max_pages: Optional[int] = None
+) -> Tuple[str, Dict[str, Image.Image], Dict]:
+    """
+    convert single pdf to markdown, page_window sets the pages processed at a time (streaming mode),
+    pipeline overlaps the extraction, layout and order stages of consecutive windows.
+    only max_pages pages from start_page are parsed (all by default), every stage from watermark removal
+    on only reads them, so a preview of the first pages of a long document costs as much as a short one.
+    progress is called with ("total", page count) once, then with (stage, pages done) as pages pass
+    the extract, layout, order and merge stages, possibly from pipeline threads.
+    the time and counts of every stage go to the active DocumentMetrics, see jungle.metrics
+    """
+    if langs is None:
+        langs = ["Chinese"] 
+    # Set language needed for OCR
+    if langs is None:
+        langs = [settings.DEFAULT_LANG]
+
+    langs = replace_langs_with_codes(langs)
+    validate_langs(langs)
+
+    if page_window is None:
+        page_window = settings.PAGE_WINDOW_SIZE
+    if pipeline is None:
+        pipeline = settings.PIPELINE_STAGES
+    if pipeline and not page_window:
+        # one layout batch per window keeps the layout model busy while the next window is extracted
+        page_window = get_layout_batch_size()
+
+    # Find the filetype
+    filetype = find_filetype(document)
+
+    # Setup output metadata
+    out_meta = {
+        "languages": langs,
+    }
+
+
+    # Get initial text blocks from the pdf, documents may be converted concurrently (dynamic batching)
+    with PDFIUM_LOCK:
+        # the pdf is opened once per backend, the stages share its pages and text dicts
+        session = DocumentSession(document)
+        pnums = select_pages(len(session.fitz_doc), start_page, max_pages)
+        logger.info(f"remove watermark")
+        with stage("watermark"):
+            try:
+                session.remove_watermark(pnums)
+            except:
+                pass
+        document = session.data
+        doc = session.pdfium_doc
+        logger.info(f"length of pdfs is {len(doc)}, parse pages {pnums.start} - {pnums.stop}")
+
+        # the text layer checks, the black listed fonts included, run per page inside pdftext
+        # debug images need the page rasters, which cached pages do not keep
+        page_cache = None if debug else get_page_cache()
+        page_keys = None
+        if page_cache is not None:
+            page_keys = page_cache.page_keys(session, pnums, langs=langs)
+        # pdftext splits the pages between its workers by their content length, read while fitz is open
+        if settings.PDFTEXT_POOL_WORKERS > 1:
+            session.page_weights(pnums)
+        session.release_fitz()
+    report_progress(progress, "total", len(pnums))
+
+    if page_window and page_window < len(pnums):
+        logger.info(f"streaming mode, {page_window} pages per window, pipeline: {pipeline}")
+        merged_lines, type_pages, toc, images = convert_page_windows(doc, session, model_lst, langs, page_window,
+                                                                     batch_multiplier=batch_multiplier, debug=debug,
+                                                                     pipeline=pipeline, page_cache=page_cache,
+                                                                     page_keys=page_keys, progress=progress,
+                                                                     pnums=pnums, out_meta=out_meta)
+    else:
+        # only pages missing from the page cache are extracted and go through the models
+        cached_entries = {}
+        if page_cache is not None:
+            cached_entries = page_cache.load(page_keys, pnums)
+        page_idxs = [pnum for pnum in pnums if pnum not in cached_entries]
+        with PDFIUM_LOCK:
+            pages, toc = get_text_blocks(
+                doc,
+                document,
+                page_idxs=page_idxs,
+                session=session
+            )
+        report_progress(progress, "extract", len(pnums))
+
+        candidates = {}
+        if pages:
+            # OCR only the pages whose text layer can not be used
+            detect_idxs, forced_idxs = select_ocr_pages(pages)
+            pages = ocr_and_layout(doc, pages, model_lst, langs, detect_idxs, forced_idxs, 
+                                   batch_multiplier=batch_multiplier, rasters=session.rasters)
+
+            # Find headers and footers candidates, before reading order changes the block order
+            candidates = {page.pnum: header_footer_candidates(page) for page in pages}
+        report_progress(progress, "layout", len(pnums))
+
+        if pages:
+            # Add block types in
+            #annotate_block_types(pages)
+            # assign_textline_to_layout(pages)
+            # Dump debug data if flags are set
+            if not cached_entries:
+                with PDFIUM_LOCK:
+                    dump_bbox_debug_data(doc, document, pages)
+
+            pages = order_and_tables(doc, pages, model_lst, batch_multiplier=batch_multiplier,
+                                     rasters=session.rasters)
+            # the cached pages keep the text of their lines instead of the char tables
+            release_line_chars(pages, candidate_span_ids(candidates))
+            if page_cache is not None:
+                page_cache.store(page_keys, pages, candidates)
+        report_progress(progress, "order", len(pnums))
+
+        with stage("merge", pages=len(pnums)):
+            # headers and footers are found over all pages, cached ones included
+            pages = merge_cached_pages(pages, candidates, cached_entries)
+            first_lines, last_lines = collect_candidates(candidates)
+            bad_span_ids = filter_header_footer_candidates(first_lines, last_lines, len(pages))
+            out_meta["block_stats"] = {"header_footer": len(bad_span_ids)}
+
+            for page in pages:
+                for block in page.blocks:
+                    block.filter_spans(bad_span_ids)
+                    block.filter_bad_span_types()
+
+            if debug:
+                images = debug_pdf(pages, get_image=lambda page: session.rasters.get(page.pnum))
+
+            # filtered, eq_stats = replace_equations(
+            #     doc,
+            #     pages,
+            #     texify_model,
+            #     batch_multiplier=batch_multiplier
+            # )
+            # flush_cuda_memory()
+            # out_meta["block_stats"]["equations"] = eq_stats
+
+            # Extract images and figures
+            #if settings.EXTRACT_IMAGES:
+            #    extract_images(doc, pages)
+
+            # Split out headers
+            split_heading_blocks(pages)
+            find_bold_italic(pages)
+
+            # Copy to avoid changing original data
+            merged_lines = merge_spans(pages)
+        report_progress(progress, "merge", len(pnums))
+        type_pages = pages
+    # the rasters are only read by the model stages and the debug images
+    session.close()
+
+    with stage("merge", lines=len(merged_lines)):
+        structure = merge_lines(merged_lines)
+
+        if cfg.SHOULD_PARSE_TABLE:
+            structure = match_table(structure)
+        if cfg.SHOULD_MATCH_TABLE_TO_PARA:
+            structure = table_association(structure)
 
     meta_cate_log = MetaCateLog(toc)
-    doc_type = DocumentType(pages)
+    doc_type = DocumentType(type_pages)
 
     #if doc_type.language == Language.CHINESE.value and doc_type.document_type == KnowledgeType.GUIDELINE.value:
     #if doc_type.document_type == KnowledgeType.GUIDELINE.value:
     logger.info("guideline extracter")
-    guideline_extracter = GuidelineExtracter()
-    guideline_extracter.extract(structure)
+    with stage("guideline"):
+        guideline_extracter = GuidelineExtracter()
+        guideline_extracter.extract(structure)
     logger.info("finish guideline extracter")
 
-    if doc_type.language == Language.CHINESE.value:
-        logger.info("Chinese document, will try to parse title level")
-        title_parser = DynamicTitleParser()
-        structure = title_parser.predict(structure, doc_type.document_type)
-
-    elif doc_type.language == Language.ENGLISH.value and meta_cate_log:
-        logger.info("English document, will try to parse title level, with its own title")
-        structure = meta_cate_log.assign_title_level(structure)
-    
-    else:
-        logger.info(" will try to parse title level, with layout model predict")
-        structure.self_title_assign()
+    with stage("title"):
+        if doc_type.language == Language.CHINESE.value:
+            logger.info("Chinese document, will try to parse title level")
+            title_parser = DynamicTitleParser()
+            structure = title_parser.predict(structure, doc_type.document_type)
+
+        elif doc_type.language == Language.ENGLISH.value and meta_cate_log:
+            logger.info("English document, will try to parse title level, with its own title")
+            structure = meta_cate_log.assign_title_level(structure)
+        
+        else:
+            logger.info(" will try to parse title level, with layout model predict")
+            structure.self_title_assign()
 
     if not debug:
         return structure, doc_type.language, doc_type.document_type
@@ -15,7 +15,7 @@ Date:    2024/07/29 17:08:41
 import base64
 import json
 import os
-from typing import List
+from typing import List, Optional
 
 from src.jungle.pdf.images import render_image
 from src.jungle.schema.page import Page
@@ -57,18 +57,19 @@ def dump_equation_debug_data(doc, images, converted_spans):
         json.dump(data_lines, f)
 
 
-def dump_bbox_debug_data(doc, fname, blocks: List[Page]):
-    """dump bbox debug data"""
+def dump_bbox_debug_data(doc, fname, blocks: List[Page], part: Optional[int] = None):
+    """dump bbox debug data, part names the file of one page window"""
     if not settings.DEBUG_DATA_FOLDER or settings.DEBUG_LEVEL < 2:
         return
 
     # Remove extension from doc name
     doc_base = fname.rsplit(".", 1)[0]
 
-    debug_file = os.path.join(settings.DEBUG_DATA_FOLDER, f"{doc_base}_bbox.json")
+    suffix = "" if part is None else f"_{part}"
+    debug_file = os.path.join(settings.DEBUG_DATA_FOLDER, f"{doc_base}_bbox{suffix}.json")
     debug_data = []
-    for idx, page_blocks in enumerate(blocks):
-        page = doc[idx]
+    for page_blocks in blocks:
+        page = doc[page_blocks.pnum]
 
         png_image = render_image(page, dpi=settings.TEXIFY_DPI)
         width, height = png_image.size
@@ -12,10 +12,12 @@ Authors: yushilin(1329239119@qq.com)
 Date:    2024/07/29 17:08:41
 """
 
+from functools import partial
 from typing import List
 
 from src.rock.layout import batch_layout_detection
 
+from src.jungle.batching import run_batched
 from src.jungle.pdf.images import render_image
 from src.jungle.schema.bbox import rescale_bbox, box_intersection_pct
 from src.jungle.schema.page import Page
@@ -73,7 +75,10 @@ def layout(doc, pages: List[Page], layout_predictor, batch_multiplier=6):
     #images = [render_image(doc[pnum], dpi=settings.SURYA_LAYOUT_DPI) for pnum in range(len(pages))]
     images = [page.page_image for page in pages]
 
-    layout_predictions = batch_layout_detection(images, layout_predictor, batch_size=settings.LAYOUT_BATCH_SIZE)
+    batch_size = get_batch_size()
+    layout_predictions = run_batched(("layout", id(layout_predictor)),
+                                     partial(batch_layout_detection, predictor=layout_predictor, batch_size=batch_size),
+                                     [images], batch_size)
     page_idxs = [idx for idx in range(len(pages))]
 
     pdf_intersection_pct_sum = 0
@@ -133,7 +138,7 @@ def layout(doc, pages: List[Page], layout_predictor, batch_multiplier=6):
 
             block = Block(
                 bbox=layout_instance.bbox,
-                pnum=page_idx,
+                pnum=page.pnum,
                 lines=blocked_lines,
                 block_type=layout_instance.label
             )
@@ -13,10 +13,12 @@ Date:    2024/07/29 17:08:41
 """
 
 from collections import defaultdict
+from functools import partial
 from typing import List
 
 from src.rock.ordering import batch_ordering
 
+from src.jungle.batching import run_batched
 from src.jungle.pdf.images import render_image
 from src.jungle.pdf.utils import sort_block_group
 from src.jungle.schema.bbox import rescale_bbox
@@ -46,8 +48,10 @@ def order(doc, pages: List[Page], order_model, batch_multiplier=1):
         bboxes.append(bbox)
 
     processor = order_model.processor
-    order_results = batch_ordering(images, bboxes, order_model, 
-                                processor, batch_size=int(get_batch_size() * batch_multiplier))
+    batch_size = int(get_batch_size() * batch_multiplier)
+    order_results = run_batched(("order", id(order_model)),
+                                partial(batch_ordering, model=order_model, processor=processor, batch_size=batch_size),
+                                [images, bboxes], batch_size)
 
     for page, order_result in zip(pages, order_results):
         for block, order in zip(page.blocks, order_result.bboxes):
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+per stage timing and throughput metrics.
+stages record wall time, cpu time of the calling thread and counts such as pages, lines, tables and OCRed pages.
+the cpu time of a stage leaves out the pipeline threads, other documents and the work it hands to
+thread pools (e.g. torch intra op threads) or worker processes.
+the numbers go to the metrics of the current document, if one is active, and to the process wide
+registry, which is exported in the prometheus text format.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from loguru import logger
+
+
+_current_metrics = contextvars.ContextVar("jungle_document_metrics", default=None)
+
+
+class MetricsRegistry(object):
+    """
+    process wide counters, labelled by stage
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._help = {}
+
+    def inc(self, name: str, value: float = 1, help_text: str = "", **labels):
+        """add value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+            if help_text:
+                self._help[name] = help_text
+
+    def prometheus_text(self) -> str:
+        """all counters in the prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            help_texts = dict(self._help)
+
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                if name in help_texts:
+                    lines.append(f"# HELP {name} {help_texts[name]}")
+                lines.append(f"# TYPE {name} counter")
+                last_name = name
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            label_text = "{" + label_text + "}" if label_text else ""
+            lines.append(f"{name}{label_text} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class DocumentMetrics(object):
+    """
+    stage metrics of one document
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    @contextmanager
+    def activate(self):
+        """make this the metrics of the current document, pipeline threads inherit it"""
+        token = _current_metrics.set(self)
+        REGISTRY.inc("jungle_documents_total", help_text="documents converted")
+        try:
+            yield self
+        finally:
+            _current_metrics.reset(token)
+
+    def add(self, name: str, wall: float = 0, cpu: float = 0, calls: int = 0, **counts):
+        """add time and counts to a stage"""
+        with self._lock:
+            stage_metrics = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            stage_metrics["wall"] += wall
+            stage_metrics["cpu"] += cpu
+            stage_metrics["calls"] += calls
+            for key, value in counts.items():
+                if isinstance(value, list):
+                    stage_metrics.setdefault(key, []).extend(value)
+                else:
+                    stage_metrics[key] = stage_metrics.get(key, 0) + value
+
+    def to_dict(self) -> Dict:
+        """stage metrics, times rounded to ms"""
+        with self._lock:
+            result = {}
+            for name, stage_metrics in self.stages.items():
+                result[name] = dict(stage_metrics, wall=round(stage_metrics["wall"], 3),
+                                    cpu=round(stage_metrics["cpu"], 3))
+            return result
+
+
+def current_metrics() -> Optional[DocumentMetrics]:
+    """metrics of the document being converted in this context"""
+    return _current_metrics.get()
+
+
+def count(name: str, **counts):
+    """add counts such as pages, lines or tables to a stage"""
+    for key, value in counts.items():
+        REGISTRY.inc(f"jungle_stage_{key}_total", value, help_text=f"{key} processed per stage", stage=name)
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add(name, **counts)
+
+
+@contextmanager
+def stage(name: str, **counts):
+    """
+    time a stage, counts known up front are passed as keywords,
+    counts found inside the stage are set on the yielded dict
+    """
+    found = {}
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield found
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        counts.update(found)
+        REGISTRY.inc("jungle_stage_wall_seconds_total", wall, help_text="wall time per stage", stage=name)
+        REGISTRY.inc("jungle_stage_cpu_seconds_total", cpu, help_text="thread cpu time per stage", stage=name)
+        REGISTRY.inc("jungle_stage_calls_total", help_text="calls per stage", stage=name)
+        for key, value in counts.items():
+            REGISTRY.inc(f"jungle_stage_{key}_total", value, help_text=f"{key} processed per stage", stage=name)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.add(name, wall=wall, cpu=cpu, calls=1, **counts)
+
+
+def record_batches(name: str, num_items: int, batch_size: int, registry: bool = True, document: bool = True):
+    """
+    record the batch sizes a model call of num_items items runs with, in the process registry
+    and in the metrics of the current document. a batch merged from several documents is counted
+    once in the registry and once per document
+    """
+    if num_items == 0:
+        return
+    batch_size = max(1, batch_size)
+    batch_sizes = [batch_size] * (num_items // batch_size)
+    if num_items % batch_size:
+        batch_sizes.append(num_items % batch_size)
+    if registry:
+        REGISTRY.inc("jungle_batches_total", len(batch_sizes), help_text="model batches per stage", stage=name)
+        REGISTRY.inc("jungle_batch_items_total", num_items, help_text="items in model batches per stage", stage=name)
+    metrics = current_metrics() if document else None
+    if metrics is not None:
+        metrics.add(name, batch_sizes=batch_sizes)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """serve the registry on /metrics"""
+
+    def do_GET(self):
+        """get"""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """no access log"""
+        pass
+
+
+@lru_cache(maxsize=None)
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """
+    serve the prometheus text endpoint on port in a daemon thread, once per process
+    """
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"metrics served on :{port}/metrics")
+    return server
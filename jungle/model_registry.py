@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+lazy model registry with a memory budget.
+every model is loaded on first use and its weight size is tracked. when the resident models exceed
+the budget the least recently used idle ones are evicted: moved to cpu on cuda, dropped otherwise
+and loaded from their checkpoint again on the next use.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+import torch
+from loguru import logger
+
+from src.jungle.metrics import REGISTRY
+from src.jungle.settings import settings
+
+
+def torch_modules(model) -> List[torch.nn.Module]:
+    """
+    the torch modules of a model, models are either modules or predictors holding modules
+    """
+    if model is None:
+        return []
+    if isinstance(model, torch.nn.Module):
+        return [model]
+    return [value for value in vars(model).values() if isinstance(value, torch.nn.Module)]
+
+
+def model_bytes(model) -> int:
+    """size of the parameters and buffers of a model"""
+    size = 0
+    for module in torch_modules(model):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def model_memory_budget(device: str) -> float:
+    """
+    GB the resident models may use on device, MODEL_MEMORY_GB or what the memory of the device leaves
+    for them: INFERENCE_RAM after VRAM_PER_TASK for every parse worker on cuda,
+    INFERENCE_CPU_RAM after RAM_PER_TASK for every parse worker otherwise. never below 0,
+    the registry raises it to the largest model it loaded
+    """
+    if settings.MODEL_MEMORY_GB is not None:
+        return max(settings.MODEL_MEMORY_GB, 0.0)
+    workers = max(settings.JOB_WORKERS, 1)
+    if "cuda" in device:
+        budget = settings.INFERENCE_RAM - settings.VRAM_PER_TASK * workers
+    else:
+        budget = settings.INFERENCE_CPU_RAM - settings.RAM_PER_TASK * workers
+    if budget <= 0:
+        logger.warning(f"[models] no memory left for the models on {device} after {workers} parse workers, "
+                       f"only the model in use stays resident")
+    return max(budget, 0.0)
+
+
+class LazyModel(object):
+    """
+    stands in for a model of model_lst, the model is loaded through the registry on first use.
+    pin it with use_model around a stage, so it is not evicted while the stage runs
+    """
+    def __init__(self, registry: "ModelRegistry", name: str):
+        self._registry = registry
+        self.name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return getattr(self._registry.get(self.name), attr)
+
+    def __call__(self, *args, **kwargs):
+        with self._registry.use(self.name) as model:
+            return model(*args, **kwargs)
+
+    def __repr__(self):
+        return f"LazyModel({self.name})"
+
+
+class ModelRegistry(object):
+    """
+    models by name, loaded on demand and evicted least recently used first above the budget.
+    the budget is at least the largest model loaded so far, a budget too small for one model
+    would evict every idle model on every load
+    """
+    def __init__(self, device: str, budget_gb: Optional[float] = None):
+        self.device = device
+        self.budget = int((budget_gb if budget_gb is not None else model_memory_budget(device)) * 1024 ** 3)
+        self._loaders: Dict[str, Callable] = {}
+        # name -> model on the device, least recently used first
+        self._resident = OrderedDict()
+        # name -> model moved to cpu, cuda only
+        self._offloaded = {}
+        self._sizes: Dict[str, int] = {}
+        self._in_use = defaultdict(int)
+        self._lock = threading.RLock()
+        # one lock per model, different models are loaded concurrently
+        self._load_locks = defaultdict(threading.Lock)
+
+    def register(self, name: str, loader: Callable) -> LazyModel:
+        """register loader() of a model, returns its lazy stand-in"""
+        self._loaders[name] = loader
+        return LazyModel(self, name)
+
+    def get(self, name: str):
+        """the model, loaded or moved back to the device if needed"""
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                return self._resident[name]
+            load_lock = self._load_locks[name]
+        with load_lock:
+            with self._lock:
+                # loaded by another thread meanwhile
+                if name in self._resident:
+                    return self._resident[name]
+            return self._load(name)
+
+    @contextmanager
+    def use(self, name: str):
+        """the model, not evicted until the block exits"""
+        while True:
+            model = self.get(name)
+            with self._lock:
+                # it may have been evicted again before it was pinned
+                if self._resident.get(name) is model:
+                    self._in_use[name] += 1
+                    break
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+
+    def load(self, names: Optional[List[str]] = None, background: bool = False):
+        """
+        load models concurrently now, e.g. at startup so the first document does not wait,
+        background returns at once and loads in a daemon thread
+        """
+        names = [name for name in (list(self._loaders) if names is None else names) if name in self._loaders]
+        if background:
+            threading.Thread(target=self.load, args=(names, ), daemon=True).start()
+            return
+        with ThreadPoolExecutor(max_workers=max(len(names), 1)) as executor:
+            list(executor.map(self.get, names))
+
+    def resident_bytes(self) -> Dict[str, int]:
+        """weight size of the models on the device"""
+        with self._lock:
+            return {name: self._sizes[name] for name in self._resident}
+
+    def _load(self, name: str):
+        """
+        load or move back a model under its load lock, the checkpoint is read without the registry lock,
+        then others are evicted above the budget
+        """
+        start = time.time()
+        with self._lock:
+            model = self._offloaded.pop(name, None)
+        if model is not None:
+            for module in torch_modules(model):
+                module.to(self.device)
+            action = "moved back to"
+        else:
+            model = self._loaders[name]()
+            action = "loaded on"
+        seconds = time.time() - start
+        with self._lock:
+            self._resident[name] = model
+            self._sizes[name] = model_bytes(model)
+            REGISTRY.inc("jungle_model_loads_total", help_text="models loaded or moved back to the device", model=name)
+            REGISTRY.inc("jungle_model_load_seconds_total", seconds,
+                         help_text="seconds spent loading models or moving them back", model=name)
+            logger.info(f"[models] {name} {action} {self.device} in {seconds:.1f} secs, "
+                        f"{self._sizes[name] / 1024 ** 2:.0f} MB")
+            self._evict(keep=name)
+        return model
+
+    def _evict(self, keep: str):
+        """evict idle models, least recently used first, until the resident ones fit the budget"""
+        total = sum(self._sizes[name] for name in self._resident)
+        budget = max(self.budget, max(self._sizes.values(), default=0))
+        for name in list(self._resident):
+            if total <= budget:
+                return
+            if name == keep or self._in_use[name] > 0:
+                continue
+            model = self._resident.pop(name)
+            total -= self._sizes[name]
+            if self.device == "cuda":
+                for module in torch_modules(model):
+                    module.to("cpu")
+                self._offloaded[name] = model
+                torch.cuda.empty_cache()
+            REGISTRY.inc("jungle_model_evictions_total", help_text="models evicted above the memory budget", model=name)
+            logger.info(f"[models] {name} evicted, {total / 1024 ** 3:.1f} GB resident")
+        if total > budget:
+            logger.warning(f"[models] {total / 1024 ** 3:.1f} GB resident, above the budget of "
+                           f"{budget / 1024 ** 3:.1f} GB, the other models are in use")
+
+
+def use_model(model):
+    """
+    context manager giving the model to run a stage with, lazy models are loaded and pinned,
+    other models are given as they are
+    """
+    if isinstance(model, LazyModel):
+        return model._registry.use(model.name)
+    return nullcontext(model)
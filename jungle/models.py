@@ -7,27 +7,29 @@
 ################################################################################
 """
 model setup script.
+the rock model packages pull in transformers and detectron2, they are imported by the setup functions,
+so importing this module, or convert, stays cheap until a model is loaded.
 
 Authors: yushilin(1329239119@qq.com)
 Date:    2024/07/29 17:08:41
 """
 
-from src.rock.model.detection.model import load_model, load_processor
+from concurrent.futures import ThreadPoolExecutor
+
 #from texify.model.model import load_model as load_texify_model
 #from texify.model.processor import load_processor as load_texify_processor
 import src.config_util as cfg
-from src.rock.model.recognition.model import load_model as load_recognition_model
-from src.rock.model.recognition.processor import load_processor as load_recognition_processor
-from src.rock.model.ordering.model import load_model as load_order_model
-from src.rock.model.ordering.processor import load_processor as load_order_processor
-from src.rock.model.layout.model import load_cpu_model, load_gpu_model
-from src.rock.model.table.model import load_table_model
+from src.jungle.model_registry import ModelRegistry
+from src.jungle.settings import settings
 
 
 def setup_recognition_model(checkpoint=None, langs=None, device=None, dtype=None):
     """
     load recognition model
     """
+    from src.rock.model.recognition.model import load_model as load_recognition_model
+    from src.rock.model.recognition.processor import load_processor as load_recognition_processor
+
     if langs is None:
         langs = ["zh", "en"]
     if checkpoint is None:
@@ -45,6 +47,8 @@ def setup_detection_model(device=None, dtype=None):
     """
     load line detection model
     """
+    from src.rock.model.detection.model import load_model, load_processor
+
     if device:
         model = load_model(checkpoint=cfg.LINE_DETECTION_MODEL_PATH, device=device, dtype=dtype)
     else:
@@ -74,6 +78,9 @@ def setup_order_model(checkpoint=None, device=None, dtype=None):
     """
     load order model
     """
+    from src.rock.model.ordering.model import load_model as load_order_model
+    from src.rock.model.ordering.processor import load_processor as load_order_processor
+
     if checkpoint is None:
         checkpoint = cfg.READING_ORDER_MODEL_PATH
     if device:
@@ -85,32 +92,62 @@ def setup_order_model(checkpoint=None, device=None, dtype=None):
     return model
 
 
-def load_all_models(langs=None, device=None, dtype=None, force_load_ocr=False):
+def load_layout_model(device):
+    """
+    load layout model, cpu and cuda have their own checkpoints
+    """
+    from src.rock.model.layout.model import load_cpu_model, load_gpu_model
+
+    if device == 'cpu':
+        return load_cpu_model(checkpoint=cfg.CPU_LAYOUT_MODEL_PATH, device=device)
+    elif device == 'cuda':
+        return load_gpu_model(checkpoint=cfg.GPU_LAYOUT_MODEL_PATH, device=device)
+    raise ValueError("Invalid device type")
+
+
+def load_table_model(device):
+    """
+    load table structure model
+    """
+    from src.rock.model.table.model import load_table_model as load_rock_table_model
+
+    return load_rock_table_model(checkpoint=cfg.TABLE_MODEL_PATH, device=device)
+
+
+def load_all_models(langs=None, device=None, dtype=None, force_load_ocr=False, lazy=None):
     """
-    load all models
+    load all models, lazy (LAZY_MODEL_LOADING by default) gives stand-ins loaded on first use
+    under the memory budget of a ModelRegistry, so detection and ocr are only loaded for scanned pages.
+    the checkpoints are independent and loaded concurrently, lazy loads PRELOAD_MODELS in the background
     """
     if device is not None:
         assert dtype is not None, "Must provide dtype if device is provided"
     if device is None:
         device = cfg.DEVICE
-    # langs is optional list of languages to prune from recognition MoE model
-    detection = setup_detection_model(device, dtype)
-    if device == 'cpu':
-        layout = load_cpu_model(checkpoint=cfg.CPU_LAYOUT_MODEL_PATH, device=device)
-    elif device == 'cuda':
-        layout = load_gpu_model(checkpoint=cfg.GPU_LAYOUT_MODEL_PATH, device=device)
-    else:
+    if device not in ('cpu', 'cuda'):
         raise ValueError("Invalid device type")
-    order = setup_order_model(checkpoint=cfg.READING_ORDER_MODEL_PATH, device=device, dtype=dtype)
+    if lazy is None:
+        lazy = settings.LAZY_MODEL_LOADING
+    # langs is optional list of languages to prune from recognition MoE model
+    loaders = {
+        "layout": lambda: load_layout_model(device),
+        "order": lambda: setup_order_model(checkpoint=cfg.READING_ORDER_MODEL_PATH, device=device, dtype=dtype),
+        "detection": lambda: setup_detection_model(device, dtype),
+        "ocr": lambda: setup_recognition_model(checkpoint=cfg.OCR_MODEL_PATH, langs=["zh", "en"],
+                                               device=device, dtype=dtype),
+    }
     #edit = load_editing_model(device, dtype)
-
-    # Only load recognition model if we'll need it for all pdfs
-    ocr = setup_recognition_model(checkpoint=cfg.OCR_MODEL_PATH, langs=["zh", "en"], device=device, dtype=dtype)
-
     #texify = setup_texify_model(device, dtype)
     if cfg.SHOULD_PARSE_TABLE:
-        table_model = load_table_model(checkpoint=cfg.TABLE_MODEL_PATH, device=device)
+        loaders["table"] = lambda: load_table_model(device)
+
+    if lazy:
+        registry = ModelRegistry(device)
+        models = {name: registry.register(name, loader) for name, loader in loaders.items()}
+        registry.load(settings.PRELOAD_MODELS, background=True)
     else:
-        table_model = None
-    model_lst = [layout, order, detection, ocr, table_model]
-    return model_lst
\ No newline at end of file
+        with ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+            futures = {name: executor.submit(loader) for name, loader in loaders.items()}
+        models = {name: future.result() for name, future in futures.items()}
+    model_lst = [models["layout"], models["order"], models["detection"], models["ocr"], models.get("table")]
+    return model_lst
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+process wide NLP engines (LAC, spacy, jieba), loaded once and shared by the parses.
+engines which are not thread safe are pooled, a thread borrows an instance for a call and
+at most NLP_ENGINE_POOL_SIZE instances of an engine are built.
+
+    with nlp_engine("lac") as lac:
+        words, tags = lac.run(text)
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Iterable, List, Tuple
+
+from loguru import logger
+
+from src.jungle.settings import settings
+
+
+def _lac(mode: str):
+    """LAC segmenter (seg) or segmenter with pos and entity tags (lac)"""
+    from LAC import LAC
+
+    return LAC(mode=mode)
+
+
+def _spacy(model_name: str):
+    """spacy pipeline"""
+    import spacy
+
+    return spacy.load(model_name)
+
+
+class EnginePool(object):
+    """
+    instances of one engine, built on demand, a thread safe engine has a single shared instance
+    """
+    def __init__(self, name: str, factory: Callable, size: int, thread_safe: bool = False):
+        self.name = name
+        self.factory = factory
+        self.size = 1 if thread_safe else max(size, 1)
+        self.thread_safe = thread_safe
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def borrow(self):
+        """an instance, kept by this thread until the block exits unless the engine is thread safe"""
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                engine = self._idle[-1] if self.thread_safe else self._idle.pop()
+            else:
+                engine = None
+                self._created += 1
+        if engine is None:
+            try:
+                engine = self._build()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+            if self.thread_safe:
+                with self._cond:
+                    self._idle.append(engine)
+                    self._cond.notify_all()
+        try:
+            yield engine
+        finally:
+            if not self.thread_safe:
+                with self._cond:
+                    self._idle.append(engine)
+                    self._cond.notify()
+
+    def _build(self):
+        """one more instance"""
+        start = time.time()
+        engine = self.factory()
+        logger.info(f"[nlp] {self.name} instance {self._created} loaded in {time.time() - start:.1f} secs")
+        return engine
+
+
+# name -> (factory(*args), thread safe)
+ENGINES: Dict[str, Tuple[Callable, bool]] = {
+    "lac_seg": (lambda: _lac("seg"), False),
+    "lac": (lambda: _lac("lac"), False),
+    "spacy": (_spacy, False),
+}
+
+_pools: Dict[Hashable, EnginePool] = {}
+_pools_lock = threading.Lock()
+
+
+def register_engine(name: str, factory: Callable, thread_safe: bool = False):
+    """add an engine, factory(*args) builds an instance for the args given to nlp_engine"""
+    ENGINES[name] = (factory, thread_safe)
+
+
+def engine_pool(name: str, *args) -> EnginePool:
+    """the process wide pool of an engine built with args"""
+    key = (name, ) + args
+    with _pools_lock:
+        if key not in _pools:
+            factory, thread_safe = ENGINES[name]
+            _pools[key] = EnginePool(name, lambda: factory(*args), settings.NLP_ENGINE_POOL_SIZE, thread_safe)
+        return _pools[key]
+
+
+def nlp_engine(name: str, *args):
+    """context manager lending an instance of the engine name built with args"""
+    return engine_pool(name, *args).borrow()
+
+
+def lac_run(name: str, texts: List[str]) -> List:
+    """LAC results of texts ("lac_seg" or "lac" engine), run in batches of NLP_BATCH_SIZE texts"""
+    results = []
+    if not texts:
+        return results
+    with nlp_engine(name) as lac:
+        for start in range(0, len(texts), settings.NLP_BATCH_SIZE):
+            results.extend(lac.run(texts[start:start + settings.NLP_BATCH_SIZE]))
+    return results
+
+
+def spacy_pipe(model_name: str, texts: List[str], disable: Iterable[str] = ()) -> List:
+    """spacy docs of texts, run through nlp.pipe without the disabled components"""
+    if not texts:
+        return []
+    with nlp_engine("spacy", model_name) as nlp:
+        disable = [name for name in disable if name in nlp.pipe_names]
+        return list(nlp.pipe(texts, batch_size=settings.NLP_BATCH_SIZE, disable=disable))
@@ -12,11 +12,13 @@ Authors: yushilin(1329239119@qq.com)
 Date:    2024/07/29 17:08:41
 """
 
+from functools import partial
 from typing import List
 
 from pypdfium2 import PdfDocument
 from src.rock.detection import batch_text_detection
 
+from src.jungle.batching import run_batched
 from src.jungle.pdf.images import render_image
 from src.jungle.schema.page import Page
 from src.jungle.settings import settings
@@ -34,12 +36,13 @@ def get_batch_size():
 def line_detection(doc: PdfDocument, pages: List[Page], det_model, batch_multiplier=1):
     """detect text line"""
     processor = det_model.processor
-    max_len = min(len(pages), len(doc))
     #images = [render_image(doc[pnum], dpi=settings.SURYA_DETECTOR_DPI) for pnum in range(max_len)]
     images = [page.page_image for page in pages]
 
-    predictions = batch_text_detection(images, det_model, processor, 
-                                        batch_size=int(get_batch_size() * batch_multiplier))
+    batch_size = int(get_batch_size() * batch_multiplier)
+    predictions = run_batched(("detection", id(det_model)),
+                              partial(batch_text_detection, model=det_model, processor=processor, batch_size=batch_size),
+                              [images], batch_size)
     for (page, pred) in zip(pages, predictions):
         page.text_lines = pred
 
@@ -13,6 +13,7 @@ Date:    2024/07/29 17:08:41
 """
 
 import tempfile
+from functools import partial
 from itertools import repeat
 from typing import List, Optional, Dict
 
@@ -22,7 +23,7 @@ from concurrent.futures import ThreadPoolExecutor
 
 from src.rock.ocr import run_recognition
 
-from src.jungle.models import setup_recognition_model
+from src.jungle.batching import run_batched
 from src.jungle.ocr.heuristics import should_ocr_page, no_text_found, detect_bad_ocr
 from src.jungle.ocr.lang import langs_to_ids
 from src.jungle.pdf.images import render_image
@@ -30,6 +31,8 @@ from src.jungle.schema.page import Page
 from src.jungle.schema.block import Block, Line, Span
 from src.jungle.settings import settings
 from src.jungle.pdf.extract_text import get_text_blocks
+from src.jungle.pdf.utils import PDFIUM_LOCK
+from src.jungle.page_cache import renumber_page
 
 
 def get_batch_size():
@@ -45,25 +48,35 @@ def get_batch_size():
     return 32
 
 
-def run_ocr(doc, pages: List[Page], langs: List[str], rec_model, batch_multiplier=1) -> (List[Page], Dict):
+def run_ocr(doc, pages: List[Page], langs: List[str], rec_model, batch_multiplier=1,
+            detected_idxs: Optional[List[int]] = None, 
+            forced_idxs: Optional[List[int]] = None) -> (List[Page], Dict):
     """
-    run ocr
+    run ocr on the detected pages which fail should_ocr_page,
+    pages in forced_idxs have an unusable text layer and are OCRed whenever text lines are detected
     """
-    ocr_pages = 0
     ocr_success = 0
     ocr_failed = 0
     no_text = no_text_found(pages)
-    ocr_idxs = list(range(len(pages)))
-
+    if detected_idxs is None:
+        detected_idxs = list(range(len(pages)))
+    if forced_idxs is None:
+        forced_idxs = detected_idxs
+    forced_idxs = set(forced_idxs)
+    ocr_idxs = [i for i in detected_idxs if should_ocr_page(pages[i], no_text or i in forced_idxs)]
+    ocr_pages = len(ocr_idxs)
 
     ocr_method = settings.OCR_ENGINE
 
     if ocr_method is None:
         return pages, {"ocr_pages": 0, "ocr_failed": 0, "ocr_success": 0, "ocr_engine": "none"}
+    elif not ocr_idxs:
+        return pages, {"ocr_pages": 0, "ocr_failed": 0, "ocr_success": 0, "ocr_engine": ocr_method}
     elif ocr_method == "rock":
         new_pages = rock_recognition(doc, ocr_idxs, langs, rec_model, pages, batch_multiplier=batch_multiplier)
     elif ocr_method == "ocrmypdf":
-        new_pages = tesseract_recognition(doc, ocr_idxs, langs)
+        # tesseract works on the pdf pages, so pass document page numbers
+        new_pages = tesseract_recognition(doc, [pages[i].pnum for i in ocr_idxs], langs)
     else:
         raise ValueError(f"Unknown OCR method {ocr_method}")
 
@@ -88,19 +101,21 @@ def rock_recognition(doc, page_idxs, langs: List[str],
     ocr recognition
     """
     #images = [render_image(doc[pnum], dpi=settings.SURYA_OCR_DPI) for pnum in page_idxs]
-    images = [page.page_image for page in pages]
-    processor = rec_model.processor
-    selected_pages = [p for i, p in enumerate(pages) if i in page_idxs]
+    selected_pages = [pages[i] for i in page_idxs]
+    images = [page.page_image for page in selected_pages]
 
     surya_langs = [langs] * len(page_idxs)
     detection_results = [p.text_lines.bboxes for p in selected_pages]
     polygons = [[b.polygon for b in bboxes] for bboxes in detection_results]
     #bboxes = [[b.bbox for b in bboxes] for bboxes in detection_results]
-    results = run_recognition(images, surya_langs, rec_model, processor, polygons=polygons,
-                                 batch_size=int(get_batch_size() * batch_multiplier))
+    batch_size = int(get_batch_size() * batch_multiplier)
+    results = run_batched(("recognition", id(rec_model)),
+                          partial(_run_recognition, rec_model, batch_size),
+                          [images, surya_langs, polygons], batch_size)
 
     new_pages = []
-    for (page_idx, result, old_page) in zip(page_idxs, results, selected_pages):
+    for (result, old_page) in zip(results, selected_pages):
+        page_idx = old_page.pnum
         text_lines = old_page.text_lines
         ocr_results = result.text_lines
         blocks = []
@@ -136,14 +151,24 @@ def rock_recognition(doc, page_idxs, langs: List[str],
     return new_pages
 
 
+def _run_recognition(rec_model, batch_size, images, langs, polygons):
+    """
+    run_recognition with the list arguments last, so calls of several documents can be merged
+    """
+    return run_recognition(images, langs, rec_model, rec_model.processor, polygons=polygons, batch_size=batch_size)
+
+
 def tesseract_recognition(doc, page_idxs, langs: List[str]) -> List[Optional[Page]]:
     """
-    tessract recognition
+    tessract recognition, every page is read from a single page pdf and moved back to its page number
     """
     pdf_pages = generate_single_page_pdfs(doc, page_idxs)
     with ThreadPoolExecutor(max_workers=settings.OCR_PARALLEL_WORKERS) as executor:
         pages = list(executor.map(_tesseract_recognition, pdf_pages, repeat(langs, len(pdf_pages))))
 
+    # the pages come back as page 0 of their pdf, with span ids 0_*
+    for page_idx, page in zip(page_idxs, pages):
+        renumber_page({"page": page, "first_lines": [], "last_lines": []}, page_idx)
     return pages
 
 
@@ -153,12 +178,13 @@ def generate_single_page_pdfs(doc, page_idxs) -> List[io.BytesIO]:
     """
     pdf_pages = []
     for page_idx in page_idxs:
-        blank_doc = pdfium.PdfDocument.new()
-        blank_doc.import_pages(doc, pages=[page_idx])
-        assert len(blank_doc) == 1, "Failed to import page"
+        with PDFIUM_LOCK:
+            blank_doc = pdfium.PdfDocument.new()
+            blank_doc.import_pages(doc, pages=[page_idx])
+            assert len(blank_doc) == 1, "Failed to import page"
 
-        in_pdf = io.BytesIO()
-        blank_doc.save(in_pdf)
+            in_pdf = io.BytesIO()
+            blank_doc.save(in_pdf)
         in_pdf.seek(0)
         pdf_pages.append(in_pdf)
     return pdf_pages
@@ -189,8 +215,9 @@ def _tesseract_recognition(in_pdf, langs: List[str]) -> Optional[Page]:
     with tempfile.NamedTemporaryFile() as f:
         f.write(out_pdf.getvalue())
         f.seek(0)
-        new_doc = pdfium.PdfDocument(f.name)
-        blocks, _ = get_text_blocks(new_doc, f.name, max_pages=1)
+        with PDFIUM_LOCK:
+            new_doc = pdfium.PdfDocument(f.name)
+            blocks, _ = get_text_blocks(new_doc, f.name, max_pages=1)
 
     page = blocks[0]
     page.ocr_method = "tesseract"
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+page level parse cache for revised documents.
+a page is keyed by a hash of its content stream and resources, so the unchanged pages of a new edition
+reuse their pdftext blocks, layout, order and table results, and only changed or new pages run the models.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import re
+import hashlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Union
+
+import fitz
+from loguru import logger
+
+from src.jungle.cache import DiskResultCache, model_fingerprint
+from src.jungle.pdf.session import DocumentSession
+from src.jungle.schema.page import Page
+from src.jungle.settings import settings
+
+
+# indirect reference in the source of a pdf object
+_REFERENCE = re.compile(r"(\d+) 0 R")
+
+
+def _object_digest(doc, xref: int, digests: Dict[int, bytes]) -> bytes:
+    """
+    hash of a pdf object, its stream and the objects it references, e.g. the font file and ToUnicode
+    stream of a font or the resources of a form xobject. the references are replaced by the hashes of
+    their objects, so the xref numbers are left out. digests caches the objects of the document
+    """
+    if xref in digests:
+        return digests[xref]
+    # a reference cycle hashes to nothing
+    digests[xref] = b""
+    sha = hashlib.sha256()
+    source = doc.xref_object(xref, compressed=True)
+    sha.update(_REFERENCE.sub(lambda match: _object_digest(doc, int(match.group(1)), digests).hex(),
+                              source).encode("utf-8"))
+    if doc.xref_is_stream(xref):
+        sha.update(doc.xref_stream_raw(xref))
+    digests[xref] = sha.digest()
+    return digests[xref]
+
+
+def _page_hash(doc, page, digests: Optional[Dict[int, bytes]] = None) -> str:
+    """
+    hash of the content stream, fonts, images and form xobjects of a page. the fonts are hashed with their
+    font programs and ToUnicode maps, the form xobjects with their resources, and xref numbers are left out
+    because they change when a pdf is re-saved. digests caches the objects shared by the pages
+    """
+    if digests is None:
+        digests = {}
+    sha = hashlib.sha256()
+    sha.update(repr((tuple(page.rect), page.rotation)).encode("utf-8"))
+    sha.update(page.read_contents())
+    for font in page.get_fonts(full=True):
+        (xref, ext, font_type, basefont, _, encoding) = font[:6]
+        sha.update(repr((ext, font_type, basefont, encoding)).encode("utf-8"))
+        if xref > 0:
+            sha.update(_object_digest(doc, xref, digests))
+    for image in page.get_images(full=True):
+        sha.update(_object_digest(doc, image[0], digests))
+    for xobject in page.get_xobjects():
+        sha.update(_object_digest(doc, xobject[0], digests))
+    return sha.hexdigest()
+
+
+def get_page_hashes(document: Union[str, bytes, DocumentSession],
+                    pnums: Optional[Iterable[int]] = None) -> Dict[int, str]:
+    """
+    content hash of pnums (every page by default) by page number
+    """
+    if isinstance(document, DocumentSession):
+        doc = document.fitz_doc
+        if pnums is None:
+            pnums = range(len(doc))
+        digests = {}
+        return {pnum: _page_hash(doc, doc[pnum], digests) for pnum in pnums}
+    if isinstance(document, str):
+        doc = fitz.open(document)
+    else:
+        doc = fitz.open(stream=document, filetype="pdf")
+    try:
+        if pnums is None:
+            pnums = range(len(doc))
+        digests = {}
+        return {pnum: _page_hash(doc, doc[pnum], digests) for pnum in pnums}
+    finally:
+        doc.close()
+
+
+def renumber_page(entry: Dict, pnum: int) -> Dict:
+    """
+    move a cached page entry to page number pnum, the page may have moved in the new edition
+    """
+    page = entry["page"]
+    if page.pnum == pnum:
+        return entry
+
+    old_prefix = f"{page.pnum}_"
+    new_prefix = f"{pnum}_"
+    lines = [line for block in page.blocks for line in block.lines]
+    lines += entry["first_lines"] + entry["last_lines"]
+    seen = set()
+    for line in lines:
+        for span in line.spans:
+            if id(span) in seen:
+                continue
+            seen.add(id(span))
+            if span.span_id.startswith(old_prefix):
+                span.span_id = new_prefix + span.span_id[len(old_prefix):]
+    for block in page.blocks:
+        block.pnum = pnum
+    page.pnum = pnum
+    return entry
+
+
+class PageCache(object):
+    """
+    per page cache of the model results, an entry holds the page after order and tables,
+    and its header footer candidate lines, taken in layout order
+    """
+    def __init__(self, cache: DiskResultCache):
+        self.cache = cache
+
+    def page_keys(self, document: Union[str, bytes, DocumentSession], pnums: Optional[Iterable[int]] = None,
+                  langs: Optional[List[str]] = None) -> Dict[int, str]:
+        """
+        cache key of pnums (every page by default) by page number. the OCR decision of a page only depends
+        on the page, langs are the OCR languages and part of the key
+        """
+        lang_key = hashlib.sha256("_".join(langs or []).encode("utf-8")).hexdigest()[:8]
+        suffix = f"{model_fingerprint()[:16]}_{lang_key}"
+        return {pnum: f"{page_hash}_{suffix}" for pnum, page_hash in get_page_hashes(document, pnums).items()}
+
+    def load(self, page_keys: Dict[int, str], pnums: Optional[List[int]] = None) -> Dict[int, Dict]:
+        """
+        cached entries of pnums (all pages of page_keys by default) by page number
+        """
+        if pnums is None:
+            pnums = list(page_keys)
+        entries = {}
+        for pnum in pnums:
+            try:
+                entry = self.cache.get(page_keys[pnum])
+            except Exception as e:
+                logger.warning(f"page cache get failed: {e}")
+                continue
+            if entry is not None:
+                entries[pnum] = renumber_page(entry, pnum)
+        logger.info(f"page cache hit {len(entries)} of {len(pnums)} pages")
+        return entries
+
+    def store(self, page_keys: Dict[int, str], pages: List[Page], candidates: Dict[int, tuple]):
+        """
+        store freshly parsed pages without their rasters and char blocks. the lines keep their text instead of
+        the chars of their spans, only the header and footer candidates keep a copy, see release_line_chars
+        """
+        for page in pages:
+            first_lines, last_lines = candidates[page.pnum]
+            entry = {
+                "page": page.model_copy(update={"page_image": None, "char_blocks": None, "text_lines": None}),
+                "first_lines": first_lines,
+                "last_lines": last_lines,
+            }
+            try:
+                self.cache.put(page_keys[page.pnum], entry)
+            except Exception as e:
+                logger.warning(f"page cache put failed: {e}")
+
+
+@lru_cache(maxsize=1)
+def get_page_cache() -> Optional[PageCache]:
+    """
+    build the page cache from settings, None if disabled
+    """
+    if not settings.PAGE_CACHE_DIR:
+        return None
+    return PageCache(DiskResultCache(settings.PAGE_CACHE_DIR, int(settings.PAGE_CACHE_MAX_GB * 1024 ** 3)))
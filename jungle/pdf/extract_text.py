@@ -24,7 +24,10 @@ from src.jungle.settings import settings
 from src.jungle.schema.block import Span, Line, Block
 from src.jungle.schema.page import Page
 from src.pdftext.extraction import dictionary_output
-from src.jungle.pdf.images import render_image 
+from src.jungle.pdf.images import render_page_image
+from src.jungle.metrics import stage
+from src.jungle.pdf.session import DocumentSession
+from src.jungle.utils import font_black_list
 
 os.environ["TESSDATA_PREFIX"] = settings.TESSDATA_PREFIX
 
@@ -99,13 +102,15 @@ def pdftext_format_to_blocks(page, pnum: int) -> Page:
         pnum=page["page"],
         bbox=page_bbox,
         rotation=rotation,
-        char_blocks=char_blocks
+        char_blocks=char_blocks,
+        diagnostics=page.get("diagnostics")
     )
     return out_page
 
 
 def get_text_blocks(doc, fname, max_pages: Optional[int] = None, 
-                    start_page: Optional[int] = None) -> (List[Page], Dict):
+                    start_page: Optional[int] = None, page_idxs: Optional[List[int]] = None,
+                    session: Optional[DocumentSession] = None) -> (List[Page], Dict):
     """
     从PDF文档中提取文本块并返回文本块列表以及目录信息。
     
@@ -114,6 +119,8 @@ def get_text_blocks(doc, fname, max_pages: Optional[int] = None,
         fname: PDF文档的文件名。
         max_pages: 可选参数，最多处理的页面数。
         start_page: 可选参数，开始处理的页面索引。
+        page_idxs: 可选参数，只处理这些页面（例如页面缓存未命中的页面），优先于 max_pages 和 start_page。
+        session: 可选参数，doc 所属的 DocumentSession，pdftext 和渲染复用其中缓存的页面，处理完的页面随后释放。
     
     Returns:
         包含两个元素的元组：
@@ -135,13 +142,35 @@ def get_text_blocks(doc, fname, max_pages: Optional[int] = None,
         max_pages = len(doc) - start_page
 
     page_range = range(start_page, start_page + max_pages)
-
-    char_blocks = dictionary_output(fname, page_range=page_range, keep_chars=True, workers=settings.PDFTEXT_CPU_WORKERS)
-    jungle_blocks = [pdftext_format_to_blocks(page, pnum) for pnum, page in enumerate(char_blocks)]
+    if page_idxs is not None:
+        page_range = page_idxs
+    if len(page_range) == 0:
+        return [], toc
+
+    get_page = session.get_page if session is not None else None
+    pool_args = {}
+    if session is not None and settings.PDFTEXT_POOL_WORKERS > 1:
+        # the pdftext workers read the bytes the render pool is given and split the pages by content length
+        pool_args = {"shared": session.shared_data(), "page_weights": session.page_weights(page_range)}
+    with stage("pdftext", pages=len(page_range)) as counts:
+        # the OCR diagnostics of every page are gathered in the same walk over the chars
+        char_blocks = dictionary_output(fname, page_range=page_range, keep_chars=True, 
+                                        workers=settings.PDFTEXT_POOL_WORKERS, pdf_doc=doc, get_page=get_page,
+                                        diagnostics=True, font_black_list=font_black_list, **pool_args)
+        jungle_blocks = [pdftext_format_to_blocks(page, page["page"]) for page in char_blocks]
+        counts["lines"] = sum(len(block.lines) for page in jungle_blocks for block in page.blocks)
     logger.info(f"render image begin")
-    for page in jungle_blocks:
-        page.page_image = render_image(doc[page.pnum], dpi=settings.IMAGE_DPI)
+    with stage("render", pages=len(jungle_blocks)):
+        if session is not None:
+            # rendered in the render pool, the stages attach the raster when they need it
+            for pnum, image in session.render_pages([page.pnum for page in jungle_blocks], settings.IMAGE_DPI):
+                session.rasters.put(pnum, image)
+        else:
+            for page in jungle_blocks:
+                page.page_image = render_page_image(doc[page.pnum], dpi=settings.IMAGE_DPI)
     logger.info(f"rendered image finish!")
+    if session is not None:
+        session.release_pages(page_range)
     return jungle_blocks, toc
 
 
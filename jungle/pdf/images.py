@@ -16,6 +16,7 @@ Date:    2024/07/29 17:08:41
 import pypdfium2 as pdfium
 from pypdfium2 import PdfPage
 
+from src.rock.input.page_image import PageImage
 from src.jungle.schema.page import Page
 from src.jungle.schema.bbox import rescale_bbox
 from src.jungle.settings import settings
@@ -49,6 +50,11 @@ def render_image(page: pdfium.PdfPage, dpi):
     return image
 
 
+def render_page_image(page: pdfium.PdfPage, dpi) -> PageImage:
+    """page image of pdf page, the raster every model stage reads"""
+    return PageImage.from_pil(render_image(page, dpi))
+
+
 def render_bbox_image(page_obj: PdfPage, page: Page, bbox):
     """render bbox image"""
     png_image = render_image(page_obj, settings.IMAGE_DPI)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+page raster store of one document.
+rasters are rendered once and attached to the pages only while a stage reads page.page_image.
+above RASTER_MEMORY_MB the least recently used detached rasters are spilled as png to RASTER_SPILL_DIR,
+or dropped and rendered again from the pdfium document when a later stage needs them.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from PIL import Image
+
+from src.rock.input.page_image import PageImage
+from src.jungle.metrics import count
+from src.jungle.pdf.images import render_page_image
+from src.jungle.pdf.utils import PDFIUM_LOCK
+from src.jungle.schema.page import Page
+from src.jungle.settings import settings
+
+
+class RasterStore(object):
+    """
+    rasters of the pages of a DocumentSession by page number
+    """
+    def __init__(self, session, dpi: int = None, max_mb: Optional[float] = None, spill_dir: Optional[str] = None):
+        self.session = session
+        self.dpi = dpi or settings.IMAGE_DPI
+        max_mb = settings.RASTER_MEMORY_MB if max_mb is None else max_mb
+        self.max_bytes = None if max_mb is None else int(max_mb * 1024 ** 2)
+        self.spill_dir = spill_dir or settings.RASTER_SPILL_DIR
+        # page number -> raster in memory, least recently used first
+        self._images = OrderedDict()
+        self._spilled: Dict[int, str] = {}
+        self._attached = Counter()
+        self._tmp_dir = None
+        self._lock = threading.RLock()
+        # rendered, spilled, loaded back, dropped and rendered again
+        self.stats = Counter()
+
+    def put(self, pnum: int, image: PageImage):
+        """add the raster of a page"""
+        with self._lock:
+            self._discard(pnum)
+            self._images[pnum] = image
+            self.stats["rendered"] += 1
+            self._shrink()
+
+    def get(self, pnum: int) -> PageImage:
+        """
+        the raster of a page, loaded from the spill file or rendered again if it left memory.
+        the store lock is not held while rendering, extraction holds PDFIUM_LOCK when it adds rasters
+        """
+        with self._lock:
+            if pnum in self._images:
+                self._images.move_to_end(pnum)
+                return self._images[pnum]
+            path = self._spilled.pop(pnum, None)
+        if path is not None:
+            with Image.open(path) as spilled:
+                image = PageImage.from_pil(spilled)
+            os.remove(path)
+            stat = "loaded"
+        else:
+            with PDFIUM_LOCK:
+                image = render_page_image(self.session.page(pnum), dpi=self.dpi)
+                self.session.release_pages([pnum])
+            stat = "rerendered"
+        with self._lock:
+            self.stats[stat] += 1
+            if pnum not in self._images:
+                self._images[pnum] = image
+            return self._images[pnum]
+
+    def attach(self, pages: Iterable[Page]) -> List[Page]:
+        """set page.page_image of pages for a stage, the rasters are not evicted until detach"""
+        pages = list(pages)
+        for page in pages:
+            with self._lock:
+                self._attached[page.pnum] += 1
+            page.page_image = self.get(page.pnum)
+        with self._lock:
+            self._shrink()
+        return pages
+
+    def detach(self, pages: Iterable[Page]):
+        """
+        the stage is done with the rasters of pages, page.page_image is cleared.
+        pages may hold several objects of a page, e.g. before and after OCR replaced it
+        """
+        with self._lock:
+            pnums = set()
+            for page in pages:
+                if page.page_image is not None:
+                    page.page_image = None
+                    pnums.add(page.pnum)
+            for pnum in pnums:
+                self._attached[pnum] -= 1
+                if self._attached[pnum] <= 0:
+                    del self._attached[pnum]
+            self._shrink()
+
+    def release(self, pnums: Iterable[int]):
+        """drop the rasters of pages no stage needs any more"""
+        with self._lock:
+            for pnum in pnums:
+                self._discard(pnum)
+
+    def close(self):
+        """drop every raster and the spill files, and add the counts to the document metrics"""
+        with self._lock:
+            self.release(list(self._images) + list(self._spilled))
+            if self._tmp_dir is not None:
+                shutil.rmtree(self._tmp_dir, ignore_errors=True)
+                self._tmp_dir = None
+            stats = {key: value for key, value in self.stats.items() if value}
+            self.stats = Counter()
+        if stats:
+            count("rasters", **stats)
+
+    def _discard(self, pnum: int):
+        """forget a raster, in memory or spilled"""
+        self._images.pop(pnum, None)
+        path = self._spilled.pop(pnum, None)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def _shrink(self):
+        """
+        spill or drop detached rasters, least recently used first, until memory is under the ceiling.
+        the resampled copies the stages cached on a raster count too, only the raster itself is spilled
+        """
+        if self.max_bytes is None:
+            return
+        total = sum(image.nbytes for image in self._images.values())
+        for pnum in list(self._images):
+            if total <= self.max_bytes:
+                return
+            if self._attached[pnum] > 0:
+                continue
+            image = self._images.pop(pnum)
+            total -= image.nbytes
+            if self.spill_dir:
+                if self._tmp_dir is None:
+                    os.makedirs(self.spill_dir, exist_ok=True)
+                    self._tmp_dir = tempfile.mkdtemp(dir=self.spill_dir, prefix="rasters_")
+                    # the spill files go with the store, also when the parse fails before close
+                    weakref.finalize(self, shutil.rmtree, self._tmp_dir, True)
+                path = os.path.join(self._tmp_dir, f"{pnum}.png")
+                # fast zlib level, the file only lives as long as the parse
+                image.to_pil().save(path, format="PNG", compress_level=1)
+                self._spilled[pnum] = path
+                self.stats["spilled"] += 1
+            else:
+                self.stats["dropped"] += 1
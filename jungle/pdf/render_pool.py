@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+persistent page render pool, RENDER_POOL_WORKERS processes which keep their own pdfium documents open.
+pdfium is not thread safe, so pages are rendered in processes instead of threads.
+the pdf bytes are handed to the workers once per document through shared memory, the workers
+render page ranges and return the raw RGB rasters in a shared memory block, no PIL image is pickled.
+the rasters are copied once out of the block into the page images.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from src.pdftext.pool import open_shared_document
+from src.rock.input.page_image import PageImage
+from src.jungle.pdf.images import render_image
+from src.jungle.settings import settings
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _render_range(name: str, size: int, pnums: List[int], dpi: int) -> Tuple[str, List[Tuple[int, int, int, int]]]:
+    """
+    worker side, render pnums into a new shared memory block,
+    returns its name and (pnum, width, height, offset) of every raster
+    """
+    doc = open_shared_document(name, size)
+    images = []
+    for pnum in pnums:
+        page = doc[pnum]
+        try:
+            images.append(render_image(page, dpi=dpi))
+        finally:
+            page.close()
+    out = SharedMemory(create=True, size=max(sum(image.width * image.height * 3 for image in images), 1))
+    layout = []
+    offset = 0
+    try:
+        for pnum, image in zip(pnums, images):
+            raw = image.tobytes()
+            out.buf[offset:offset + len(raw)] = raw
+            layout.append((pnum, image.width, image.height, offset))
+            offset += len(raw)
+    except Exception:
+        out.close()
+        out.unlink()
+        raise
+    out.close()
+    return out.name, layout
+
+
+def _collect(result: Tuple[str, List[Tuple[int, int, int, int]]]) -> List[Tuple[int, PageImage]]:
+    """copy the rasters of a finished range out of its shared memory block and free the block"""
+    name, layout = result
+    shm = SharedMemory(name=name)
+    try:
+        images = []
+        for pnum, width, height, offset in layout:
+            with shm.buf[offset:offset + width * height * 3] as raw:
+                images.append((pnum, PageImage(np.array(raw, dtype=np.uint8).reshape(height, width, 3))))
+        return images
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _discard(future):
+    """free the shared memory of a range nobody collects"""
+    try:
+        _collect(future.result())
+    except Exception:
+        pass
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    the process wide render pool, started on first use. the workers are spawned,
+    they do not inherit the torch and cuda state of the parse worker
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.RENDER_POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"[render] pool of {settings.RENDER_POOL_WORKERS} workers started")
+        return _pool
+
+
+def shutdown_render_pool():
+    """stop the workers, the next render starts a new pool"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def render_pages(shared: SharedMemory, size: int, pnums: List[int], dpi: int) -> Iterator[Tuple[int, PageImage]]:
+    """
+    (pnum, raster) of pnums in order, rendered by the pool in ranges of at most RENDER_CHUNK_PAGES pages.
+    shared holds the size pdf bytes and stays alive until the iteration ends
+    """
+    pnums = list(pnums)
+    chunk = max(1, min(settings.RENDER_CHUNK_PAGES, -(-len(pnums) // settings.RENDER_POOL_WORKERS)))
+    pool = get_render_pool()
+    futures = [pool.submit(_render_range, shared.name, size, pnums[start:start + chunk], dpi)
+               for start in range(0, len(pnums), chunk)]
+    collected = 0
+    try:
+        for future in futures:
+            images = _collect(future.result())
+            collected += 1
+            yield from images
+    except BrokenProcessPool:
+        # a worker died, e.g. killed on memory, the next render starts a new pool
+        shutdown_render_pool()
+        raise
+    finally:
+        # the iteration stopped early, the rasters of the other ranges are freed once they are rendered
+        for future in futures[collected:]:
+            if not future.cancel():
+                future.add_done_callback(_discard)
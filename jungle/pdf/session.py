@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+document session, one pdf shared by the stages of convert_single_pdf.
+each backend opens the bytes once: fitz for watermark removal, font check and page hashes,
+pdfium for pdftext and rendering. pdfium pages with their textpages and fitz text dicts
+are cached, so the stages do not parse the same pages again. the render and pdftext pool workers
+open their own pdfium documents from the bytes, shared with them once per document.
+not thread safe, use it under PDFIUM_LOCK.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import weakref
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import fitz
+import pypdfium2 as pdfium
+from loguru import logger
+
+from src.jungle.pdf.images import render_page_image
+from src.jungle.pdf.render_pool import render_pages
+from src.jungle.pdf.utils import page_content_length
+from src.jungle.settings import settings
+from src.jungle.utils import remove_watermark_from_doc
+from src.pdftext.pool import share_bytes
+
+
+class DocumentSession(object):
+    """
+    pdf bytes with their lazily opened fitz and pdfium documents and per page caches
+    """
+    def __init__(self, document: Union[str, bytes]):
+        if isinstance(document, str):
+            with open(document, "rb") as f:
+                document = f.read()
+        self.data = document
+        self._fitz_doc = None
+        self._pdfium_doc = None
+        # page number -> (pdfium page, textpage), least recently used first
+        self._pages = OrderedDict()
+        self._page_dicts = {}
+        self._rasters = None
+        self._shared = None
+        # page number -> estimated text, kept after fitz is released
+        self._page_weights = {}
+
+    @property
+    def fitz_doc(self):
+        """fitz document, opened on first use"""
+        if self._fitz_doc is None:
+            self._fitz_doc = fitz.open(stream=self.data, filetype="pdf")
+        return self._fitz_doc
+
+    @property
+    def pdfium_doc(self) -> pdfium.PdfDocument:
+        """pdfium document, opened on first use"""
+        if self._pdfium_doc is None:
+            self._pdfium_doc = pdfium.PdfDocument(self.data)
+        return self._pdfium_doc
+
+    @property
+    def rasters(self):
+        """page raster store, the rasters are rendered by get_text_blocks"""
+        if self._rasters is None:
+            from src.jungle.pdf.rasters import RasterStore
+            self._rasters = RasterStore(self)
+        return self._rasters
+
+    def shared_data(self):
+        """the bytes in shared memory for the render and pdftext pools, freed with the session"""
+        if self._shared is None:
+            self._shared = share_bytes(self.data)
+            self._shared_finalizer = weakref.finalize(self, _free_shared, self._shared)
+        return self._shared
+
+    def render_pages(self, pnums: List[int], dpi: int) -> Iterator[Tuple]:
+        """
+        (pnum, raster) of pnums in order, in the render pool for more than RENDER_POOL_MIN_PAGES pages.
+        pages left when the pool breaks are rendered in process
+        """
+        pnums = list(pnums)
+        done = set()
+        if settings.RENDER_POOL_WORKERS > 1 and len(pnums) >= settings.RENDER_POOL_MIN_PAGES:
+            try:
+                for pnum, image in render_pages(self.shared_data(), len(self.data), pnums, dpi):
+                    done.add(pnum)
+                    yield pnum, image
+            except BrokenProcessPool:
+                logger.warning(f"render pool broken, {len(pnums) - len(done)} pages rendered in process")
+        for pnum in pnums:
+            if pnum not in done:
+                yield pnum, render_page_image(self.page(pnum), dpi=dpi)
+
+    def __len__(self):
+        return len(self.pdfium_doc)
+
+    def get_page(self, pnum: int):
+        """
+        pdfium page and its textpage, at most SESSION_CACHE_PAGES pages are kept open
+        """
+        if pnum in self._pages:
+            self._pages.move_to_end(pnum)
+            return self._pages[pnum]
+        page = self.pdfium_doc.get_page(pnum)
+        self._pages[pnum] = (page, page.get_textpage())
+        while len(self._pages) > settings.SESSION_CACHE_PAGES:
+            self._pages.popitem(last=False)
+        return self._pages[pnum]
+
+    def page(self, pnum: int) -> pdfium.PdfPage:
+        """pdfium page"""
+        return self.get_page(pnum)[0]
+
+    def textpage(self, pnum: int) -> pdfium.PdfTextPage:
+        """pdfium textpage"""
+        return self.get_page(pnum)[1]
+
+    def page_dict(self, page) -> Dict:
+        """fitz text dict of a fitz page"""
+        if page.number not in self._page_dicts:
+            self._page_dicts[page.number] = page.get_text("dict")
+        return self._page_dicts[page.number]
+
+    def remove_watermark(self, pnums: Optional[Iterable[int]] = None):
+        """
+        remove watermarks of pnums (all pages by default) in place, the bytes are only written again
+        when a page changed or fitz had to repair the file
+        """
+        try:
+            changed_pages = remove_watermark_from_doc(self.fitz_doc, self.page_dict, pnums)
+        except Exception:
+            # the fitz document may be half modified, start again from the bytes
+            self.release_fitz()
+            raise
+        if not changed_pages and not self.fitz_doc.is_repaired:
+            return
+        logger.info(f"pdf rewritten, watermark removed from {len(changed_pages)} pages")
+        # content streams may be shared between pages, so no text dict is trusted after a change
+        self._page_dicts = {}
+        self._page_weights = {}
+        self.data = self.fitz_doc.tobytes()
+        self.release_shared()
+        self._pages = OrderedDict()
+        self._pdfium_doc = None
+
+    def page_weights(self, pnums: Iterable[int]) -> Dict[int, int]:
+        """
+        content stream length of pnums, how pdftext splits the pages between its workers.
+        read with fitz, so call it before release_fitz, the lengths are kept
+        """
+        pnums = list(pnums)
+        for pnum in pnums:
+            if pnum not in self._page_weights:
+                self._page_weights[pnum] = page_content_length(self.fitz_doc, pnum)
+        return {pnum: self._page_weights[pnum] for pnum in pnums}
+
+    def release_pages(self, pnums: Iterable[int]):
+        """drop the cached pdfium pages of pnums, e.g. once they are extracted and rendered"""
+        for pnum in pnums:
+            self._pages.pop(pnum, None)
+
+    def release_fitz(self):
+        """close the fitz document and drop its text dicts, once the fitz stages are done"""
+        self._page_dicts = {}
+        if self._fitz_doc is not None:
+            self._fitz_doc.close()
+            self._fitz_doc = None
+
+    def release_shared(self):
+        """free the shared bytes, e.g. once the bytes changed"""
+        if self._shared is not None:
+            self._shared_finalizer()
+            self._shared = None
+
+    def close(self):
+        """drop the rasters, the shared bytes and the open documents once the document is parsed"""
+        if self._rasters is not None:
+            self._rasters.close()
+        self.release_shared()
+        self.release_fitz()
+        self._pages = OrderedDict()
+        self._pdfium_doc = None
+
+
+def _free_shared(shm):
+    """close and unlink a shared memory block"""
+    shm.close()
+    shm.unlink()
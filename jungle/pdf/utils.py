@@ -13,12 +13,17 @@ Date:    2024/07/29 17:08:41
 """
 
 
+import threading
 from typing import Optional
 
 import filetype
 
 from src.jungle.settings import settings
 
+# pdfium and fitz are not thread safe, every pdfium call made off the main flow
+# (pipeline stages, ocr threads, documents converted concurrently) holds this lock
+PDFIUM_LOCK = threading.RLock()
+
 
 def find_filetype(fpath):
     """detect file type"""
@@ -40,6 +45,22 @@ def find_filetype(fpath):
         return "other"
 
 
+def page_content_length(doc, pnum: int) -> int:
+    """
+    stored bytes of the content streams of a fitz page, read from their Length without decoding them.
+    a cheap estimate of the text of a page, pdftext splits the pages between its workers by it
+    """
+    length = 0
+    for xref in doc[pnum].get_contents():
+        kind, value = doc.xref_get_key(xref, "Length")
+        if kind == "int":
+            length += int(value)
+        else:
+            # indirect length
+            length += len(doc.xref_stream_raw(xref))
+    return length
+
+
 def font_flags_decomposer(flags: Optional[int]) -> str:
     """font flags decomposer"""
     if flags is None:
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+stage overlapped pipeline, each stage runs in its own thread and stages are
+connected by bounded queues, so a cpu stage works on the next item while a
+model stage works on the current one.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import queue
+import threading
+import contextvars
+from typing import Callable, Iterable, List
+
+from loguru import logger
+
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+class _StageFailure(object):
+    """
+    exception raised by a stage, passed down the queues to the consumer
+    """
+    def __init__(self, stage_name: str, exception: Exception):
+        self.stage_name = stage_name
+        self.exception = exception
+
+
+def _put(out_queue: queue.Queue, item, stop_event: threading.Event) -> bool:
+    """put item, give up if the pipeline is stopped"""
+    while not stop_event.is_set():
+        try:
+            out_queue.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(in_queue: queue.Queue, stop_event: threading.Event):
+    """get item, return _DONE if the pipeline is stopped"""
+    while not stop_event.is_set():
+        try:
+            return in_queue.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _feed(source: Iterable, out_queue: queue.Queue, stop_event: threading.Event):
+    """push source items into the first queue"""
+    try:
+        for item in source:
+            if not _put(out_queue, item, stop_event):
+                return
+    except Exception as e:
+        _put(out_queue, _StageFailure("source", e), stop_event)
+    _put(out_queue, _DONE, stop_event)
+
+
+def _run_stage(stage: Callable, in_queue: queue.Queue, out_queue: queue.Queue, stop_event: threading.Event):
+    """apply stage to every item of in_queue, failures are passed through untouched"""
+    while True:
+        item = _get(in_queue, stop_event)
+        if item is _DONE:
+            _put(out_queue, _DONE, stop_event)
+            return
+
+        if not isinstance(item, _StageFailure):
+            try:
+                item = stage(item)
+            except Exception as e:
+                logger.error(f"pipeline stage {stage_name(stage)} failed: {e}")
+                item = _StageFailure(stage_name(stage), e)
+
+        if not _put(out_queue, item, stop_event):
+            return
+
+
+def stage_name(stage: Callable) -> str:
+    """readable name of a stage, also for functools.partial"""
+    func = getattr(stage, "func", stage)
+    return getattr(func, "__name__", repr(func))
+
+
+def run_pipeline(source: Iterable, stages: List[Callable], queue_size: int = 2):
+    """
+    run every stage in its own thread, yield the outputs of the last stage in source order.
+    at most queue_size items wait between two stages, which bounds the memory held by the pipeline.
+    an exception in any stage is raised in the consumer.
+    the threads run in copies of the consumer's context, so context variables such as the document metrics carry over.
+    """
+    stop_event = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(_feed, source, queues[0], stop_event),
+                                name="pipeline-source", daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=contextvars.copy_context().run,
+                                        args=(_run_stage, stage, queues[i], queues[i + 1], stop_event),
+                                        name=f"pipeline-{stage_name(stage)}", daemon=True))
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StageFailure):
+                raise item.exception
+            yield item
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+
+def run_sequential(source: Iterable, stages: List[Callable]):
+    """
+    same contract as run_pipeline, but every item runs through all stages on the calling thread
+    """
+    for item in source:
+        for stage in stages:
+            item = stage(item)
+        yield item
@@ -17,6 +17,7 @@ from src.jungle.schema.merged import MergedLine, MergedBlock, FullyMergedBlock
 from src.jungle.schema.page import Page
 from src.jungle.structure import Element, PDFStructure, AttrNorm
 from src.jungle.utils import is_chinese_character
+from src.pdftext.pdf.char_table import CharSlice
 import src.config_util as cfg
 
 import re
@@ -183,6 +184,27 @@ def get_line_text(line):
     result_text.replace("~", "\~")
     return result_text
 
+def release_line_chars(pages: List[Page], keep_span_ids=()):
+    """
+    keep the get_line_text of every line and drop the chars of its spans, a char slice pins the char table
+    of its page. lines with a span in keep_span_ids may still lose spans, e.g. header and footer candidates,
+    their spans keep a compact copy of their chars instead
+    """
+    keep_span_ids = set(keep_span_ids)
+    for page in pages:
+        for block in page.blocks:
+            for line in block.lines:
+                if any(span.span_id in keep_span_ids for span in line.spans):
+                    for span in line.spans:
+                        if isinstance(span.chars, CharSlice):
+                            span.chars = span.chars.compact()
+                    continue
+                if line.merged_text is None:
+                    line.merged_text = get_line_text(line)
+                for span in line.spans:
+                    span.chars = None
+
+
 def surround_text(s, char_to_insert):
     """surround text"""
     leading_whitespace = re.match(r'^(\s*)', s).group(1)
@@ -214,7 +236,7 @@ def merge_spans(pages: List[Page]) -> List[List[MergedBlock]]:
                 line_font_weights = []
 
 
-                line_text = get_line_text(line)
+                line_text = line.merged_text if line.merged_text is not None else get_line_text(line)
                 block_spans.extend(line.spans)
                 
                 # for i, span in enumerate(line.spans):
@@ -13,9 +13,9 @@ Date:    2024/07/29 17:08:41
 """
 
 import math
-from typing import List, Optional, Dict, Union
+from typing import Any, List, Optional, Dict
 
-from pydantic import field_validator
+from pydantic import field_serializer, field_validator
 import ftfy
 
 from src.jungle.schema.bbox import BboxElement
@@ -29,7 +29,7 @@ class BlockType(BboxElement):
 
 class Span(BboxElement):
     """span"""
-    chars: Union[List[Dict], None] = None # none if using ocr 
+    chars: Optional[Any] = None # CharSlice of the pdftext char table of the page, none if using ocr
     text: str
     span_id: str
     rotation: float
@@ -46,10 +46,16 @@ class Span(BboxElement):
     def fix_unicode(cls, text: str) -> str:
         return ftfy.fix_text(text)
 
+    @field_serializer('chars')
+    def dump_chars(self, chars) -> Optional[List[Dict]]:
+        """chars as dicts in model_dump"""
+        return None if chars is None else chars.to_list()
+
 
 class Line(BboxElement):
     """line"""
     spans: List[Span]
+    merged_text: Optional[str] = None # get_line_text of the line, kept once the chars of its spans are dropped
 
     @property
     def prelim_text(self):
@@ -118,6 +124,8 @@ class Block(BboxElement):
             for span in line.spans:
                 if not span.span_id in bad_span_ids:
                     new_spans.append(span)
+            if len(new_spans) < len(line.spans):
+                line.merged_text = None
             line.spans = new_spans
             if len(new_spans) > 0:
                 new_lines.append(line)
@@ -29,9 +29,10 @@ class Page(BboxElement):
     layout: Optional[LayoutResult] = None
     order: Optional[OrderResult] = None
     ocr_method: Optional[str] = None # One of "rock" or "tesseract"
-    char_blocks: Optional[List[Dict]] = None # Blocks with character-level data from pdftext
+    char_blocks: Optional[List[Dict]] = None # Blocks with character-level data from pdftext, the spans share the char tables of the page spans
     images: Optional[List[Any]] = None # Images to save along with the page, need Any to avoid pydantic error
-    page_image: Optional[Any] = None # Image of the page itself
+    page_image: Optional[Any] = None # PageImage of the page itself, the read-only raster the model stages share
+    diagnostics: Optional[Dict] = None # Text layer diagnostics from pdftext, see pdftext.pdf.chars.page_diagnostics
 
     def get_nonblank_lines(self):
         """get nonblank lines"""
@@ -27,7 +27,9 @@ class Settings(BaseSettings):
     # General
     TORCH_DEVICE: Optional[str] = None # Note: MPS device does not work for text detection, and will default to CPU
     IMAGE_DPI: int = 96 # DPI to render images pulled from pdf at
-    IMAGE_DPI_WORKERS: int = 6 # How many CPU workers to use for image rendering
+    IMAGE_DPI_WORKERS: int = 6 # How many CPU workers to use for image rendering, a persistent process pool sharing the CPU count with pdftext
+    RENDER_CHUNK_PAGES: int = 8 # Pages per render task, the rasters of a task come back in one shared memory block
+    RENDER_POOL_MIN_PAGES: int = 4 # Fewer pages are rendered in process, the pool is not worth the handoff
     EXTRACT_IMAGES: bool = True # Extract images from pdfs and save them
     MODELS_DIR: str = "/home/disk1/yushilin/code/parser/vikp/parser/models"
 
@@ -50,6 +52,8 @@ class Settings(BaseSettings):
     # How much VRAM to allocate per task (in GB).  Peak marker
     # VRAM usage is around 5GB, but avg across workers is lower.
     VRAM_PER_TASK: float = 4.5 
+    INFERENCE_CPU_RAM: int = 16 # How much RAM the models and the parse workers may use on cpu (in GB)
+    RAM_PER_TASK: float = 3 # How much RAM to allocate per task on cpu (in GB)
     # Default language we assume files to be in, should be one of the keys in TESSERACT_LANGUAGES
     DEFAULT_LANG: str = "ch" 
 
@@ -58,7 +62,49 @@ class Settings(BaseSettings):
     }
 
     # Text extraction
-    PDFTEXT_CPU_WORKERS: int = 10 # How many CPU workers to use for pdf text extraction
+    PDFTEXT_CPU_WORKERS: int = 10 # How many CPU workers to use for pdf text extraction, a persistent process pool sharing the CPU count with the render pool
+
+    # Streaming
+    # Pages pushed through extraction, rendering and the models at a time, None processes the whole document at once
+    PAGE_WINDOW_SIZE: Optional[int] = None
+    # Overlap extraction, layout and ordering of consecutive page windows in separate threads
+    PIPELINE_STAGES: bool = False
+    PIPELINE_QUEUE_SIZE: int = 2 # Page windows buffered between two pipeline stages
+
+    # Result cache
+    RESULT_CACHE_DIR: Optional[str] = None # Local parse result cache folder, None disables the local cache
+    RESULT_CACHE_MAX_GB: float = 5 # Least recently used results are evicted above this size
+    RESULT_CACHE_SHARED: bool = False # Also share results between servers in the parse_result_cache pg table
+    PAGE_CACHE_DIR: Optional[str] = None # Page level cache folder, unchanged pages of a revised document skip the models
+    PAGE_CACHE_MAX_GB: float = 20 # Least recently used pages are evicted above this size
+
+    # Dynamic batching
+    DYNAMIC_BATCHING: bool = False # Parse the files of a request concurrently and merge their model calls into shared batches
+    BATCHING_MAX_WAIT: float = 0.05 # Seconds a model call waits for the calls of other documents
+    BATCHING_MAX_DOCUMENTS: int = 8 # Documents parsed concurrently
+
+    # Parse jobs
+    JOB_WORKERS: int = 2 # Parse workers of the async job api
+    JOB_MAX_QUEUED: int = 10000 # Jobs waiting for a worker, submit fails above this
+    JOB_PROGRESS_INTERVAL: float = 2 # Seconds between two progress writes of a job
+    PREVIEW_PAGES: int = 5 # Pages parsed by a preview request, DocumentType reads the first 5 pages
+
+    # Document session
+    SESSION_CACHE_PAGES: int = 200 # Pdfium pages and textpages kept open per document, shared by the stages
+    RASTER_MEMORY_MB: Optional[float] = 2048 # Page rasters kept in memory per document, None keeps all of them
+    RASTER_SPILL_DIR: Optional[str] = None # Rasters above RASTER_MEMORY_MB are saved here as png, None drops them and renders them again
+
+    # Model loading
+    LAZY_MODEL_LOADING: bool = True # Load every model on first use, detection and ocr only for scanned pages
+    PRELOAD_MODELS: List[str] = ["layout", "order"] # Lazy models loaded in the background at startup, every document needs them
+    MODEL_MEMORY_GB: Optional[float] = None # Memory the loaded models may use, None is INFERENCE_RAM minus VRAM_PER_TASK per parse worker on cuda, INFERENCE_CPU_RAM minus RAM_PER_TASK per parse worker otherwise
+
+    # NLP engines
+    NLP_ENGINE_POOL_SIZE: int = 2 # Instances of each LAC and spacy engine per process, a parse thread borrows one per call
+    NLP_BATCH_SIZE: int = 64 # Texts per LAC run and spacy pipe batch
+
+    # Metrics
+    METRICS_PORT: Optional[int] = None # Serve the stage metrics in the prometheus text format on this port, per process
 
     # Text line Detection
     DETECTOR_BATCH_SIZE: Optional[int] = 12 # Defaults to 6 for CPU, 12 otherwise
@@ -67,10 +113,12 @@ class Settings(BaseSettings):
     DETECTOR_POSTPROCESSING_CPU_WORKERS: int = 4
 
     # OCR
+    BLACKLISTED_FONT_MAX_CHARS: int = 5 # Pages with more chars in black listed fonts are OCRed, the cmaps of these fonts can not be trusted
     INVALID_CHARS: List[str] = [chr(0xfffd), "�"]
     # Which OCR engine to use, either "surya" or "ocrmypdf".  Defaults to "ocrmypdf" on CPU, "surya" on GPU.
     OCR_ENGINE: Optional[Literal["rock", "ocrmypdf"]] = "rock" 
     OCR_ALL_PAGES: bool = False # Run OCR on every page even if text can be extracted
+    OCR_COVERAGE_CHECK: bool = False # Run line detection on every page to find text lines missing from the text layer
 
     ## Surya
     SURYA_OCR_DPI: int = 96
@@ -136,6 +184,24 @@ class Settings(BaseSettings):
         """texify dtype"""
         return torch.float32 if self.TORCH_DEVICE_MODEL == "cpu" else torch.float16
 
+    @computed_field
+    @property
+    def RENDER_POOL_WORKERS(self) -> int:
+        """render pool size, IMAGE_DPI_WORKERS and PDFTEXT_CPU_WORKERS share the cpus by their ratio"""
+        cpus = os.cpu_count() or 1
+        requested = self.IMAGE_DPI_WORKERS + self.PDFTEXT_CPU_WORKERS
+        if requested <= cpus:
+            return max(1, self.IMAGE_DPI_WORKERS)
+        return max(1, self.IMAGE_DPI_WORKERS * cpus // requested)
+
+    @computed_field
+    @property
+    def PDFTEXT_POOL_WORKERS(self) -> int:
+        """pdftext pool size, the cpus the render pool leaves, all of them when pages are rendered in process"""
+        cpus = os.cpu_count() or 1
+        render = self.RENDER_POOL_WORKERS if self.RENDER_POOL_WORKERS > 1 else 0
+        return max(1, min(self.PDFTEXT_CPU_WORKERS, cpus - render))
+
 
     class Config:
         """config"""
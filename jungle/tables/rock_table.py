@@ -12,7 +12,6 @@ Authors: yushilin(1329239119@qq.com)
 Date:    2024/07/29 17:08:41
 """
 
-from bs4 import BeautifulSoup
 from typing import List
 from src.jungle.schema.page import Page
 from src.jungle.schema.bbox import merge_boxes, box_intersection_pct, rescale_bbox
@@ -45,6 +44,8 @@ def get_cell_box(table):
     """
     convert table to bbox
     """   
+    from bs4 import BeautifulSoup
+
     # get number rows and number columns
     htmltable = "".join(table)
     soup = BeautifulSoup(htmltable, 'html.parser')
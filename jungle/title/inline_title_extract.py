@@ -7,7 +7,8 @@
 import re
 import json
 import math
-from LAC import LAC
+
+from src.jungle.nlp import lac_run
 
 
 
@@ -60,7 +61,6 @@ class HeaderExtracter():
                                      r"^[\u4e00-\u9fffa-zA-Z、,\(\)（）\s\.\d，]{1,30}[。?？！①②③④⑤]", 
                                      r"^[\[【][\u4e00-\u9fff、]{1,20}[】\]]",
                                     ]  #第一篇  、、、
-        self.seg = LAC(mode="seg")
         #self.un_meanful_loc = ["m","xc","w","u"]  # 普通名词， 其他专名词，形容词，数量词，人名，方位名词，普通动词，
         self.sure_title = [0, 1, 2, 3, 4, 7]
 
@@ -68,6 +68,22 @@ class HeaderExtracter():
         """
         如果content 中包含标题，然后提取出来
         """
+        return self.extract_batch([element])[0]
+
+    def extract_batch(self, elements):
+        """
+        批量提取, 先用正则提取, 没有匹配到的一起分词
+        """
+        unmatched = [element for element in elements if not self.extract_by_pattern(element)]
+        seg_results = lac_run("lac_seg", [element.text.strip() for element in unmatched])
+        for element, seg_result in zip(unmatched, seg_results):
+            self.extract_by_seg(element, seg_result)
+        return elements
+
+    def extract_by_pattern(self, element):
+        """
+        正则提取 inline header, 返回 False 表示需要分词
+        """
         content = element.text
         ## 判断是否包含 inline header
         content = content.strip()
@@ -76,7 +92,7 @@ class HeaderExtracter():
             searched = re.search(re_str, search_content.lstrip())
             if searched:
                 if searched.span()[1] == len(search_content):
-                    return element
+                    return True
                 else:
 
                     extracted_content = content[searched.span()[1]:] if i in self.sure_title else content
@@ -86,11 +102,15 @@ class HeaderExtracter():
                         element.text = searched.group()[:-1] + "\n\n" + extracted_content
                     else:
                         element.text = searched.group() + "\n\n" + extracted_content
-                    return element
-            
+                    return True
         #如果没有 search 到，进行分词
-        seg_result = self.seg.run(search_content)
+        return False
 
+    def extract_by_seg(self, element, seg_result):
+        """
+        用分词结果的前几个 token 作为标题
+        """
+        content = element.text.strip()
 
         # 提取前5个 token
         append_token = []
@@ -1388,13 +1388,13 @@ class DynamicTitleParser(object):
                 structure[index].leafNode = False
         
         # 所有的非叶子节点提取其标题，如果有行内标题标识，则直接提取标题，如果没有则提取前12个字，并打上『...』
+        # 提取只改非叶子节点的文本, 不影响叶子节点的判断, 所以先批量提取
+        non_leaf_headers = [header for header in structure
+                            if not header.leafNode and header.title_level != -1
+                            and count_ch_characters(header.text) > 30
+                            and re.search(r'[\u4e00-\u9fff]', header.text)]
+        self.header_extracter.extract_batch(non_leaf_headers)
         for index, header in enumerate(structure):
-            #非叶子节点
-            if not header.leafNode and header.title_level != -1 \
-                and count_ch_characters(header.text) > 30 \
-                    and re.search(r'[\u4e00-\u9fff]', header.text):
-                    
-                header = self.header_extracter.extract(header)
             # 叶子节点
             if header.leafNode and count_ch_characters(header.text) > 50:
                 header.title_level = -1
@@ -19,6 +19,7 @@ from loguru import logger
 import fitz
 from fontTools.ttLib import TTFont
 from io import BytesIO
+from collections import Counter
 from PIL import Image, ImageDraw 
 import base64
 
@@ -105,6 +106,18 @@ def black_list_check(font_name):
     return False
 
 
+def _page_dict(page):
+    """text dict of a fitz page"""
+    return page.get_text("dict")
+
+
+def _select_pages(doc, pnums=None):
+    """fitz pages of pnums, all pages by default"""
+    if pnums is None:
+        return iter(doc)
+    return (doc[pnum] for pnum in pnums)
+
+
 def check_font_is_support(file_bytes):
     """
     check pdf file's font support
@@ -149,11 +162,24 @@ def check_font_is_support(file_bytes):
 def remove_watermark(file_bytes):
     """remove watermark"""
     doc = fitz.open(stream=file_bytes, filetype="pdf")
+    remove_watermark_from_doc(doc)
+    return doc.tobytes()
+
+
+def remove_watermark_from_doc(doc, get_page_dict=_page_dict, pnums=None):
+    """
+    remove text and image watermarks from an open fitz document in place,
+    get_page_dict(page) may return cached text dicts. returns the numbers of the changed pages.
+    pnums limits the removal to these pages. an image is a watermark when it is on every page of the document,
+    also with pnums, so the selected pages lose the same images as in a full parse
+    """
+    changed_pages = set()
+    num_pages = len(doc)
     # delete text watermark
 
 
-    for page in doc:
-        blocks = page.get_text("dict")["blocks"]
+    for page in _select_pages(doc, pnums):
+        blocks = get_page_dict(page)["blocks"]
         retoted_found = False
         for block in blocks:
             if "lines" in block:
@@ -211,17 +237,28 @@ def remove_watermark(file_bytes):
             if changed > 0:  # if we did anything, write back modified /Contents
                 logger.info("update stream")
                 doc.update_stream(xref, b"\n".join(new_lines))
+                changed_pages.add(page.number)
     logger.info("finish remove text watermark")
     # delete image workmark
 
     image_dict = {}
-    if len(doc) > 1:
-        for page in doc: 
+    if num_pages > 1:
+        # get_images is cheap, the image rects are only looked up for images on every page
+        candidates = Counter()
+        for page in doc:
+            for img in page.get_images():
+                if img[4] != 1:
+                    (xref, smask, width, height, bpc, colorspace, alt, colorspace, name) = img
+                    candidates[str((width, height, bpc, name))] += 1
+        for page in doc:
             img_list = page.get_images()
             for img in img_list:
                 if img[4] == 1:
                     continue
                 (xref, smask, width, height, bpc, colorspace, alt, colorspace, name) = img
+                image_info = str((width, height, bpc, name))
+                if candidates[image_info] < num_pages:
+                    continue
 
                 img_rects = page.get_image_rects(xref)
                 if img_rects:
@@ -230,36 +267,36 @@ def remove_watermark(file_bytes):
                         int(img_rect.x1) == int(page.rect.width) and int(img_rect.y1) == int(page.rect.height):
                         continue
 
-            
-                image_info = str((width, height, bpc, name))
                 if image_info in image_dict:
                     image_dict[image_info] += 1
                 else:
                     image_dict[image_info] = 1
         watermarks = []
         for img, number in image_dict.items():
-            if number >= len(doc):
+            if number >= num_pages:
                 watermarks.append(img)
 
-        for page in doc:
+        for page in _select_pages(doc, pnums):
             img_list = page.get_images()
             for img in img_list:
                 (xref, smask, width, height, bpc, colorspace, alt, colorspace, name) = img
                 image_info = str((width, height, bpc, name))
                 if image_info in watermarks:
                     page.delete_image(xref)
+                    changed_pages.add(page.number)
     logger.info("finish remove image watermark")
-    return doc.tobytes()
+    return changed_pages
 
 
-def debug_pdf(pages):
+def debug_pdf(pages, get_image=None):
     """
-    debug pdf
+    debug pdf, get_image(page) gives the raster of a page when it is not set on the page
     """
     save_images = []
     buffers = []
     for page in pages:
-        drawing_image = page.page_image.copy()
+        image = get_image(page) if get_image is not None else page.page_image
+        drawing_image = image.to_pil()
         drawing = ImageDraw.Draw(drawing_image)
         for posid, block in enumerate(page.blocks):
             drawing.rectangle(block.bbox, outline="red")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+async parse jobs. submit returns at once, a fixed pool of parse workers takes jobs from a bounded queue.
+job status, per stage progress and result urls live in structured_parsed_result,
+the progress in its parse_progress (text) column, so any server process can answer a poll.
+the column is added by PARSE_JOBS_DDL when the queue starts, see ensure_job_schema.
+the server starts the process wide queue once with start_job_queue, the sync api never touches it.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import queue
+import asyncio
+import threading
+import traceback
+
+from typing import Dict, Optional
+from loguru import logger
+from datetime import datetime
+
+from src import connect
+from src.error.errors import RepeatedParseException, RetryableException
+from src.jungle.batching import document_in_flight
+from src.jungle.metrics import DocumentMetrics
+from src.jungle.schema.entity import ParseStatus
+from src.jungle.settings import settings
+
+
+ASYNC_QUEUE_FULL = 5015
+_STOP = object()
+
+# migration of the async jobs, the only column they add to structured_parsed_result
+PARSE_JOBS_DDL = "ALTER TABLE structured_parsed_result ADD COLUMN IF NOT EXISTS parse_progress text"
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+class JobProgress(object):
+    """
+    pages done per stage of one job, written to the db at most every JOB_PROGRESS_INTERVAL seconds
+    """
+    def __init__(self, job_id: str, owner: Optional[str] = None):
+        self.job_id = job_id
+        # host:pid of the process running the job, a restarted process fails the jobs it lost
+        self.owner = owner
+        self.total_pages = 0
+        self.stages = {}
+        self.metrics = DocumentMetrics()
+        self._lock = threading.Lock()
+        self._last_write = 0
+
+    def __call__(self, stage: str, num_pages: int):
+        """progress callback of convert_single_pdf, called from pipeline threads too"""
+        with self._lock:
+            if stage == "total":
+                self.total_pages = num_pages
+            else:
+                self.stages[stage] = self.stages.get(stage, 0) + num_pages
+            now = time.monotonic()
+            if now - self._last_write < settings.JOB_PROGRESS_INTERVAL:
+                return
+            self._last_write = now
+            progress = self.to_json()
+        _update_job(self.job_id, parse_progress=progress)
+
+    def to_json(self, with_metrics: bool = False) -> str:
+        """progress as json text, with_metrics adds the stage times and counts"""
+        progress = {"total_pages": self.total_pages, "stages": self.stages}
+        if self.owner:
+            progress["owner"] = self.owner
+        if with_metrics:
+            progress["metrics"] = self.metrics.to_dict()
+        return json.dumps(progress)
+
+
+def _process_alive(pid: int) -> bool:
+    """whether a process of this host is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _update_job(job_id: str, **columns):
+    """update columns of the job row"""
+    columns["update_time"] = datetime.now()
+    assignments = ", ".join(f"{name} = %s" for name in columns)
+    sql = f"UPDATE structured_parsed_result SET {assignments} WHERE file_id = %s"
+    with connect.conn_pool as conn:
+        conn.execute(sql, list(columns.values()) + [job_id])
+
+
+def ensure_job_schema():
+    """add the parse_progress column if the table does not have it yet"""
+    with connect.conn_pool as conn:
+        conn.execute(PARSE_JOBS_DDL)
+
+
+def start_job_queue(pdf_parser) -> "ParseJobQueue":
+    """
+    start the process wide job queue once, later calls return it. pdf_parser is a FileParse,
+    its models are shared by the workers. called by the server of every worker process
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            ensure_job_schema()
+            _job_queue = ParseJobQueue(pdf_parser)
+            _job_queue.start()
+        return _job_queue
+
+
+def get_job_queue() -> "ParseJobQueue":
+    """the job queue started by start_job_queue"""
+    if _job_queue is None:
+        raise RuntimeError("parse job queue is not started, call start_job_queue first")
+    return _job_queue
+
+
+class ParseJobQueue(object):
+    """
+    bounded queue of parse jobs served by a fixed number of worker threads
+    """
+    def __init__(self, pdf_parser, workers: Optional[int] = None, max_queued: Optional[int] = None):
+        """
+        pdf_parser is a FileParse, its models are shared by all workers. nothing runs before start
+        """
+        self.pdf_parser = pdf_parser
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._queue = queue.Queue(maxsize=max_queued or settings.JOB_MAX_QUEUED)
+        self._workers = [threading.Thread(target=self._work, name=f"parse-job-{i}", daemon=True)
+                         for i in range(workers or settings.JOB_WORKERS)]
+
+    def start(self):
+        """fail the jobs lost by a previous process and start the workers"""
+        self._fail_lost_jobs()
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, file_data: Dict) -> str:
+        """
+        queue a parse job and return its id, the file_id if given.
+        a file parsed successfully is only parsed again when its url changed or file_data has force set,
+        otherwise its job id is returned. a file queued or being parsed raises RepeatedParseException
+        like the sync api
+        """
+        job_id = str(file_data.get("file_id") or uuid.uuid4().hex)
+        file_data = dict(file_data, file_id=job_id)
+        force = bool(file_data.get("force", False))
+
+        # the row is only taken over when no parse of the file is queued or running,
+        # and a parsed file only for another url or a forced parse
+        sql = """
+        INSERT INTO
+            structured_parsed_result (file_id, file_type, file_name, file_url, parse_status, parse_progress, update_time)
+        VALUES
+            (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (file_id) DO
+            UPDATE SET
+                file_type = EXCLUDED.file_type,
+                file_name = EXCLUDED.file_name,
+                file_url = EXCLUDED.file_url,
+                parse_status = EXCLUDED.parse_status,
+                parse_progress = EXCLUDED.parse_progress,
+                update_time = EXCLUDED.update_time
+            WHERE structured_parsed_result.parse_status = %s
+                OR (structured_parsed_result.parse_status = %s
+                    AND (%s OR structured_parsed_result.file_url IS DISTINCT FROM EXCLUDED.file_url));
+        """
+        with connect.conn_pool as conn:
+            taken = conn.execute_rowcount(sql, [
+                job_id,
+                file_data.get("file_type", "pdf"),
+                file_data.get("file_name", ""),
+                file_data.get("url", ""),
+                ParseStatus.PREPARE,
+                JobProgress(job_id, self.owner).to_json(),
+                datetime.now(),
+                ParseStatus.FAILED,
+                ParseStatus.SUCCESS,
+                force,
+            ])
+            if not taken:
+                r = conn.fetchone("SELECT parse_status FROM structured_parsed_result WHERE file_id=%s", [job_id])
+        if not taken:
+            if r is not None and r.parse_status == ParseStatus.SUCCESS:
+                logger.info(f"[job] {job_id} already parsed")
+                return job_id
+            raise RepeatedParseException(-1, "please do not call repeatedly", None)
+
+        try:
+            self._queue.put_nowait(file_data)
+        except queue.Full:
+            _update_job(job_id, parse_status=ParseStatus.FAILED,
+                        parse_progress=json.dumps({"error": "parse job queue is full"}))
+            raise RetryableException(ASYNC_QUEUE_FULL, "parse job queue is full, please retry later", None)
+        logger.info(f"[job] submitted {job_id}, {self._queue.qsize()} queued")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        status, progress and result urls of a job, None if unknown
+        """
+        sql = """
+        SELECT file_id, parse_status, parse_progress, language, knowledge_type, json_tree_url, markdown_url
+        FROM structured_parsed_result WHERE file_id=%s
+        """
+        with connect.conn_pool as conn:
+            r = conn.fetchone(sql, [job_id])
+        if not r:
+            return None
+        return {
+            "job_id": r.file_id,
+            "parse_status": r.parse_status,
+            "progress": json.loads(r.parse_progress) if r.parse_progress else {},
+            "language": r.language,
+            "knowledge_type": r.knowledge_type,
+            "json_tree_url": r.json_tree_url,
+            "markdown_url": r.markdown_url,
+        }
+
+    def stream(self, job_id: str, interval: float = 1.0):
+        """
+        yield the job status whenever it changes, until the job succeeds or fails
+        """
+        last = None
+        while True:
+            job = self.get(job_id)
+            if job != last:
+                yield job
+                last = job
+            if job is None or job["parse_status"] in (ParseStatus.SUCCESS, ParseStatus.FAILED):
+                return
+            time.sleep(interval)
+
+    async def astream(self, job_id: str, interval: float = 1.0):
+        """
+        stream for asyncio servers, the db polls run in the default executor
+        """
+        loop = asyncio.get_running_loop()
+        last = None
+        while True:
+            job = await loop.run_in_executor(None, self.get, job_id)
+            if job != last:
+                yield job
+                last = job
+            if job is None or job["parse_status"] in (ParseStatus.SUCCESS, ParseStatus.FAILED):
+                return
+            await asyncio.sleep(interval)
+
+    def close(self):
+        """
+        stop the workers after the queued jobs are done
+        """
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    def _fail_lost_jobs(self):
+        """
+        fail the jobs a previous process on this host left queued or running, they are never picked up.
+        jobs of other live processes, e.g. the prefork siblings, are left alone
+        """
+        host = socket.gethostname()
+        sql = """
+        SELECT file_id, parse_progress FROM structured_parsed_result
+        WHERE parse_status IN (%s, %s) AND parse_progress LIKE %s
+        """
+        try:
+            with connect.conn_pool as conn:
+                rows = conn.fetchall(sql, [ParseStatus.PREPARE, ParseStatus.PROCESSING, f'%"owner": "{host}:%'])
+            for r in rows:
+                owner = json.loads(r.parse_progress).get("owner", "")
+                owner_host, _, pid = owner.rpartition(":")
+                if owner_host != host or not pid.isdigit() or _process_alive(int(pid)):
+                    continue
+                _update_job(r.file_id, parse_status=ParseStatus.FAILED,
+                            parse_progress=json.dumps({"error": "parse job lost when the server restarted, please submit again"}))
+                logger.warning(f"[job] {r.file_id} of {owner} lost, marked failed")
+        except Exception as e:
+            logger.error(f"[job] lost job check failed, error: {e}")
+
+    def _work(self):
+        """worker loop"""
+        while True:
+            file_data = self._queue.get()
+            if file_data is _STOP:
+                return
+            with document_in_flight():
+                self._run(file_data)
+
+    def _run(self, file_data: Dict):
+        """parse one job and store its result, the labels and row of the sync api included"""
+        job_id = file_data["file_id"]
+        progress = JobProgress(job_id, self.owner)
+        try:
+            _update_job(job_id, parse_status=ParseStatus.PROCESSING, parse_progress=progress.to_json())
+            result = self.pdf_parser.parse_pdf_result(file_data, progress=progress, metrics=progress.metrics)
+            self.pdf_parser.store_result(file_data, result)
+            _update_job(job_id, parse_progress=progress.to_json(with_metrics=True))
+            logger.info(f"[job] finished {job_id}")
+        except Exception as e:
+            logger.error(f"[job] failed {job_id}, error: {e}")
+            logger.error(traceback.format_exc())
+            try:
+                _update_job(job_id, parse_status=ParseStatus.FAILED,
+                            parse_progress=json.dumps({"error": str(e)}))
+            except Exception as db_error:
+                logger.error(f"[job] status update failed {job_id}, error: {db_error}")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+compiled tree classifier, the sklearn decision tree or forest of dt.joblib flattened into node arrays.
+inference asks for one row per page and character position, predict_proba of sklearn spends most of
+such a call validating and converting its input. the compiled trees walk the nodes directly, in python
+for a few rows and vectorised in numpy for larger batches, and give the same probabilities bit for bit:
+rows are rounded to float32 like sklearn does, leaves hold the normalized class probabilities of
+DecisionTreeClassifier.predict_proba and a forest adds the trees up in order before dividing.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+from array import array
+from typing import List, Sequence
+
+import numpy as np
+
+# rows evaluated in python, larger batches are evaluated in numpy
+PYTHON_MAX_ROWS = 16
+
+
+class CompiledTrees(object):
+    """
+    the trees of a classifier as flat node arrays, every tree is a slice of the arrays starting at its root
+    """
+    def __init__(self, left: np.ndarray, right: np.ndarray, feature: np.ndarray, threshold: np.ndarray,
+                 leaf_proba: np.ndarray, roots: np.ndarray, max_depth: int, average: bool):
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.leaf_proba = leaf_proba
+        self.roots = roots
+        self.max_depth = max_depth
+        self.average = average
+        self.n_classes = leaf_proba.shape[1]
+        self._lists()
+
+    def _lists(self):
+        """python lists of the arrays for the row walk, indexing a list is much faster than an array"""
+        self._left = self.left.tolist()
+        self._right = self.right.tolist()
+        self._feature = self.feature.tolist()
+        self._threshold = self.threshold.tolist()
+        self._leaf_proba = self.leaf_proba.tolist()
+        self._roots = self.roots.tolist()
+
+    def __getstate__(self):
+        # the lists are rebuilt in the worker process, only the arrays are pickled
+        return {key: value for key, value in vars(self).items() if not key.startswith("_")}
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self._lists()
+
+    def predict_row(self, row: Sequence) -> List[float]:
+        """class probabilities of one row"""
+        row = array("f", row)
+        left, right, feature, threshold = self._left, self._right, self._feature, self._threshold
+        if len(self._roots) == 1:
+            node = self._roots[0]
+            while left[node] != -1:
+                node = left[node] if row[feature[node]] <= threshold[node] else right[node]
+            return list(self._leaf_proba[node])
+
+        proba = [0.0] * self.n_classes
+        for node in self._roots:
+            while left[node] != -1:
+                node = left[node] if row[feature[node]] <= threshold[node] else right[node]
+            leaf = self._leaf_proba[node]
+            for k in range(self.n_classes):
+                proba[k] += leaf[k]
+        if self.average:
+            num_trees = len(self._roots)
+            proba = [value / num_trees for value in proba]
+        return proba
+
+    def predict_proba(self, rows) -> np.ndarray:
+        """class probabilities of rows, n_rows x n_classes like sklearn"""
+        if len(rows) <= PYTHON_MAX_ROWS:
+            return np.array([self.predict_row(row) for row in rows], dtype=np.float64).reshape(-1, self.n_classes)
+
+        X = np.asarray(rows, dtype=np.float32)
+        row_idxs = np.arange(X.shape[0])
+        proba = np.zeros((X.shape[0], self.n_classes), dtype=np.float64)
+        for root in self.roots:
+            node = np.full(X.shape[0], root, dtype=np.int64)
+            for _ in range(self.max_depth):
+                left = self.left[node]
+                inner = left != -1
+                if not inner.any():
+                    break
+                go_left = X[row_idxs, self.feature[node]] <= self.threshold[node]
+                node = np.where(inner, np.where(go_left, left, self.right[node]), node)
+            if len(self.roots) == 1:
+                return self.leaf_proba[node].copy()
+            # one tree after the other, in the order of the forest
+            proba += self.leaf_proba[node]
+        if self.average:
+            proba /= len(self.roots)
+        return proba
+
+
+def _tree_arrays(tree, offset: int):
+    """flat arrays of a fitted sklearn tree_, node ids shifted by offset"""
+    left = tree.children_left.astype(np.int64)
+    right = tree.children_right.astype(np.int64)
+    is_leaf = left == -1
+    left = np.where(is_leaf, -1, left + offset)
+    right = np.where(is_leaf, -1, right + offset)
+
+    # DecisionTreeClassifier.predict_proba, single output
+    proba = tree.value[:, 0, :].astype(np.float64)
+    normalizer = proba.sum(axis=1)[:, np.newaxis]
+    normalizer[normalizer == 0.0] = 1.0
+    proba /= normalizer
+    return left, right, tree.feature.astype(np.int64), tree.threshold.astype(np.float64), proba
+
+
+def compile_model(model) -> CompiledTrees:
+    """
+    compiled trees of a fitted DecisionTreeClassifier or a forest of them (RandomForest, ExtraTrees),
+    raises ValueError for other models
+    """
+    if hasattr(model, "tree_"):
+        estimators, average = [model], False
+    elif hasattr(model, "estimators_") and all(hasattr(estimator, "tree_") for estimator in model.estimators_):
+        estimators, average = list(model.estimators_), True
+    else:
+        raise ValueError(f"can not compile {type(model).__name__}, only trees and forests of trees")
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise ValueError("can not compile a multi output model")
+
+    arrays = []
+    roots = []
+    offset = 0
+    for estimator in estimators:
+        roots.append(offset)
+        arrays.append(_tree_arrays(estimator.tree_, offset))
+        offset += estimator.tree_.node_count
+    left, right, feature, threshold, leaf_proba = [np.concatenate(parts) for parts in zip(*arrays)]
+    max_depth = max(estimator.tree_.max_depth for estimator in estimators)
+    return CompiledTrees(left, right, feature, threshold, leaf_proba, np.array(roots, dtype=np.int64),
+                         max_depth, average)
+
+
+def verification_rows(compiled: CompiledTrees, num_rows: int, seed: int = 0) -> np.ndarray:
+    """
+    generated rows around the split thresholds, every feature is a threshold, a float32 step next to it
+    or a random value in the range of the thresholds, so both sides of the splits are taken
+    """
+    rng = np.random.default_rng(seed)
+    num_features = int(compiled.feature.max()) + 1 if (compiled.feature >= 0).any() else 1
+    rows = np.zeros((num_rows, num_features), dtype=np.float32)
+    for feature in range(num_features):
+        thresholds = compiled.threshold[compiled.feature == feature].astype(np.float32)
+        if len(thresholds) == 0:
+            rows[:, feature] = rng.integers(0, 2, num_rows)
+            continue
+        picks = thresholds[rng.integers(0, len(thresholds), num_rows)]
+        nudges = rng.integers(-1, 2, num_rows)
+        values = np.where(nudges < 0, np.nextafter(picks, np.float32(-np.inf)),
+                          np.where(nudges > 0, np.nextafter(picks, np.float32(np.inf)), picks))
+        low, high = float(thresholds.min()), float(thresholds.max())
+        spread = max(high - low, 1.0)
+        random = rng.uniform(low - spread, high + spread, num_rows).astype(np.float32)
+        rows[:, feature] = np.where(rng.random(num_rows) < 0.25, random, values)
+    return rows
+
+
+def verify_compiled(model, compiled: CompiledTrees, num_rows: int = 4096, seed: int = 0) -> bool:
+    """
+    whether the compiled trees give the exact predict_proba of model on generated rows,
+    row by row and as a batch
+    """
+    rows = verification_rows(compiled, num_rows, seed)
+    expected = np.asarray(model.predict_proba(rows), dtype=np.float64)
+    batch = compiled.predict_proba(rows)
+    single = np.array([compiled.predict_row(row) for row in rows.tolist()], dtype=np.float64)
+    return np.array_equal(expected, batch) and np.array_equal(expected, single)
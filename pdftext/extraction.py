@@ -13,34 +13,30 @@ Date:    2024/07/29 17:08:41
 """
 
 
-from functools import partial
 from typing import List
-from concurrent.futures import ProcessPoolExecutor
-import math
+from concurrent.futures.process import BrokenProcessPool
 import pypdfium2 as pdfium
+from loguru import logger
 
 from src.pdftext.inference import inference
 from src.pdftext.model import get_model
 from src.pdftext.pdf.chars import get_pdfium_chars
 from src.pdftext.pdf.utils import unnormalize_bbox
+from src.pdftext.pool import extract_pages, shutdown_pdftext_pool
 from src.pdftext.postprocessing import merge_text, sort_blocks, postprocess_text, handle_hyphens
 from src.pdftext.settings import settings
 
 
-def _get_page_range(pdf_path, model, page_range):
-    """get page range"""
-    pdf_doc = pdfium.PdfDocument(pdf_path)
-    text_chars = get_pdfium_chars(pdf_doc, page_range)
-    pages = inference(text_chars, model)
-    return pages
-
-
-def _get_pages(pdf_path, model=None, page_range=None, workers=None):
-    """get pages"""
-    if model is None:
-        model = get_model()
-
-    pdf_doc = pdfium.PdfDocument(pdf_path)
+def _get_pages(pdf_path, model=None, page_range=None, workers=None, pdf_doc=None, get_page=None,
+               diagnostics=False, font_black_list=None, shared=None, page_weights=None):
+    """
+    get pages, pdf_doc is the document already opened from pdf_path and get_page(page_idx) returns
+    (page, textpage) from a cache, both are only used in process, the pool workers open pdf_path themselves.
+    shared is a shared memory block holding the pdf bytes for the pool and page_weights the estimated
+    chars of the pages, see pool.extract_pages. diagnostics and font_black_list, see get_pdfium_chars
+    """
+    if pdf_doc is None:
+        pdf_doc = pdfium.PdfDocument(pdf_path)
     if page_range is None:
         page_range = range(len(pdf_doc))
 
@@ -49,22 +45,21 @@ def _get_pages(pdf_path, model=None, page_range=None, workers=None):
          # It's inefficient to have too many workers, since we batch in inference
         workers = min(workers, len(page_range) // settings.WORKER_PAGE_THRESHOLD)
 
-    if workers is None or workers <= 1:
-        text_chars = get_pdfium_chars(pdf_doc, page_range)
-        return inference(text_chars, model)
-
-    func = partial(_get_page_range, pdf_path, model)
-    page_range = list(page_range)
+    if workers is not None and workers > 1:
+        try:
+            # the workers use the model they loaded themselves unless another one is given
+            return extract_pages(pdf_path, page_range, workers, model=model, diagnostics=diagnostics,
+                                 font_black_list=font_black_list, shared=shared, page_weights=page_weights)
+        except BrokenProcessPool:
+            # a worker died, e.g. killed on memory, the next extraction starts a new pool
+            shutdown_pdftext_pool()
+            logger.warning(f"pdftext pool broken, {len(page_range)} pages extracted in process")
 
-    pages_per_worker = math.ceil(len(page_range) / workers)
-    page_range_chunks = [page_range[i * pages_per_worker:(i + 1) * pages_per_worker] for i in range(workers)]
-
-    with ProcessPoolExecutor(max_workers=workers) as executor:
-        pages = list(executor.map(func, page_range_chunks))
-
-    ordered_pages = [page for sublist in pages for page in sublist]
-
-    return ordered_pages
+    if model is None:
+        model = get_model()
+    text_chars = get_pdfium_chars(pdf_doc, page_range, get_page=get_page, diagnostics=diagnostics,
+                                  font_black_list=font_black_list)
+    return inference(text_chars, model)
 
 
 def plain_text_output(pdf_path, sort=False, model=None, hyphens=False, page_range=None, workers=None) -> str:
@@ -85,21 +80,30 @@ def paginated_plain_text_output(pdf_path, sort=False, model=None,
 
 
 def _process_span(span, page_width, page_height, keep_chars):
-    """process span"""
+    """process span, the chars of the page are already scaled to the page"""
     span["bbox"] = unnormalize_bbox(span["bbox"], page_width, page_height)
     span["text"] = handle_hyphens(postprocess_text(span["text"]), keep_hyphens=True)
     if not keep_chars:
         del span["chars"]
-    else:
-        for char in span["chars"]:
-            char["bbox"] = unnormalize_bbox(char["bbox"], page_width, page_height)
 
 
-def dictionary_output(pdf_path, sort=False, model=None, page_range=None, keep_chars=True, workers=None):
-    """output as a dictionary"""
-    pages = _get_pages(pdf_path, model, page_range, workers=workers)
+def dictionary_output(pdf_path, sort=False, model=None, page_range=None, keep_chars=True, workers=None,
+                      pdf_doc=None, get_page=None, diagnostics=False, font_black_list=None, shared=None,
+                      page_weights=None):
+    """
+    output as a dictionary, pdf_doc and get_page reuse an open document, shared and page_weights
+    feed the worker pool, see _get_pages.
+    diagnostics adds the text layer diagnostics of every page under "diagnostics", see get_pdfium_chars
+    """
+    pages = _get_pages(pdf_path, model, page_range, workers=workers, pdf_doc=pdf_doc, get_page=get_page,
+                       diagnostics=diagnostics, font_black_list=font_black_list, shared=shared,
+                       page_weights=page_weights)
     for page in pages:
         page_width, page_height = page["width"], page["height"]
+        # the char boxes of the whole page at once, the spans hold slices of the table
+        chars = page.pop("chars")
+        if keep_chars:
+            chars.scale(page_width, page_height)
         for block in page["blocks"]:
             for k in list(block.keys()):
                 if k not in ["lines", "bbox"]:
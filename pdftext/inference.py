@@ -13,114 +13,85 @@ Date:    2024/07/29 17:08:41
 """
 
 from itertools import chain
+from typing import Dict
 
-import sklearn
+import numpy as np
 
+from src.pdftext.compiled import CompiledTrees
+from src.pdftext.pdf.char_table import CharTable
 from src.pdftext.pdf.utils import LINE_BREAKS, TABS, SPACES
 from src.pdftext.settings import settings
 
 
-def update_current(current, new_char):
-    """update"""
-    bbox = new_char["bbox"]
-    if "bbox" not in current:
-        current["bbox"] = bbox.copy()
-    else:
-        current_bbox = current["bbox"]
-        current_bbox[0] = min(bbox[0], current_bbox[0])
-        current_bbox[1] = min(bbox[1], current_bbox[1])
-        current_bbox[2] = max(bbox[2], current_bbox[2])
-        current_bbox[3] = max(bbox[3], current_bbox[3])
-    current_bbox = current["bbox"]
-    current["center_x"] = (current_bbox[0] + current_bbox[2]) / 2
-    current["center_y"] = (current_bbox[1] + current_bbox[3]) / 2
-
-
-def create_training_row(char_info, prev_char, currblock, currline):
-    """create training row"""
-    char = char_info["char"]
-
-    # Store variables used multiple times
-    char_bbox = char_info["bbox"]
-    prev_bbox = prev_char["bbox"]
-    currblock_bbox = currblock["bbox"]
-    currline_bbox = currline["bbox"]
-
-    char_x1, char_y1, char_x2, char_y2 = char_bbox
-    prev_x1, prev_y1, prev_x2, prev_y2 = prev_bbox
-    char_center_x = (char_x2 + char_x1) / 2
-    char_center_y = (char_y2 + char_y1) / 2
-    x_gap = char_x1 - prev_x2
-    y_gap = char_y1 - prev_y2
-
-    char_font = char_info["font"]
-    prev_font = prev_char["font"]
-    font_match = (char_font["name"] == prev_font["name"] and
-                  char_font["size"] == prev_font["size"] and
-                  char_font["weight"] == prev_font["weight"] and
-                  char_font["flags"] == prev_font["flags"] and
-                  char_info["rotation"] == prev_char["rotation"])
-
-    is_space = char in SPACES or char in TABS
-
-    training_row = {
-        "is_newline": char in LINE_BREAKS,
-        "is_space": is_space,
-        "x_gap": x_gap,
-        "y_gap": y_gap,
-        "font_match": font_match,
-        "x_outer_gap": char_x2 - prev_x1,
-        "y_outer_gap": char_y2 - prev_y1,
-        "line_x_center_gap": char_center_x - currline["center_x"],
-        "line_y_center_gap": char_center_y - currline["center_y"],
-        "line_x_gap": char_x1 - currline_bbox[2],
-        "line_y_gap": char_y1 - currline_bbox[3],
-        "line_x_start_gap": char_x1 - currline_bbox[0],
-        "line_y_start_gap": char_y1 - currline_bbox[1],
-        "block_x_center_gap": char_center_x - currblock["center_x"],
-        "block_y_center_gap": char_center_y - currblock["center_y"],
-        "block_x_gap": char_x1 - currblock_bbox[2],
-        "block_y_gap": char_y1 - currblock_bbox[3],
-        "block_x_start_gap": char_x1 - currblock_bbox[0],
-        "block_y_start_gap": char_y1 - currblock_bbox[1]
+# model features, in the sorted order the classifier was trained with
+FEATURES = [
+    "block_x_center_gap", "block_x_gap", "block_x_start_gap", "block_y_center_gap", "block_y_gap",
+    "block_y_start_gap", "font_match", "is_newline", "is_space", "line_x_center_gap", "line_x_gap",
+    "line_x_start_gap", "line_y_center_gap", "line_y_gap", "line_y_start_gap", "x_gap", "x_outer_gap",
+    "y_gap", "y_outer_gap",
+]
+
+_LINE_BREAKS = np.array(sorted({ord(char) for char in LINE_BREAKS}), dtype=np.uint32)
+_SPACES = np.array(sorted({ord(char) for char in SPACES + TABS}), dtype=np.uint32)
+
+
+def page_columns(table: CharTable) -> Dict[str, list]:
+    """
+    columns of the features of a page from its char table, the bboxes and font ids (font and rotation).
+    the features which do not depend on the current line and block, the gaps to the previous char,
+    font match and newline / space flags, are computed here in one vectorised pass.
+    the columns are returned as lists, the sequential kernel indexes them char by char
+    """
+    bboxes = table.boxes
+    fonts = table.font_ids
+    x1, y1, x2, y2 = bboxes.T
+
+    # index i holds the feature of char i and char i - 1, nothing for the first char
+    zero = np.zeros(1)
+    return {
+        "x1": x1.tolist(),
+        "y1": y1.tolist(),
+        "x2": x2.tolist(),
+        "y2": y2.tolist(),
+        "center_x": ((x2 + x1) / 2).tolist(),
+        "center_y": ((y2 + y1) / 2).tolist(),
+        "font": fonts.tolist(),
+        "font_match": np.concatenate([[False], fonts[1:] == fonts[:-1]]).tolist(),
+        "x_gap": np.concatenate([zero, x1[1:] - x2[:-1]]).tolist(),
+        "y_gap": np.concatenate([zero, y1[1:] - y2[:-1]]).tolist(),
+        "x_outer_gap": np.concatenate([zero, x2[1:] - x1[:-1]]).tolist(),
+        "y_outer_gap": np.concatenate([zero, y2[1:] - y1[:-1]]).tolist(),
+        "is_newline": np.isin(table.codes, _LINE_BREAKS).tolist(),
+        "is_space": np.isin(table.codes, _SPACES).tolist(),
     }
 
-    return training_row
 
+def set_center(current):
+    """center of a finished line or block"""
+    bbox = current["bbox"]
+    current["center_x"] = (bbox[0] + bbox[2]) / 2
+    current["center_y"] = (bbox[1] + bbox[3]) / 2
 
-def update_span(line, span):
-    """update span"""
-    if span["chars"]:
-        first_char = span["chars"][0]
-        span["font"] = first_char["font"]
-        span["rotation"] = first_char["rotation"]
 
-        char_bboxes = [char["bbox"] for char in span["chars"]]
-        min_x, min_y, max_x, max_y = char_bboxes[0]
-
-        for bbox in char_bboxes[1:]:
-            min_x = min(min_x, bbox[0])
-            min_y = min(min_y, bbox[1])
-            max_x = max(max_x, bbox[2])
-            max_y = max(max_y, bbox[3])
-
-        span["bbox"] = [min_x, min_y, max_x, max_y]
-        span["text"] = "".join(char["char"] for char in span["chars"])
-        span["char_start_idx"] = first_char["char_idx"]
-        span["char_end_idx"] = span["chars"][-1]["char_idx"]
-
-        # Remove unneeded keys from the characters
-        for char in span["chars"]:
-            for key in list(char.keys()):
-                if key not in ["char", "bbox"]:
-                    del char[key]
-
-        line["spans"].append(span)
-    return {"chars": []}
+def update_span(line, table: CharTable, start: int, end: int) -> int:
+    """update span, the chars start to end of table, returns the start of the next span"""
+    if end > start:
+        name, flags, size, weight, rotation = table.font(start)
+        line["spans"].append({
+            "font": {"size": size, "weight": weight, "name": name, "flags": flags},
+            "rotation": rotation,
+            "bbox": table.span_bbox(start, end),
+            "text": table.text(start, end),
+            "char_start_idx": int(table.char_idxs[start]),
+            "char_end_idx": int(table.char_idxs[end - 1]),
+            "chars": table.slice(start, end),
+        })
+    return end
 
 
 def update_line(block, line):
     """update line"""
+    set_center(line)
     block["lines"].append(line)
     line = {"spans": []}
     return line
@@ -128,16 +99,17 @@ def update_line(block, line):
 
 def update_block(blocks, block):
     """update block"""
+    set_center(block)
     blocks["blocks"].append(block)
     block = {"lines": []}
     return block
 
 
 def infer_single_page(text_chars, block_threshold=settings.BLOCK_THRESHOLD):
-    """infer single page"""
-    prev_char = None
-    prev_font_info = None
-
+    """
+    infer single page, yields the features of every char after the first and receives its class probabilities.
+    only the gaps to the current line and block are computed here, the rest comes from page_columns
+    """
     blocks = {
         "blocks": [],
         "page": text_chars["page"],
@@ -146,51 +118,87 @@ def infer_single_page(text_chars, block_threshold=settings.BLOCK_THRESHOLD):
         "width": text_chars["width"],
         "height": text_chars["height"],
     }
+    if "diagnostics" in text_chars:
+        blocks["diagnostics"] = text_chars["diagnostics"]
+    # the spans keep slices of the char table of the page
+    blocks["chars"] = text_chars["chars"]
     block = {"lines": []}
     line = {"spans": []}
-    span = {"chars": []}
-
-    for char_info in text_chars["chars"]:
-        font = char_info['font']
-        font_info = f"{font['name']}_{font['size']}_{font['weight']}_{font['flags']}_{char_info['rotation']}"
-        if prev_char:
-            training_row = create_training_row(char_info, prev_char, block, line)
-            sorted_keys = sorted(training_row.keys())
-            training_row = [training_row[key] for key in sorted_keys]
-            char_height = char_info["bbox"][3] - char_info["bbox"][1]
+    # the current span is the chars span_start to i
+    span_start = 0
+
+    table = text_chars["chars"]
+    columns = page_columns(table)
+    x1s, y1s, x2s, y2s = columns["x1"], columns["y1"], columns["x2"], columns["y2"]
+    center_xs, center_ys = columns["center_x"], columns["center_y"]
+    fonts, font_matches = columns["font"], columns["font_match"]
+    x_gaps, y_gaps = columns["x_gap"], columns["y_gap"]
+    x_outer_gaps, y_outer_gaps = columns["x_outer_gap"], columns["y_outer_gap"]
+    is_newlines, is_spaces = columns["is_newline"], columns["is_space"]
+
+    # bboxes of the current line and block, the same lists as line["bbox"] and block["bbox"]
+    line_bbox = None
+    block_bbox = None
+    for i in range(len(table)):
+        x1, y1, x2, y2 = x1s[i], y1s[i], x2s[i], y2s[i]
+        if i > 0:
+            center_x = center_xs[i]
+            center_y = center_ys[i]
+            line_center_x = (line_bbox[0] + line_bbox[2]) / 2
+            line_center_y = (line_bbox[1] + line_bbox[3]) / 2
+            block_center_x = (block_bbox[0] + block_bbox[2]) / 2
+            block_center_y = (block_bbox[1] + block_bbox[3]) / 2
+            training_row = [
+                center_x - block_center_x, x1 - block_bbox[2], x1 - block_bbox[0],
+                center_y - block_center_y, y1 - block_bbox[3], y1 - block_bbox[1],
+                font_matches[i], is_newlines[i], is_spaces[i],
+                center_x - line_center_x, x1 - line_bbox[2], x1 - line_bbox[0],
+                center_y - line_center_y, y1 - line_bbox[3], y1 - line_bbox[1],
+                x_gaps[i], x_outer_gaps[i], y_gaps[i], y_outer_gaps[i],
+            ]
             prediction_probs = yield training_row
+            new_font = fonts[i] != fonts[i - 1]
             # First item is probability of same line/block, second is probability of new line, third is probability of new block
             if prediction_probs[0] >= .5:
                 # Ensure we update spans properly for font info when predicting no new line
-                if prev_font_info != font_info:
-                    span = update_span(line, span)
+                if new_font:
+                    span_start = update_span(line, table, span_start, i)
             elif prediction_probs[2] > block_threshold:
-                span = update_span(line, span)
+                span_start = update_span(line, table, span_start, i)
                 line = update_line(block, line)
                 block = update_block(blocks, block)
-            elif prev_char["char"] in LINE_BREAKS: # Look for newline character as a forcing signal for a new line
-                span = update_span(line, span)
+            elif is_newlines[i - 1]: # Look for newline character as a forcing signal for a new line
+                span_start = update_span(line, table, span_start, i)
                 line = update_line(block, line)
             # Look for horizontal line break as a forcing signal for a new line
-            elif prev_char["bbox"][0] > char_info["bbox"][2]:
-                span = update_span(line, span)
+            elif x1s[i - 1] > x2:
+                span_start = update_span(line, table, span_start, i)
                 line = update_line(block, line)
-            elif char_info["bbox"][0] - prev_char["bbox"][2] > char_height * 5:
-                span = update_span(line, span)
+            elif x_gaps[i] > (y2 - y1) * 5:
+                span_start = update_span(line, table, span_start, i)
                 line = update_line(block, line)
 
-            elif prev_font_info != font_info:
-                span = update_span(line, span)
-
-        span["chars"].append(char_info)
-        update_current(line, char_info)
-        update_current(block, char_info)
-
-        prev_char = char_info
-        prev_font_info = font_info
-
-    if span["chars"]:
-        update_span(line, span)
+            elif new_font:
+                span_start = update_span(line, table, span_start, i)
+
+        if "bbox" not in line:
+            line_bbox = [x1, y1, x2, y2]
+            line["bbox"] = line_bbox
+        else:
+            line_bbox[0] = min(x1, line_bbox[0])
+            line_bbox[1] = min(y1, line_bbox[1])
+            line_bbox[2] = max(x2, line_bbox[2])
+            line_bbox[3] = max(y2, line_bbox[3])
+        if "bbox" not in block:
+            block_bbox = [x1, y1, x2, y2]
+            block["bbox"] = block_bbox
+        else:
+            block_bbox[0] = min(x1, block_bbox[0])
+            block_bbox[1] = min(y1, block_bbox[1])
+            block_bbox[2] = max(x2, block_bbox[2])
+            block_bbox[3] = max(y2, block_bbox[3])
+
+    update_span(line, table, span_start, len(table))
     if line["spans"]:
         update_line(block, line)
     if block["lines"]:
@@ -200,7 +208,8 @@ def infer_single_page(text_chars, block_threshold=settings.BLOCK_THRESHOLD):
 
 
 def inference(text_chars, model):
-    """predict"""
+    """predict, model is the compiled model of get_model or an sklearn classifier"""
+
     # Create generators and get first training row from each
     generators = [infer_single_page(text_page) for text_page in text_chars]
     next_prediction = {}
@@ -229,9 +238,15 @@ def inference(text_chars, model):
         training_idxs = sorted(training_data.keys())
         training_rows = [training_data[idx] for idx in training_idxs]
 
-        # Disable nan, etc, validation for a small speedup
-        with sklearn.config_context(assume_finite=True):
+        if isinstance(model, CompiledTrees):
             predictions = model.predict_proba(training_rows)
+        else:
+            # sklearn is imported with the model, not with the package
+            import sklearn
+
+            # Disable nan, etc, validation for a small speedup
+            with sklearn.config_context(assume_finite=True):
+                predictions = model.predict_proba(training_rows)
         for pred, page_idx in zip(predictions, training_idxs):
             next_prediction[page_idx] = pred
     sorted_keys = sorted(page_blocks.keys())
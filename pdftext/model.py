@@ -12,16 +12,39 @@ Authors: yushilin(1329239119@qq.com)
 Date:    2024/07/29 17:08:41
 """
 
+from functools import lru_cache
+
 import joblib
+from loguru import logger
+
 import src.config_util as cfg
+from src.pdftext.compiled import compile_model, verify_compiled
+from src.pdftext.settings import settings
 
 
 def get_model(model_path: str=None):
     """
-    load model
+    load model, once per process, compiled into node arrays unless COMPILE_MODEL is off.
+    the sklearn model is kept when it can not be compiled or the compiled one predicts differently
     """
     if model_path is None:
         model_path = cfg.PDF_EXTRACTION_MODEL
+    return _load_model(model_path, settings.COMPILE_MODEL)
+
+
+@lru_cache(maxsize=4)
+def _load_model(model_path: str, compile_trees: bool):
+    """load and compile model"""
     model = joblib.load(model_path)
-    return model
+    if not compile_trees:
+        return model
+    try:
+        compiled = compile_model(model)
+    except ValueError as e:
+        logger.warning(f"pdftext model not compiled: {e}")
+        return model
+    if settings.COMPILE_VERIFY_ROWS and not verify_compiled(model, compiled, settings.COMPILE_VERIFY_ROWS):
+        logger.warning(f"compiled pdftext model differs from {type(model).__name__}.predict_proba, not used")
+        return model
+    return compiled
 
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+columnar chars of a page, one array per field instead of a dict per char.
+spans keep a [start, end) slice of the table of their page, the code reading chars iterates
+light views which look like the old char dicts, char["char"] and char["bbox"].
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# (name, flags, size, weight, rotation) of a char
+CharFont = Tuple[Optional[str], Optional[int], float, float, float]
+
+
+class CharTable(object):
+    """
+    the chars of a page: codepoints, boxes, font ids into the interned fonts and the pdfium char index.
+    the boxes are normalized float64 while the page is segmented, scale turns them into float32 page coordinates
+    """
+    def __init__(self, codes: np.ndarray, boxes: np.ndarray, font_ids: np.ndarray, char_idxs: np.ndarray,
+                 fonts: List[CharFont], decimals: Optional[int] = None):
+        self.codes = codes
+        self.boxes = boxes
+        self.font_ids = font_ids
+        self.char_idxs = char_idxs
+        self.fonts = fonts
+        # the page coordinates are rounded to decimals, the float32 boxes are rounded again when read
+        self.decimals = decimals
+
+    @classmethod
+    def build(cls, chars: Sequence[str], boxes: Sequence[float], fonts: Sequence[CharFont],
+              char_idxs: Sequence[int]) -> "CharTable":
+        """table of the columns of get_pdfium_chars, boxes is flat with 4 values per char"""
+        font_ids: Dict[CharFont, int] = {}
+        ids = [font_ids.setdefault(font, len(font_ids)) for font in fonts]
+        return cls(
+            codes=np.array([ord(char) for char in chars], dtype="<u4"),
+            boxes=np.array(boxes, dtype=np.float64).reshape(-1, 4),
+            font_ids=np.array(ids, dtype=np.int32),
+            char_idxs=np.array(char_idxs, dtype=np.int32),
+            fonts=list(font_ids),
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """memory of the columns"""
+        return self.codes.nbytes + self.boxes.nbytes + self.font_ids.nbytes + self.char_idxs.nbytes
+
+    def text(self, start: int = 0, end: Optional[int] = None) -> str:
+        """text of the chars start to end"""
+        return self.codes[start:end].tobytes().decode("utf-32-le", errors="surrogatepass")
+
+    def char(self, index: int) -> str:
+        """character of a char"""
+        return chr(self.codes[index])
+
+    def bbox(self, index: int) -> Tuple[float, ...]:
+        """bbox of a char"""
+        box = self.boxes[index].tolist()
+        if self.decimals is not None:
+            return tuple(round(value, self.decimals) for value in box)
+        return tuple(box)
+
+    def font(self, index: int) -> CharFont:
+        """font of a char"""
+        return self.fonts[self.font_ids[index]]
+
+    def span_bbox(self, start: int, end: int) -> List[float]:
+        """bbox around the chars start to end"""
+        boxes = self.boxes[start:end]
+        mins = boxes.min(axis=0).tolist()
+        maxs = boxes.max(axis=0).tolist()
+        return [mins[0], mins[1], maxs[2], maxs[3]]
+
+    def scale(self, page_width: float, page_height: float):
+        """normalized boxes to page coordinates rounded to 0.1 like unnormalize_bbox, stored as float32"""
+        scale = np.array([page_width, page_height, page_width, page_height], dtype=np.float64)
+        self.boxes = np.round(self.boxes * scale, 1).astype(np.float32)
+        self.decimals = 1
+
+    def slice(self, start: int, end: int) -> "CharSlice":
+        """view of the chars start to end"""
+        return CharSlice(self, start, end)
+
+
+class CharSlice(object):
+    """
+    the chars [start, end) of a char table, what a span keeps instead of a list of char dicts
+    """
+    __slots__ = ("table", "start", "end")
+
+    def __init__(self, table: CharTable, start: int, end: int):
+        self.table = table
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self) -> Iterator["CharView"]:
+        table = self.table
+        return (CharView(table, index) for index in range(self.start, self.end))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            assert step == 1, "char slices are contiguous"
+            return CharSlice(self.table, self.start + start, self.start + max(start, end))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("char index out of range")
+        return CharView(self.table, self.start + index)
+
+    def compact(self) -> "CharSlice":
+        """the chars in a table of their own, the slice no longer keeps the table of the whole page alive"""
+        table = self.table
+        start, end = self.start, self.end
+        own = CharTable(table.codes[start:end].copy(), table.boxes[start:end].copy(),
+                        table.font_ids[start:end].copy(), table.char_idxs[start:end].copy(),
+                        table.fonts, decimals=table.decimals)
+        return CharSlice(own, 0, end - start)
+
+    def __getstate__(self):
+        # only the chars of the slice are pickled, not the table of the whole page
+        if self.start == 0 and self.end == len(self.table):
+            return self.table, self.start, self.end
+        compact = self.compact()
+        return compact.table, compact.start, compact.end
+
+    def __setstate__(self, state):
+        self.table, self.start, self.end = state
+
+    def __deepcopy__(self, memo):
+        # the table is not changed once the page is extracted, copies share it
+        return CharSlice(self.table, self.start, self.end)
+
+    def __repr__(self):
+        return f"CharSlice({self.text!r})"
+
+    @property
+    def text(self) -> str:
+        """text of the chars"""
+        return self.table.text(self.start, self.end)
+
+    def to_list(self) -> List[Dict]:
+        """the chars as dicts, e.g. to dump them as json"""
+        return [{"char": char["char"], "bbox": char["bbox"]} for char in self]
+
+
+class CharView(object):
+    """
+    one char of a char table, read like the char dicts: char["char"] and char["bbox"]
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: CharTable, index: int):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key: str):
+        if key == "char":
+            return self.table.char(self.index)
+        if key == "bbox":
+            return self.table.bbox(self.index)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        """value of key, default for fields a char does not have"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"CharView({self['char']!r}, {self['bbox']})"
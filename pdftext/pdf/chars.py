@@ -12,19 +12,33 @@ Authors: yushilin(1329239119@qq.com)
 Date:    2024/07/29 17:08:41
 """
 
+import ctypes
 import math
-from typing import Dict, List
+from array import array
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
 
+import pypdfium2 as pdfium
 import pypdfium2.raw as pdfium_c
 
-from src.pdftext.pdf.utils import get_fontname, pdfium_page_bbox_to_device_bbox, page_bbox_to_device_bbox
+from src.pdftext.pdf.char_table import CharFont, CharTable
+from src.pdftext.pdf.utils import get_fontname, pdfium_page_bbox_to_device_bbox, device_bbox_converter
 from src.pdftext.settings import settings
 
+# Full-width characters and the corresponding half-width characters
+FULLWIDTH_TABLE = str.maketrans(''.join(chr(i) for i in range(0xFF01, 0xFF5E)),
+                                ''.join(chr(i) for i in range(0x21, 0x7E)))
 
+# every TEXT_CHECK_STRIDE-th char of the page text is compared with FPDFText_GetUnicode
+TEXT_CHECK_STRIDE = 64
 
-def update_previous_fonts(char_infos: List, i: int, prev_fontname: str, 
-                        prev_fontflags: int, text_page, fontname_sample_freq: int):
+# the font of a char is found through its text object, older pdfium builds only have FPDFText_GetFontInfo
+TEXT_OBJECTS = hasattr(pdfium_c, "FPDFText_GetTextObject") and hasattr(pdfium_c, "FPDFTextObj_GetFont")
+
+
+def update_previous_fonts(fonts: List[CharFont], i: int, prev_fontname: str,
+                          prev_fontflags: int, text_page, fontname_sample_freq: int):
     """update previous fonts"""
     min_update = max(0, i - fontname_sample_freq) # Minimum index to update
     for j in range(i - 1, min_update, -1): # Goes from i to min_update
@@ -33,28 +47,157 @@ def update_previous_fonts(char_infos: List, i: int, prev_fontname: str,
         # If we hit the region with the previous fontname, we can bail out
         if fontname == prev_fontname and fontflags == prev_fontflags:
             break
-        char_infos[j]["font"]["name"] = fontname
-        char_infos[j]["font"]["flags"] = fontflags
+        fonts[j] = (fontname, fontflags) + fonts[j][2:]
 
 
 def fullwidth_to_halfwidth(text):
-    """ Create a translation table """
-    fullwidth = ''.join(chr(i) for i in range(0xFF01, 0xFF5E))  # Full-width characters
-    halfwidth = ''.join(chr(i) for i in range(0x21, 0x7E))  # Corresponding half-width characters
-    translation_table = str.maketrans(fullwidth, halfwidth)
-    return text.translate(translation_table)
+    """ full-width characters of text to half-width """
+    return text.translate(FULLWIDTH_TABLE)
+
+
+def page_text(text_page, total_chars: int) -> Optional[str]:
+    """
+    text of the chars of a page in one FPDFText_GetText call, one character per char index.
+    None when the text does not line up with the chars, e.g. a char outside the BMP is two utf-16 units
+    """
+    if total_chars == 0:
+        return ""
+    buffer = (ctypes.c_ushort * (total_chars + 1))()
+    n_units = pdfium_c.FPDFText_GetText(text_page, 0, total_chars, buffer)
+    # n_units counts the terminating null
+    text = bytes(buffer)[:max(n_units - 1, 0) * 2].decode("utf-16-le", errors="surrogatepass")
+    if len(text) != total_chars:
+        return None
+    for i in list(range(0, total_chars, TEXT_CHECK_STRIDE)) + [total_chars - 1]:
+        if ord(text[i]) != pdfium_c.FPDFText_GetUnicode(text_page, i):
+            return None
+    return text
+
+
+def page_chars(text_page, total_chars: int) -> List[Optional[str]]:
+    """half-width characters of the chars of a page, None for a char which is no valid unicode"""
+    text = page_text(text_page, total_chars)
+    if text is not None:
+        return list(fullwidth_to_halfwidth(text))
+
+    chars = []
+    for i in range(total_chars):
+        char = pdfium_c.FPDFText_GetUnicode(text_page, i)
+        try:
+            chars.append(fullwidth_to_halfwidth(chr(char)))
+        except Exception as e:
+            logger.warning(e)
+            chars.append(None)
+    return chars
+
+
+def _char_font(text_page, i: int, fontname: Optional[str], fontflags: Optional[int]) -> CharFont:
+    """font of char i with its name and flags"""
+    fontsize = round(pdfium_c.FPDFText_GetFontSize(text_page, i), 1)
+    fontweight = round(pdfium_c.FPDFText_GetFontWeight(text_page, i), 1)
+    rotation = pdfium_c.FPDFText_GetCharAngle(text_page, i)
+    rotation = rotation * 180 / math.pi # convert from radians to degrees
+    return fontname, fontflags, fontsize, fontweight, rotation
+
+
+def char_fonts(text_page, total_chars: int, fontname_sample_freq: int) -> List[CharFont]:
+    """
+    fonts of the chars of a page. size, weight and angle are read once per text object and the
+    name and flags once per font, the chars pdfium generates (spaces, line breaks) have no text object
+    and are read one by one. without text objects the font name is sampled every fontname_sample_freq chars
+    """
+    fonts = []
+    if TEXT_OBJECTS:
+        by_object: Dict[int, CharFont] = {}
+        by_font: Dict[int, Tuple[Optional[str], Optional[int]]] = {}
+        for i in range(total_chars):
+            text_obj = pdfium_c.FPDFText_GetTextObject(text_page, i)
+            obj_key = ctypes.cast(text_obj, ctypes.c_void_p).value
+            if obj_key is None:
+                fonts.append(_char_font(text_page, i, *get_fontname(text_page, i)))
+                continue
+            font = by_object.get(obj_key)
+            if font is None:
+                font_key = ctypes.cast(pdfium_c.FPDFTextObj_GetFont(text_obj), ctypes.c_void_p).value
+                if font_key not in by_font:
+                    by_font[font_key] = get_fontname(text_page, i)
+                font = by_object[obj_key] = _char_font(text_page, i, *by_font[font_key])
+            fonts.append(font)
+        return fonts
 
+    fontname = None
+    fontflags = None
+    for i in range(total_chars):
+        if fontname is None or i % fontname_sample_freq == 0:
+            prev_fontname = fontname
+            prev_fontflags = fontflags
+            fontname, fontflags = get_fontname(text_page, i)
+            if (fontname != prev_fontname or fontflags != prev_fontflags) and i > 0:
+                update_previous_fonts(fonts, i, prev_fontname, prev_fontflags, text_page, fontname_sample_freq)
+        fonts.append(_char_font(text_page, i, fontname, fontflags))
+    return fonts
 
-def get_pdfium_chars(pdf, page_range, fontname_sample_freq=settings.FONTNAME_SAMPLE_FREQ):
-    """get pdfium chars"""
+
+def char_boxes(text_page, total_chars: int, loose: List[bool]) -> array:
+    """
+    (left, bottom, right, top) of the chars of a page in one flat array, 4 values per char,
+    loose[i] takes the loose box of char i
+    """
+    boxes = array("d", [0.0]) * (4 * total_chars)
+    rect = pdfium_c.FS_RECTF()
+    left, right, bottom, top = ctypes.c_double(), ctypes.c_double(), ctypes.c_double(), ctypes.c_double()
+    for i in range(total_chars):
+        if loose[i]:
+            ok = pdfium_c.FPDFText_GetLooseCharBox(text_page, i, rect)
+            box = rect.left, rect.bottom, rect.right, rect.top
+        else:
+            ok = pdfium_c.FPDFText_GetCharBox(text_page, i, left, right, bottom, top)
+            box = left.value, bottom.value, right.value, top.value
+        if not ok:
+            raise pdfium.PdfiumError("Failed to get charbox.")
+        offset = 4 * i
+        boxes[offset], boxes[offset + 1], boxes[offset + 2], boxes[offset + 3] = box
+    return boxes
+
+
+def load_page(pdf, page_idx):
+    """pdfium page and its textpage"""
+    page = pdf.get_page(page_idx)
+    return page, page.get_textpage()
+
+
+def page_diagnostics(total_chars, unicode_map_errors, garbage_chars, blacklisted_chars):
+    """
+    per page text layer diagnostics, ratios of the page chars and the count of chars in black listed fonts.
+    the unicode map error ratio is a lower bound once it passes UNICODE_MAP_ERROR_RATIO, counting stops there
+    """
+    ratio_base = total_chars + 0.00001
+    return {
+        "total_chars": total_chars,
+        "unicode_map_error": unicode_map_errors / ratio_base,
+        "garbage": garbage_chars / ratio_base,
+        "blacklisted_chars": blacklisted_chars,
+    }
+
+
+def get_pdfium_chars(pdf, page_range, fontname_sample_freq=settings.FONTNAME_SAMPLE_FREQ, get_page=None,
+                     diagnostics=False, font_black_list=None):
+    """
+    get pdfium chars, get_page(page_idx) returns (page, textpage) and may serve them from a cache.
+    diagnostics adds the text layer diagnostics of every page, gathered in the same walk over the chars,
+    the chars of fonts whose name contains a name in font_black_list can not be trusted.
+    the chars of a page are a CharTable under "chars"
+    """
+    if get_page is None:
+        get_page = partial(load_page, pdf)
+    blacklisted_fonts = {}
     blocks = []
     font_names = set()
     #num_unicode_map_error = 0
     font_info_error = 0
     char_nums = 0
     for page_idx in page_range:
-        page = pdf.get_page(page_idx)
-        text_page = page.get_textpage()
+        page, text_page = get_page(page_idx)
         mediabox = page.get_mediabox()
 
         page_rotation = page.get_rotation()
@@ -85,58 +228,48 @@ def get_pdfium_chars(pdf, page_range, fontname_sample_freq=settings.FONTNAME_SAM
             "height": page_height,
         }
 
-        fontname = None
-        fontflags = None
         total_chars = text_page.count_chars()
         char_nums += total_chars
-        char_infos = []
-        
-        for i in range(total_chars):
-            char = pdfium_c.FPDFText_GetUnicode(text_page, i)
-            try:
-                char = chr(char)
-            except Exception as e:
-                logger.warning(e)
+        # columns of the char table of the page
+        table_chars = []
+        table_boxes = []
+        table_fonts = []
+        table_idxs = []
+        unicode_map_errors = 0
+        max_unicode_map_errors = total_chars * settings.UNICODE_MAP_ERROR_RATIO
+        garbage_chars = 0
+        blacklisted_chars = 0
+
+        chars = page_chars(text_page, total_chars)
+        fonts = char_fonts(text_page, total_chars, fontname_sample_freq)
+        boxes = char_boxes(text_page, total_chars, [font[4] == 0 for font in fonts]) # Loose doesn't work properly when charbox is rotated
+        to_device_bbox = device_bbox_converter(page, page_width, page_height, page_rotation)
+        for i, char in enumerate(chars):
+            if diagnostics and unicode_map_errors <= max_unicode_map_errors:
+                unicode_map_errors += pdfium_c.FPDFText_HasUnicodeMapError(text_page, i) != 0
+            if char is None:
                 continue
-            char = fullwidth_to_halfwidth(char)
-
-            fontsize = round(pdfium_c.FPDFText_GetFontSize(text_page, i), 1)
-            fontweight = round(pdfium_c.FPDFText_GetFontWeight(text_page, i), 1)
-            if fontname is None or i % fontname_sample_freq == 0:
-                prev_fontname = fontname
-                prev_fontflags = fontflags
-                fontname, fontflags = get_fontname(text_page, i)
-
-                font_names.add(fontname)
-                if (fontname != prev_fontname or fontflags != prev_fontflags) and i > 0:
-                    update_previous_fonts(char_infos, i, prev_fontname, prev_fontflags,
-                                         text_page, fontname_sample_freq)
-
-            rotation = pdfium_c.FPDFText_GetCharAngle(text_page, i)
-            rotation = rotation * 180 / math.pi # convert from radians to degrees
-
-            coords = text_page.get_charbox(i, loose=rotation == 0) # Loose doesn't work properly when charbox is rotated
-            device_coords = page_bbox_to_device_bbox(page, coords, page_width,
-                                                 page_height, bl_origin,
-                                                page_rotation, normalize=True)
-
-            char_info = {
-                "font": {
-                    "size": fontsize,
-                    "weight": fontweight,
-                    "name": fontname,
-                    "flags": fontflags
-                },
-                "fontname": fontname,
-                "rotation": rotation,
-                "char": char,
-                "bbox": device_coords,
-                "char_idx": i
-            }
-            char_infos.append(char_info)
-
-        text_chars["chars"] = char_infos
+
+            font = fonts[i]
+            fontname = font[0]
+            font_names.add(fontname)
+            if diagnostics:
+                garbage_chars += ord(char) < 65
+                if font_black_list and fontname:
+                    if fontname not in blacklisted_fonts:
+                        blacklisted_fonts[fontname] = any(name in fontname for name in font_black_list)
+                    blacklisted_chars += blacklisted_fonts[fontname]
+
+            table_chars.append(char)
+            table_boxes.extend(to_device_bbox(boxes[4 * i:4 * i + 4]))
+            table_fonts.append(font)
+            table_idxs.append(i)
+
+        text_chars["chars"] = CharTable.build(table_chars, table_boxes, table_fonts, table_idxs)
         text_chars["total_chars"] = total_chars
+        if diagnostics:
+            text_chars["diagnostics"] = page_diagnostics(total_chars, unicode_map_errors, garbage_chars,
+                                                         blacklisted_chars)
         blocks.append(text_chars)
     logger.info(f"fonts : {font_names}")
     return blocks
\ No newline at end of file
@@ -118,6 +118,33 @@ def page_bbox_to_device_bbox(page, bbox, page_width: int, page_height: int, bl_o
     return bbox
 
 
+def device_bbox_converter(page, page_width: int, page_height: int, page_rotation: int):
+    """
+    page_bbox_to_device_bbox(..., normalize=True) of one page as a function of the bbox,
+    the rotation, page sizes and ctypes outputs are set up once instead of for every char
+    """
+    orig_page_height, orig_page_width = page_height, page_width
+    if page_rotation in [90, 270]:
+        orig_page_height, orig_page_width = page_width, page_height
+    width = math.ceil(orig_page_width)
+    height = math.ceil(orig_page_height)
+    rotate = {90: 1, 180: 2, 270: 3}.get(page_rotation, 0)
+    device_x = ctypes.c_int()
+    device_y = ctypes.c_int()
+    page_to_device = pdfium_c.FPDF_PageToDevice
+
+    def convert(bbox):
+        page_to_device(page, 0, 0, width, height, rotate, bbox[0], bbox[1], device_x, device_y)
+        left, bottom = device_x.value, device_y.value
+        page_to_device(page, 0, 0, width, height, rotate, bbox[2], bbox[3], device_x, device_y)
+        dev_bbox = [left, device_y.value, device_x.value, bottom]
+        if page_rotation > 0:
+            dev_bbox = rotate_pdfium_bbox(dev_bbox, page_rotation, page_width, page_height)
+        return [dev_bbox[0] / page_width, dev_bbox[1] / page_height,
+                dev_bbox[2] / page_width, dev_bbox[3] / page_height]
+    return convert
+
+
 def rotate_pdfium_bbox(bbox, angle_deg, width, height):
     """
     rotate bbox by angle
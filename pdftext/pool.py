@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+persistent pdftext extraction pool, the workers load the classifier once when they start and keep
+the last documents open. the pdf bytes reach the workers through shared memory, a task only carries
+the block name and its page range, and the pages are split between the workers by their estimated
+chars instead of their count.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import pypdfium2 as pdfium
+from loguru import logger
+
+from src.pdftext.inference import inference
+from src.pdftext.model import get_model
+from src.pdftext.pdf.chars import get_pdfium_chars, load_page
+
+# documents kept open by a worker, the ranges of a document usually go to every worker
+# and the pages of a document are usually rendered by consecutive tasks
+WORKER_DOCUMENTS = 2
+
+# worker side, (shared memory name, size) -> pdfium document
+_documents = OrderedDict()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# where a worker reads the pdf, a path or (shared memory name, size)
+Source = Union[str, Tuple[str, int]]
+
+
+def share_bytes(data: bytes) -> SharedMemory:
+    """shared memory block holding data, the owner closes and unlinks it"""
+    shm = SharedMemory(create=True, size=max(len(data), 1))
+    shm.buf[:len(data)] = data
+    return shm
+
+
+def _init_worker():
+    """worker side, load the classifier before the first task"""
+    get_model()
+
+
+def open_shared_document(name: str, size: int) -> pdfium.PdfDocument:
+    """
+    worker side, the document of the size pdf bytes in the shared memory block name.
+    the last WORKER_DOCUMENTS documents stay open, the extraction and the render workers both keep them
+    """
+    key = (name, size)
+    if key in _documents:
+        _documents.move_to_end(key)
+        return _documents[key]
+    shm = SharedMemory(name=name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    _documents[key] = pdfium.PdfDocument(data)
+    while len(_documents) > WORKER_DOCUMENTS:
+        _documents.popitem(last=False)[1].close()
+    return _documents[key]
+
+
+def _open_document(source: Source) -> Tuple[pdfium.PdfDocument, bool]:
+    """worker side, the document of source and whether the caller closes it, documents in shared memory stay open"""
+    if isinstance(source, str):
+        return pdfium.PdfDocument(source), True
+    return open_shared_document(*source), False
+
+
+def _extract_range(source: Source, page_range: List[int], model=None, diagnostics=False,
+                   font_black_list: Optional[List[str]] = None) -> List[Dict]:
+    """worker side, the pdftext pages of page_range, model None is the model the worker loaded"""
+    pdf_doc, close = _open_document(source)
+    opened = []
+
+    def get_page(page_idx):
+        page, text_page = load_page(pdf_doc, page_idx)
+        opened.append((page, text_page))
+        return page, text_page
+
+    try:
+        text_chars = get_pdfium_chars(pdf_doc, page_range, get_page=get_page, diagnostics=diagnostics,
+                                      font_black_list=font_black_list)
+    finally:
+        # the document stays open for the next range, its pages do not
+        for page, text_page in opened:
+            text_page.close()
+            page.close()
+        if close:
+            pdf_doc.close()
+    return inference(text_chars, get_model() if model is None else model)
+
+
+def get_pdftext_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    the process wide extraction pool, started on first use with workers capped at the cpu count.
+    the size stays fixed, a call asking for fewer workers submits fewer ranges, see extract_pages.
+    the workers are spawned, they do not inherit the torch and cuda state of the parse worker
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            workers = max(1, min(workers, os.cpu_count() or 1))
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker)
+            _pool_workers = workers
+            logger.info(f"[pdftext] pool of {workers} workers started")
+        return _pool
+
+
+def shutdown_pdftext_pool():
+    """stop the workers, the next extraction starts a new pool"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        pool, _pool, _pool_workers = _pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def split_pages(page_range: Sequence[int], parts: int,
+                page_weights: Optional[Dict[int, float]] = None) -> List[List[int]]:
+    """
+    page_range in at most parts consecutive ranges of about the same weight,
+    the estimated chars of a page, every page weighs the same without page_weights
+    """
+    page_range = list(page_range)
+    weights = [max(page_weights.get(pnum, 0), 1) if page_weights else 1 for pnum in page_range]
+    total = sum(weights)
+    ranges = []
+    current = []
+    weight = 0
+    for pnum, page_weight in zip(page_range, weights):
+        target = total * (len(ranges) + 1) / parts
+        # a heavy page goes to the next range when the current one is closer to its share without it
+        if current and len(ranges) < parts - 1 and weight + page_weight - target > target - weight:
+            ranges.append(current)
+            current = []
+            target = total * (len(ranges) + 1) / parts
+        current.append(pnum)
+        weight += page_weight
+        if weight >= target and len(ranges) < parts - 1:
+            ranges.append(current)
+            current = []
+    if current:
+        ranges.append(current)
+    return ranges
+
+
+def extract_pages(pdf_path: Union[str, bytes], page_range: Sequence[int], workers: int, model=None,
+                  diagnostics=False, font_black_list: Optional[List[str]] = None, shared: Optional[SharedMemory] = None,
+                  page_weights: Optional[Dict[int, float]] = None) -> List[Dict]:
+    """
+    pdftext pages of page_range in order, extracted by the pool in at most workers ranges.
+    pdf_path is a path or the pdf bytes, shared a shared memory block already holding the bytes,
+    otherwise the bytes are shared for this call. model None is the model the workers loaded,
+    another model is sent with every range. font_black_list is a plain list of font names,
+    it is sent with every range without importing anything in the workers
+    """
+    own_shared = None
+    if isinstance(pdf_path, str):
+        source = pdf_path
+    else:
+        if shared is None:
+            shared = own_shared = share_bytes(pdf_path)
+        source = (shared.name, len(pdf_path))
+    futures = []
+    try:
+        pool = get_pdftext_pool(workers)
+        with _pool_lock:
+            pool_workers = _pool_workers
+        parts = max(1, min(workers, pool_workers))
+        font_black_list = list(font_black_list) if font_black_list else None
+        futures = [pool.submit(_extract_range, source, pages, model, diagnostics, font_black_list)
+                   for pages in split_pages(page_range, parts, page_weights)]
+        return [page for future in futures for page in future.result()]
+    finally:
+        if own_shared is not None:
+            # a failed range does not stop the others, they read the bytes until they are done
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            own_shared.close()
+            own_shared.unlink()
@@ -23,10 +23,14 @@ class Settings(BaseSettings):
 
 
     # Fonts
-    FONTNAME_SAMPLE_FREQ: int = 1
+    FONTNAME_SAMPLE_FREQ: int = 1 # Chars per font name lookup, only for pdfium builds without FPDFText_GetTextObject
+    # Diagnostics
+    UNICODE_MAP_ERROR_RATIO: float = 0.009 # Pages above this unicode map error ratio need OCR, counting stops there
     # Inference
     BLOCK_THRESHOLD: float = 0.8 # Confidence threshold for block detection
     WORKER_PAGE_THRESHOLD: int = 10 # Min number of pages per worker in parallel
+    COMPILE_MODEL: bool = True # Flatten the tree classifier into node arrays, no sklearn call per character
+    COMPILE_VERIFY_ROWS: int = 4096 # Generated rows the compiled model must predict exactly like sklearn, 0 skips the check
 
     # Benchmark
     RESULTS_FOLDER: str = "results"
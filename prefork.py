@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pre-fork launcher for parse workers.
+the parent loads the models once, freezes them and moves the weights to shared memory, then forks the workers.
+the workers share the weights copy-on-write, so an extra worker costs little memory and starts in seconds.
+cuda can not be used across fork, on cuda every worker loads its own models.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+
+from typing import Callable, List, Optional
+from loguru import logger
+
+import torch
+
+from src import connect
+import src.config_util as cfg
+from src.connect.pool import ThreadedConnectionPool
+from src.jungle.models import load_all_models
+from src.jungle.model_registry import torch_modules
+
+
+# pools inherited from the parent are kept referenced in the workers, closing them would close the parent connections
+_inherited_pools = []
+
+
+def freeze_models(model_lst: List):
+    """
+    eval mode without gradients, and cpu weights in shared memory
+    """
+    for model in model_lst:
+        for module in torch_modules(model):
+            module.eval()
+            module.requires_grad_(False)
+            module.share_memory()
+
+
+def load_shared_models() -> List:
+    """
+    load the models in the parent, ready to be forked
+    """
+    start = time.time()
+    # lazy models would be loaded in every worker, after fork
+    model_lst = load_all_models(lazy=False)
+    freeze_models(model_lst)
+    # objects which exist before fork are never scanned by gc again, so gc does not dirty their pages in the workers
+    gc.collect()
+    gc.freeze()
+    logger.info(f"[prefork] models loaded in {time.time() - start:.1f} secs")
+    return model_lst
+
+
+def _init_worker(worker_idx: int, num_workers: int):
+    """reset the per process state inherited from the parent"""
+    _inherited_pools.append(connect.conn_pool)
+    connect.conn_pool = ThreadedConnectionPool(10, 60, **connect.config)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_workers))
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    logger.info(f"[prefork] worker {worker_idx} started, pid {os.getpid()}")
+
+
+def _spawn(worker: Callable, model_lst: Optional[List], worker_idx: int, num_workers: int) -> int:
+    """fork one worker, return its pid"""
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    code = 0
+    try:
+        _init_worker(worker_idx, num_workers)
+        if model_lst is None:
+            model_lst = load_all_models()
+        worker(model_lst, worker_idx)
+    except Exception as e:
+        logger.exception(f"[prefork] worker {worker_idx} failed: {e}")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def run_workers(worker: Callable, num_workers: int, respawn: bool = True):
+    """
+    load the models once and fork num_workers processes running worker(model_lst, worker_idx),
+    e.g. a consumer building FileParse(model_lst=model_lst). dead workers are forked again,
+    SIGTERM and SIGINT stop all workers.
+    """
+    model_lst = load_shared_models() if cfg.DEVICE == "cpu" else None
+    if model_lst is None:
+        logger.warning("[prefork] models can not be shared on cuda, every worker loads its own models")
+
+    workers = {}
+    for worker_idx in range(num_workers):
+        workers[_spawn(worker, model_lst, worker_idx, num_workers)] = worker_idx
+
+    stopping = []
+
+    def stop(signum, frame):
+        """stop all workers"""
+        stopping.append(signum)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker_idx = workers.pop(pid, None)
+        if worker_idx is None:
+            continue
+        logger.warning(f"[prefork] worker {worker_idx} (pid {pid}) exited with status {status}")
+        if respawn and not stopping:
+            workers[_spawn(worker, model_lst, worker_idx, num_workers)] = worker_idx
+
+
+if __name__ == "__main__":
+
+    from src.http_response import HTTPResponse
+    from src.file_parse import FileParse
+
+    def serve(model_lst, worker_idx):
+        """example worker, the job queue threads started here serve the submitted parse jobs"""
+        response = HTTPResponse(pdf_parser=FileParse(model_lst=model_lst))
+        response.start_jobs()
+        while True:
+            time.sleep(3600)
+
+    run_workers(serve, int(sys.argv[1]) if len(sys.argv) > 1 else 2)
@@ -22,6 +22,7 @@ from PIL import Image
 from src.rock.postprocessing.heatmap import get_and_clean_boxes
 from src.rock.postprocessing.affinity import get_vertical_lines, get_horizontal_lines
 from src.rock.input.processing import prepare_image, split_image
+from src.rock.input.page_image import as_page_image
 from src.rock.schema import TextDetectionResult
 from src.rock.settings import settings
 from tqdm import tqdm
@@ -45,12 +46,11 @@ def batch_detection(images: List, model, processor,
     """
     batch text line detection
     """
-    assert all([isinstance(image, Image.Image) for image in images])
     if batch_size is None:
         batch_size = get_batch_size()
     heatmap_count = model.config.num_labels
 
-    images = [image.convert("RGB") for image in images]
+    images = [as_page_image(image) for image in images]
     orig_sizes = [image.size for image in images]
     split_index = []
     split_heights = []
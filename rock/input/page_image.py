@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+page image, the one read-only uint8 RGB array of a rendered page shared by the model stages.
+the stages read views of it, the resampled copies a processor needs are made once per target size.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import threading
+from typing import Callable, Dict, Hashable, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+
+class PageImage(object):
+    """
+    read-only H x W x 3 uint8 array of a page, with a cache of its resampled copies by target
+    """
+    def __init__(self, array: np.ndarray):
+        assert array.dtype == np.uint8 and array.ndim == 3 and array.shape[2] == 3
+        array.setflags(write=False)
+        self.array = array
+        self._resampled: Dict[Hashable, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pil(cls, image: Image.Image) -> "PageImage":
+        """page image of a PIL image, the pixels are copied once"""
+        return cls(np.asarray(image.convert("RGB"), dtype=np.uint8))
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height) like PIL"""
+        return self.array.shape[1], self.array.shape[0]
+
+    @property
+    def width(self) -> int:
+        """width"""
+        return self.array.shape[1]
+
+    @property
+    def height(self) -> int:
+        """height"""
+        return self.array.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """memory of the page and its resampled copies"""
+        return self.array.nbytes + sum(array.nbytes for array in self._resampled.values())
+
+    def __array__(self, dtype=None, copy=None):
+        # np.asarray(page_image) is a view, the array is read-only
+        if dtype is not None and np.dtype(dtype) != self.array.dtype:
+            return self.array.astype(dtype)
+        return self.array
+
+    def to_pil(self) -> Image.Image:
+        """writable PIL copy, e.g. to draw on"""
+        return Image.fromarray(self.array)
+
+    def crop(self, box) -> Image.Image:
+        """PIL image of box, only the box is copied when it lies inside the page"""
+        left, top, right, bottom = [int(round(value)) for value in box]
+        if 0 <= left <= right <= self.width and 0 <= top <= bottom <= self.height:
+            return Image.fromarray(self.array[top:bottom, left:right])
+        # PIL fills the area outside the page
+        return self.to_pil().crop(box)
+
+    def resampled(self, key: Hashable, resample: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """resample(array) cached under key, a target size and method"""
+        with self._lock:
+            if key not in self._resampled:
+                array = np.ascontiguousarray(resample(self.array), dtype=np.uint8)
+                array.setflags(write=False)
+                self._resampled[key] = array
+            return self._resampled[key]
+
+    def fit(self, size: Tuple[int, int]) -> np.ndarray:
+        """
+        the page shrunk to fit (width, height) then stretched to it, both LANCZOS,
+        the resize of the detection and reading order processors
+        """
+        return self.resampled(("fit", ) + tuple(size), fit_resample(size))
+
+    def drop_resampled(self):
+        """forget the resampled copies"""
+        with self._lock:
+            self._resampled = {}
+
+
+def fit_resample(size: Tuple[int, int]) -> Callable[[np.ndarray], np.ndarray]:
+    """fit resample of an array to size"""
+    def resample(array: np.ndarray) -> np.ndarray:
+        img = Image.fromarray(array)
+        img.thumbnail(size, Image.Resampling.LANCZOS) # Shrink largest dimension to fit new size
+        img = img.resize(size, Image.Resampling.LANCZOS) # Stretch smaller dimension to fit new size
+        return np.asarray(img, dtype=np.uint8)
+    return resample
+
+
+def as_page_image(image: Union[PageImage, Image.Image, np.ndarray]) -> PageImage:
+    """page image of a page image, PIL image or RGB array"""
+    if isinstance(image, PageImage):
+        return image
+    if isinstance(image, Image.Image):
+        return PageImage.from_pil(image)
+    return PageImage(np.asarray(image, dtype=np.uint8))
+
+
+def resampled(image, key: Hashable, resample: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    """resample(array) of an image, cached when it is a page image"""
+    if isinstance(image, PageImage):
+        return image.resampled(key, resample)
+    return resample(np.asarray(image))
@@ -23,14 +23,16 @@ import pypdfium2
 from PIL import Image, ImageOps, ImageDraw
 import torch
 from src.rock.settings import settings
+from src.rock.input.page_image import PageImage, as_page_image
 from loguru import logger
 import cv2
 
 
 def split_image(img, processor):
     """split image"""
-    # This will not modify/return the original image - it will either crop, or copy the image
-    img_height = list(img.size)[1]
+    # The splits are views of the page image, only the padded last split is copied
+    img = as_page_image(img)
+    img_height = img.height
     max_height = settings.DETECTOR_IMAGE_CHUNK_HEIGHT
     processor_height = processor.size["height"]
     if img_height > max_height:
@@ -42,24 +44,24 @@ def split_image(img, processor):
             bottom = (i + 1) * processor_height
             if bottom > img_height:
                 bottom = img_height
-            cropped = img.crop((0, top, img.size[0], bottom))
+            cropped = img.array[top:bottom]
             height = bottom - top
             if height < processor_height:
-                cropped = ImageOps.pad(cropped, (img.size[0], processor_height), color=255, centering=(0, 0))
-            splits.append(cropped)
+                padded = np.full((processor_height, img.width, 3), 255, dtype=np.uint8)
+                padded[:height] = cropped
+                cropped = padded
+            splits.append(PageImage(cropped))
             split_heights.append(height)
         return splits, split_heights
-    return [img.copy()], [img_height]
+    return [img], [img_height]
 
 
 def prepare_image(img, processor):
     """prepare image"""
     new_size = (processor.size["width"], processor.size["height"])
 
-    img.thumbnail(new_size, Image.Resampling.LANCZOS) # Shrink largest dimension to fit new size
-    img = img.resize(new_size, Image.Resampling.LANCZOS) # Stretch smaller dimension to fit new size
-
-    img = np.asarray(img, dtype=np.uint8)
+    # Resampled once per page and size, see PageImage.fit
+    img = as_page_image(img).fit(new_size)
     img = processor(img)["pixel_values"][0]
     img = torch.from_numpy(img)
     return img
@@ -95,7 +97,8 @@ def slice_bboxes_from_image(image: Image.Image, bboxes):
 
 def slice_polys_from_image(image: Image.Image, polys):
     """slice polys from image"""
-    image_array = np.array(image, dtype=np.uint8)
+    # A view of the page, slice_and_pad_poly copies each line
+    image_array = as_page_image(image).array
     lines = []
     for idx, poly in enumerate(polys):
         lines.append(slice_and_pad_poly(image_array, poly))
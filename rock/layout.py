@@ -21,14 +21,15 @@ import numpy as np
 from src.rock.detection import batch_detection
 from src.rock.postprocessing.heatmap import keep_largest_boxes, get_and_clean_boxes, get_detected_boxes
 from src.rock.schema import LayoutResult, LayoutBox, TextDetectionResult
+from src.rock.input.page_image import PageImage
 import src.config_util as settings
 
 
 def batch_layout_detection(images: List, predictor, batch_size=12) -> List[LayoutResult]:
     """
-    batch layout detection.
+    batch layout detection, page images are passed as they are so the predictor caches its resize.
     """
-    images = [np.asarray(image) for image in images]
+    images = [image if isinstance(image, PageImage) else np.asarray(image) for image in images]
     results = predictor(images, batch_size=batch_size)
     return results
 
@@ -19,6 +19,7 @@ from typing import Dict, List
 from src.rock.settings import settings
 import src.config_util as cfg
 from src.rock.schema import LayoutResult, LayoutBox, TextDetectionResult
+from src.rock.input.page_image import PageImage, resampled
 from detectron2.config import LazyCall as L
 from detectron2.layers import ShapeSpec
 from detectron2.modeling.backbone import SwinTransformer
@@ -104,7 +105,7 @@ class DefaultPredictor:
     def __call__(self, original_images: List[np.ndarray], batch_size: int =16):
         """
         Args:
-            original_image list of images (np.ndarray): images of shape (H, W, C) (in BGR order).
+            original_image list of images (np.ndarray or PageImage): images of shape (H, W, C) (in BGR order).
 
         Returns:
             predictions (dict):
@@ -128,9 +129,13 @@ class DefaultPredictor:
 
                     for original_image in batch:
                         
-                        height, width = original_image.shape[:2]
+                        array = np.asarray(original_image)
+                        height, width = array.shape[:2]
 
-                        image = self.aug.get_transform(original_image).apply_image(original_image)
+                        # The resize of a page image is cached per target size
+                        transform = self.aug.get_transform(array)
+                        image = resampled(original_image, ("layout", transform.new_h, transform.new_w),
+                                          transform.apply_image)
 
                         image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
                         image = image.to(settings.TORCH_DEVICE_MODEL)
@@ -172,7 +177,7 @@ def group_images_with_same_ratio(images):
     """
     ratio_dict = defaultdict(list)
     for index, image in enumerate(images):
-        height, width = image.shape[:2]
+        height, width = np.asarray(image).shape[:2]
         ratio = width / height
         ratio_dict[ratio].append(index)
     return ratio_dict
@@ -201,7 +206,7 @@ def batch_layout_detection(images: List, predictor, batch_size=12) -> List[Layou
     """
     batch layout detection
     """
-    images = [np.asarray(image) for image in images]
+    images = [image if isinstance(image, PageImage) else np.asarray(image) for image in images]
     results = predictor(images, batch_size=batch_size)
     return results
 
@@ -108,7 +108,10 @@ class OrderImageProcessor(DonutImageProcessor):
         img = img.resize(new_size, Image.Resampling.LANCZOS)  # Stretch smaller dimension to fit new size
 
         img = np.asarray(img, dtype=np.uint8)
+        return img, self.rescale_boxes(boxes, orig_dim)
 
+    def rescale_boxes(self, boxes, orig_dim):
+        """rescale boxes of an image of size orig_dim to the box size"""
         width, height = orig_dim
         box_width, box_height = self.box_size["width"], self.box_size["height"]
         for box in boxes:
@@ -127,7 +130,7 @@ class OrderImageProcessor(DonutImageProcessor):
             if box[3] > box_height:
                 box[3] = box_height
 
-        return img, boxes
+        return boxes
 
     def preprocess(
         self,
@@ -148,9 +151,10 @@ class OrderImageProcessor(DonutImageProcessor):
         return_tensors: Optional[Union[str, TensorType]] = None,
         data_format: Optional[ChannelDimension] = ChannelDimension.FIRST,
         input_data_format: Optional[Union[str, ChannelDimension]] = None,
+        orig_sizes: Optional[List[Tuple[int, int]]] = None,
         **kwargs,
     ) -> PIL.Image.Image:
-        """preprocess"""
+        """preprocess, with orig_sizes the images are already resized and orig_sizes are their sizes before"""
         images = make_list_of_images(images)
 
         if not valid_images(images):
@@ -161,10 +165,13 @@ class OrderImageProcessor(DonutImageProcessor):
 
         new_images = []
         new_boxes = []
-        for img, box in zip(images, boxes):
+        for idx, (img, box) in enumerate(zip(images, boxes)):
             if len(box) > self.max_boxes:
                 raise ValueError(f"Too many boxes, max is {self.max_boxes}")
-            img, box = self.resize_img_and_boxes(img, box)
+            if orig_sizes is not None:
+                box = self.rescale_boxes(box, orig_sizes[idx])
+            else:
+                img, box = self.resize_img_and_boxes(img, box)
             new_images.append(img)
             new_boxes.append(box)
 
@@ -18,6 +18,7 @@ import torch
 from PIL import Image
 
 from src.rock.schema import OrderBox, OrderResult
+from src.rock.input.page_image import as_page_image
 from src.rock.settings import settings
 from tqdm import tqdm
 import numpy as np
@@ -50,12 +51,12 @@ def rank_elements(arr):
 def batch_ordering(images: List, bboxes: List[List[List[float]]], 
                     model, processor, batch_size=None) -> List[OrderResult]:
     """batch ordering"""
-    assert all([isinstance(image, Image.Image) for image in images])
     assert len(images) == len(bboxes)
     if batch_size is None:
         batch_size = get_batch_size()
 
-    images = [image.convert("RGB") for image in images]
+    images = [as_page_image(image) for image in images]
+    new_size = (processor.size["width"], processor.size["height"])
 
     output_order = []
     for i in range(0, len(images), batch_size):
@@ -63,7 +64,9 @@ def batch_ordering(images: List, bboxes: List[List[List[float]]],
         batch_images = images[i:i + batch_size]
         orig_sizes = [image.size for image in batch_images]
         logger.info("reading order process start")
-        model_inputs = processor(images=batch_images, boxes=batch_bboxes)
+        # The processor gets the resampled page images, resized once per page
+        model_inputs = processor(images=[image.fit(new_size) for image in batch_images], boxes=batch_bboxes,
+                                 orig_sizes=orig_sizes)
         logger.info("reading order process end")
         batch_pixel_values = model_inputs["pixel_values"]
         batch_bboxes = model_inputs["input_boxes"]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+throughput benchmark on a generated corpus, on cpu.
+exits with status 1 when a metric regresses against the baseline.
+
+    python src/script/benchmark.py --baseline benchmark_baseline.json
+    python src/script/benchmark.py --docs single_column,book --save_baseline benchmark_baseline.json
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+import sys
+import os
+import platform
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+os.environ.setdefault("TORCH_DEVICE", "cpu")
+
+import argparse
+import src.config_util as cfg
+from src.jungle.benchmark.corpus import CORPUS, CORPUS_VERSION, build_corpus
+from src.jungle.benchmark.runner import run_full, run_micro, compare, load_json, save_json
+from src.jungle.models import load_all_models
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus_dir", type=str, default="benchmark_corpus")
+    parser.add_argument("--docs", type=str, default=",".join(CORPUS), help="comma separated corpus documents")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--micro_only", action="store_true", help="skip the full pipeline, no models are loaded")
+    parser.add_argument("--baseline", type=str, default=None, help="baseline json to compare with")
+    parser.add_argument("--save_baseline", type=str, default=None, help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression")
+    parser.add_argument("--output", type=str, default="benchmark_result.json")
+    args = parser.parse_args()
+
+    if cfg.DEVICE != "cpu":
+        print(f"warning: models are configured for {cfg.DEVICE}, results are not comparable with cpu baselines")
+
+    paths = build_corpus(args.corpus_dir, args.docs.split(","))
+    results = {
+        "corpus_version": CORPUS_VERSION,
+        "machine": {"cpu_count": os.cpu_count(), "platform": platform.platform(), "device": cfg.DEVICE},
+        "micro": run_micro(paths, repeat=args.repeat),
+    }
+    if not args.micro_only:
+        results["full"] = run_full(paths, load_all_models(lazy=False), repeat=args.repeat)
+
+    save_json(results, args.output)
+    if args.save_baseline:
+        save_json(results, args.save_baseline)
+
+    if args.baseline:
+        baseline = load_json(args.baseline)
+        if baseline.get("corpus_version") != CORPUS_VERSION:
+            print("warning: the baseline was measured on another corpus version")
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("no regression against the baseline")
@@ -18,18 +18,25 @@ from src.jungle.convert import convert_single_pdf
 from src.jungle.logger import configure_logging
 from src.jungle.models import load_all_models
 from src.jungle.cleaners.ner import JiebaSeg, SpacyEngSeg, parse_doc_labels
+from src.jungle.settings import settings
 import argparse
 
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_file", type=str)
+    parser.add_argument("--start_page", type=int, default=None, help="first page parsed, from 0")
+    parser.add_argument("--max_pages", type=int, default=None, help="pages parsed from start_page")
+    parser.add_argument("--preview", action="store_true", help="only parse the first PREVIEW_PAGES pages")
     args = parser.parse_args()
+    if args.preview:
+        args.start_page, args.max_pages = 0, settings.PREVIEW_PAGES
     model_lst = load_all_models()
 
     with open(args.input_file, "rb") as f:
         bfile = f.read()
 
-    structure, language, knowledge_type = convert_single_pdf(bfile, model_lst)
+    structure, language, knowledge_type = convert_single_pdf(bfile, model_lst, start_page=args.start_page,
+                                                             max_pages=args.max_pages)
     with open("result.md", "w") as f:
         f.write(structure.to_markdown())
\ No newline at end of file
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+startup profile of the service: import time per library and model load time.
+exits with status 1 when the import takes longer than --max_import_secs.
+
+    python src/script/startup_profile.py --max_import_secs 5
+    python src/script/startup_profile.py --models eager
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import json
+import argparse
+from src.jungle.benchmark.startup import import_profile, model_profile
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", type=str, default="src.http_response", help="module imported by the service")
+    parser.add_argument("--top", type=int, default=20, help="libraries and top level imports reported")
+    parser.add_argument("--models", choices=["none", "lazy", "eager"], default="none",
+                        help="also time load_all_models, in this process")
+    parser.add_argument("--max_import_secs", type=float, default=None, help="import time counted as a regression")
+    parser.add_argument("--output", type=str, default="startup_profile.json")
+    args = parser.parse_args()
+
+    results = {"imports": import_profile(args.module, top=args.top)}
+    if args.models != "none":
+        results["models"] = model_profile(lazy=args.models == "lazy")
+
+    print(json.dumps(results, indent=2))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    import_seconds = results["imports"]["import_seconds"]
+    if args.max_import_secs is not None and import_seconds > args.max_import_secs:
+        print(f"regression: importing {args.module} took {import_seconds} secs, "
+              f"above {args.max_import_secs} secs")
+        sys.exit(1)
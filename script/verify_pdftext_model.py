@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+check that the compiled pdftext classifier predicts exactly like sklearn predict_proba on
+generated rows, and time both on the rows of one page at a time.
+
+    python src/script/verify_pdftext_model.py --rows 100000
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import time
+import argparse
+
+import joblib
+import sklearn
+import src.config_util as cfg
+from src.pdftext.compiled import compile_model, verify_compiled, verification_rows
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, default=cfg.PDF_EXTRACTION_MODEL)
+    parser.add_argument("--rows", type=int, default=100000, help="generated rows compared")
+    parser.add_argument("--seeds", type=int, default=5, help="corpora generated with different seeds")
+    parser.add_argument("--batch", type=int, default=1, help="rows per call in the timing, pages stepped together")
+    args = parser.parse_args()
+
+    model = joblib.load(args.model_path)
+    compiled = compile_model(model)
+    print(f"{type(model).__name__}: {len(compiled.roots)} trees, {len(compiled.left)} nodes, "
+          f"depth {compiled.max_depth}")
+
+    for seed in range(args.seeds):
+        if not verify_compiled(model, compiled, num_rows=args.rows, seed=seed):
+            print(f"seed {seed}: compiled predictions differ from predict_proba")
+            sys.exit(1)
+    print(f"identical on {args.seeds} x {args.rows} rows")
+
+    rows = verification_rows(compiled, 2000, seed=args.seeds).tolist()
+    batches = [rows[i:i + args.batch] for i in range(0, len(rows), args.batch)]
+    start = time.perf_counter()
+    with sklearn.config_context(assume_finite=True):
+        for batch in batches:
+            model.predict_proba(batch)
+    sklearn_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    for batch in batches:
+        compiled.predict_proba(batch)
+    compiled_secs = time.perf_counter() - start
+    print(f"{len(batches)} calls of {args.batch} rows: sklearn {sklearn_secs:.3f} secs, "
+          f"compiled {compiled_secs:.3f} secs")
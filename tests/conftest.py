@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+the repository is deployed as the package src, the tests import it under that name.
+without the deployed conf/01bot.yaml the config is read from an empty one, every setting takes its default.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import os
+import sys
+import tempfile
+import importlib
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "src" not in sys.modules:
+    _spec = importlib.util.spec_from_file_location("src", os.path.join(ROOT, "__init__.py"),
+                                                   submodule_search_locations=[ROOT])
+    sys.modules["src"] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules["src"])
+
+if "src.config_util" not in sys.modules and not os.path.exists(os.path.join("conf", "01bot.yaml")):
+    _cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as _conf_root:
+        os.makedirs(os.path.join(_conf_root, "conf"))
+        with open(os.path.join(_conf_root, "conf", "01bot.yaml"), "w") as _f:
+            _f.write("mdocai_01bot_doc: {}\nocr_server: {}\n")
+        os.chdir(_conf_root)
+        try:
+            importlib.import_module("src.config_util")
+        finally:
+            os.chdir(_cwd)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+model calls of concurrent documents merged into shared batches, and the batch sizes they record.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import threading
+
+import pytest
+
+batching = pytest.importorskip("src.jungle.batching")
+
+from src.jungle.metrics import MetricsRegistry, DocumentMetrics
+from src.jungle import metrics as jungle_metrics
+from src.jungle.batching import BatchScheduler
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """a fresh process registry"""
+    registry = MetricsRegistry()
+    monkeypatch.setattr(jungle_metrics, "REGISTRY", registry)
+    return registry
+
+
+def _counter(registry, name, stage):
+    """value of a counter of stage"""
+    return registry._counters.get((name, (("stage", stage), )), 0)
+
+
+def _run_documents(scheduler, item_lists, func, batch_size=16):
+    """run one call per document in threads, every document in flight, returns the results and the metrics"""
+    results = [None] * len(item_lists)
+    errors = [None] * len(item_lists)
+    document_metrics = [DocumentMetrics() for _ in item_lists]
+    ready = threading.Barrier(len(item_lists))
+
+    def run(i):
+        with document_metrics[i].activate(), scheduler.document():
+            ready.wait()
+            try:
+                results[i] = scheduler.run(("layout", 0), func, [item_lists[i]], batch_size)
+            except Exception as e:
+                errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, )) for i in range(len(item_lists))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors, document_metrics
+
+
+def test_calls_of_concurrent_documents_are_merged(registry):
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    scheduler = BatchScheduler(max_wait=5)
+    results, errors, document_metrics = _run_documents(scheduler, [[1, 2], [3], [4, 5, 6]], double)
+    assert errors == [None, None, None]
+    assert results == [[2, 4], [6], [8, 10, 12]]
+    # every document was in flight, the leader did not wait for the timeout
+    assert len(calls) == 1
+    assert sorted(calls[0]) == [1, 2, 3, 4, 5, 6]
+    # the merged batch is counted once in the registry and once per document
+    assert _counter(registry, "jungle_batches_total", "layout") == 1
+    assert _counter(registry, "jungle_batch_items_total", "layout") == 6
+    for metrics in document_metrics:
+        assert metrics.to_dict()["layout"]["batch_sizes"] == [6]
+
+
+def test_leader_stops_waiting_at_the_batch_size(registry):
+    scheduler = BatchScheduler(max_wait=5)
+    with scheduler.document(), scheduler.document():
+        # a second document is in flight but the call fills a batch on its own
+        result = scheduler.run(("layout", 0), lambda items: [-item for item in items], [[1, 2, 3]], 2)
+    assert result == [-1, -2, -3]
+    assert _counter(registry, "jungle_batches_total", "layout") == 2
+
+
+def test_leader_waits_at_most_max_wait(registry):
+    scheduler = BatchScheduler(max_wait=0.01)
+    with scheduler.document(), scheduler.document():
+        result = scheduler.run(("layout", 0), lambda items: items, [[1]], 8)
+    assert result == [1]
+
+
+def test_errors_reach_every_merged_call(registry):
+    def fail(items):
+        raise RuntimeError("model failed")
+
+    scheduler = BatchScheduler(max_wait=5)
+    results, errors, _ = _run_documents(scheduler, [[1], [2]], fail)
+    assert results == [None, None]
+    assert all(isinstance(error, RuntimeError) for error in errors)
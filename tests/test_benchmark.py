@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+benchmark summaries and the regressions found against a baseline.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import pytest
+
+runner = pytest.importorskip("src.jungle.benchmark.runner")
+
+from src.jungle.benchmark.runner import compare, summarize, summarize_memory, load_json, save_json
+
+BASELINE = {
+    "all": {"pages_per_sec": 10.0, "latency_p50": 2.0, "latency_p95": 4.0, "peak_rss_mb": 1000.0,
+            "rss_delta_mb": 200.0, "documents": 5, "stage_wall": {"layout": 3.0}},
+    "render": {"a.pdf": {"pages_per_sec": 50.0, "latency_p95": 0.5}},
+}
+
+
+def _results(**changes):
+    """the baseline with the overall metrics changed"""
+    results = {key: dict(value) for key, value in BASELINE.items()}
+    results["all"].update(changes)
+    return results
+
+
+def test_no_regression_within_tolerance():
+    assert compare(_results(pages_per_sec=9.5, latency_p95=4.3, peak_rss_mb=1090.0), BASELINE) == []
+
+
+def test_slower_and_larger_runs_regress():
+    regressions = compare(_results(pages_per_sec=8.0, latency_p50=2.5, rss_delta_mb=300.0), BASELINE)
+    assert sorted(regressions) == [
+        "all/latency_p50: 2.5 vs baseline 2.0",
+        "all/pages_per_sec: 8.0 vs baseline 10.0",
+        "all/rss_delta_mb: 300.0 vs baseline 200.0",
+    ]
+
+
+def test_improvements_do_not_regress():
+    assert compare(_results(pages_per_sec=20.0, latency_p50=1.0, peak_rss_mb=500.0), BASELINE) == []
+
+
+def test_nested_results_are_compared():
+    results = _results()
+    results["render"] = {"a.pdf": {"pages_per_sec": 40.0, "latency_p95": 0.5}}
+    assert compare(results, BASELINE) == ["render/a.pdf/pages_per_sec: 40.0 vs baseline 50.0"]
+
+
+def test_informational_and_missing_metrics_are_skipped():
+    results = _results(documents=50, stage_wall={"layout": 30.0})
+    del results["all"]["latency_p95"]
+    del results["render"]
+    assert compare(results, BASELINE) == []
+
+
+def test_unmeasured_memory_is_skipped():
+    baseline = _results(peak_rss_mb=None)
+    assert compare(_results(peak_rss_mb=None, rss_delta_mb=None), BASELINE) == []
+    assert compare(_results(peak_rss_mb=5000.0), baseline) == []
+
+
+def test_tolerance():
+    results = _results(pages_per_sec=9.5)
+    assert compare(results, BASELINE, tolerance=0.1) == []
+    assert compare(results, BASELINE, tolerance=0.01) == ["all/pages_per_sec: 9.5 vs baseline 10.0"]
+
+
+def test_summaries():
+    summary = summarize([1.0, 2.0, 3.0], pages=12)
+    assert summary["documents"] == 3
+    assert summary["pages_per_sec"] == 2.0
+    assert summary["latency_p50"] == 2.0
+    assert summarize_memory([100.0, 300.04, None], [5.0, None]) == {"peak_rss_mb": 300.0, "rss_delta_mb": 5.0}
+    assert summarize_memory([None], []) == {"peak_rss_mb": None, "rss_delta_mb": None}
+
+
+def test_results_round_trip(tmp_path):
+    path = str(tmp_path / "baseline.json")
+    save_json(BASELINE, path)
+    assert load_json(path) == BASELINE
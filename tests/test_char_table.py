@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+char table columns, the slices spans keep and their pickling.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import copy
+import pickle
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.pdftext.pdf.char_table import CharTable, CharSlice
+
+FONT = ("Song", 4, 10.0, 400.0, 0.0)
+BOLD = ("Song-Bold", 4, 10.0, 700.0, 0.0)
+
+
+def _table(text="ab𝄞cd"):
+    """table of text, char i in the box (i, 0, i + 1, 1) and every other char bold"""
+    boxes = [value for i in range(len(text)) for value in (i, 0, i + 1, 1)]
+    fonts = [FONT if i % 2 == 0 else BOLD for i in range(len(text))]
+    return CharTable.build(list(text), boxes, fonts, list(range(len(text))))
+
+
+def test_build_interns_fonts():
+    table = _table()
+    assert len(table) == 5
+    assert table.fonts == [FONT, BOLD]
+    assert table.font(3) == BOLD
+    assert table.text() == "ab𝄞cd"
+    assert table.text(1, 3) == "b𝄞"
+    assert table.char(2) == "𝄞"
+
+
+def test_slice_reads_like_char_dicts():
+    table = _table()
+    chars = table.slice(1, 4)
+    assert len(chars) == 3
+    assert chars.text == "b𝄞c"
+    assert [char["char"] for char in chars] == ["b", "𝄞", "c"]
+    assert chars[0]["bbox"] == (1.0, 0.0, 2.0, 1.0)
+    assert chars[-1]["char"] == "c"
+    assert chars[0].get("font") is None
+    with pytest.raises(IndexError):
+        chars[3]
+
+
+def test_slice_of_slice():
+    chars = _table().slice(1, 5)
+    sub = chars[1:3]
+    assert isinstance(sub, CharSlice)
+    assert (sub.start, sub.end) == (2, 4)
+    assert sub.text == "𝄞c"
+    assert len(chars[3:1]) == 0
+    assert chars[:].text == chars.text
+
+
+def test_scale_rounds_boxes():
+    table = _table("ab")
+    table.scale(612.0, 792.0)
+    assert table.boxes.dtype == np.float32
+    assert table.bbox(1) == (612.0, 0.0, 1224.0, 792.0)
+    assert table.span_bbox(0, 2) == [0.0, 0.0, 1224.0, 792.0]
+
+
+def test_compact_copies_the_chars():
+    table = _table()
+    chars = table.slice(2, 4).compact()
+    assert chars.table is not table
+    assert len(chars.table) == 2
+    assert chars.text == "𝄞c"
+    assert chars[1]["bbox"] == (3.0, 0.0, 4.0, 1.0)
+    assert chars.table.font(1) == BOLD
+
+
+def test_pickle_keeps_only_the_slice():
+    table = _table()
+    chars = table.slice(1, 3)
+    restored = pickle.loads(pickle.dumps(chars))
+    assert restored.text == "b𝄞"
+    assert len(restored.table) == 2
+    assert restored.to_list() == chars.to_list()
+
+    whole = pickle.loads(pickle.dumps(table.slice(0, len(table))))
+    assert whole.text == table.text()
+
+
+def test_deepcopy_shares_the_table():
+    chars = _table().slice(0, 2)
+    copied = copy.deepcopy(chars)
+    assert copied.table is chars.table
+    assert (copied.start, copied.end) == (0, 2)
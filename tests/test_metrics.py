@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+per stage metrics of a document and of the process registry.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("loguru")
+
+from src.jungle import metrics as jungle_metrics
+from src.jungle.metrics import MetricsRegistry, DocumentMetrics, count, current_metrics, record_batches, stage
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """a fresh process registry"""
+    registry = MetricsRegistry()
+    monkeypatch.setattr(jungle_metrics, "REGISTRY", registry)
+    return registry
+
+
+def _counter(registry, name, stage_name):
+    """value of a counter of stage_name"""
+    return registry._counters.get((name, (("stage", stage_name), )), 0)
+
+
+def test_stage_records_time_and_counts(registry):
+    metrics = DocumentMetrics()
+    with metrics.activate():
+        with stage("layout", pages=3) as counts:
+            counts["tables"] = 2
+        count("layout", pages=1)
+    layout = metrics.to_dict()["layout"]
+    assert layout["calls"] == 1
+    assert layout["pages"] == 4
+    assert layout["tables"] == 2
+    assert layout["wall"] >= 0
+    assert _counter(registry, "jungle_stage_pages_total", "layout") == 4
+    assert _counter(registry, "jungle_stage_calls_total", "layout") == 1
+    assert current_metrics() is None
+
+
+def test_stage_cpu_leaves_out_other_threads(registry):
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            pass
+
+    thread = threading.Thread(target=spin)
+    thread.start()
+    metrics = DocumentMetrics()
+    try:
+        with metrics.activate(), stage("wait"):
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        thread.join()
+    # the stage slept, the cpu the other thread burnt meanwhile is not charged to it
+    assert metrics.to_dict()["wait"]["cpu"] < 0.1
+
+
+def test_record_batches(registry):
+    metrics = DocumentMetrics()
+    with metrics.activate():
+        record_batches("layout", 10, 4)
+        record_batches("layout", 0, 4)
+    assert metrics.to_dict()["layout"]["batch_sizes"] == [4, 4, 2]
+    assert _counter(registry, "jungle_batches_total", "layout") == 3
+    assert _counter(registry, "jungle_batch_items_total", "layout") == 10
+
+
+def test_record_batches_registry_or_document_only(registry):
+    metrics = DocumentMetrics()
+    with metrics.activate():
+        record_batches("ocr", 3, 0, registry=False)
+        record_batches("ocr", 5, 8, document=False)
+    # a batch size below 1 is 1
+    assert metrics.to_dict()["ocr"]["batch_sizes"] == [1, 1, 1]
+    assert _counter(registry, "jungle_batches_total", "ocr") == 1
+    assert _counter(registry, "jungle_batch_items_total", "ocr") == 5
+
+
+def test_prometheus_text(registry):
+    registry.inc("jungle_stage_calls_total", 2, help_text="calls per stage", stage="ocr")
+    text = registry.prometheus_text()
+    assert "# HELP jungle_stage_calls_total calls per stage\n" in text
+    assert "# TYPE jungle_stage_calls_total counter\n" in text
+    assert 'jungle_stage_calls_total{stage="ocr"} 2.0\n' in text
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+borrow limits of the shared NLP engine pools.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import itertools
+import threading
+import time
+
+import pytest
+
+nlp = pytest.importorskip("src.jungle.nlp")
+
+from src.jungle.nlp import EnginePool, engine_pool, register_engine
+
+
+class _Factory(object):
+    """builds numbered engines, fails the first fail_first builds"""
+    def __init__(self, fail_first: int = 0):
+        self.built = 0
+        self.fail_first = fail_first
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                raise RuntimeError("model files missing")
+            self.built += 1
+            return {"id": next(self._ids)}
+
+
+def _borrow_concurrently(pool: EnginePool, threads: int, hold: float = 0.05):
+    """borrow from threads at once, returns the engines they got and the most borrowed at the same time"""
+    engines = []
+    lock = threading.Lock()
+    state = {"borrowed": 0, "peak": 0}
+
+    def borrow():
+        with pool.borrow() as engine:
+            with lock:
+                engines.append(engine)
+                state["borrowed"] += 1
+                state["peak"] = max(state["peak"], state["borrowed"])
+            time.sleep(hold)
+            with lock:
+                state["borrowed"] -= 1
+
+    workers = [threading.Thread(target=borrow) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+    return engines, state["peak"]
+
+
+def test_at_most_size_instances_are_lent():
+    factory = _Factory()
+    pool = EnginePool("lac", factory, size=2)
+    engines, peak = _borrow_concurrently(pool, threads=6)
+    assert len(engines) == 6
+    assert factory.built == 2
+    assert peak == 2
+    assert {engine["id"] for engine in engines} == {0, 1}
+
+
+def test_instances_are_reused():
+    factory = _Factory()
+    pool = EnginePool("lac", factory, size=4)
+    with pool.borrow() as first:
+        pass
+    with pool.borrow() as second:
+        assert second is first
+    assert factory.built == 1
+
+
+def test_size_below_one_is_one():
+    assert EnginePool("lac", _Factory(), size=0).size == 1
+
+
+def test_thread_safe_engine_is_shared():
+    factory = _Factory()
+    pool = EnginePool("jieba", factory, size=4, thread_safe=True)
+    engines, peak = _borrow_concurrently(pool, threads=5)
+    assert factory.built == 1
+    assert peak > 1
+    assert all(engine is engines[0] for engine in engines)
+
+
+def test_failed_build_frees_its_slot():
+    factory = _Factory(fail_first=1)
+    pool = EnginePool("lac", factory, size=1)
+    with pytest.raises(RuntimeError):
+        with pool.borrow():
+            pass
+    # the failed instance does not count, the next borrow builds one instead of waiting forever
+    with pool.borrow() as engine:
+        assert engine["id"] == 0
+    assert factory.built == 1
+
+
+def test_engine_pool_per_engine_and_args(monkeypatch):
+    monkeypatch.setattr(nlp, "ENGINES", dict(nlp.ENGINES))
+    monkeypatch.setattr(nlp, "_pools", {})
+    register_engine("test_engine", lambda name: {"name": name})
+    pool = engine_pool("test_engine", "en")
+    assert engine_pool("test_engine", "en") is pool
+    assert engine_pool("test_engine", "zh") is not pool
+    with pool.borrow() as engine:
+        assert engine == {"name": "en"}
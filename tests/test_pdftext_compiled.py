@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+compiled trees give the predict_proba of the sklearn tree or forest they come from.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import pickle
+
+import pytest
+
+np = pytest.importorskip("numpy")
+ensemble = pytest.importorskip("sklearn.ensemble")
+tree = pytest.importorskip("sklearn.tree")
+
+from src.pdftext.compiled import compile_model, verify_compiled
+
+
+def _data(seed=0):
+    """small classification set with integer and float features, like the pdftext features"""
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.integers(0, 5, 300), rng.normal(size=300), rng.uniform(0, 100, 300)])
+    y = ((X[:, 0] > 2) ^ (X[:, 1] > 0)).astype(int) + (X[:, 2] > 80)
+    return X, y
+
+
+@pytest.mark.parametrize("model", [
+    tree.DecisionTreeClassifier(max_depth=6, random_state=0),
+    ensemble.RandomForestClassifier(n_estimators=5, max_depth=5, random_state=0),
+])
+def test_compiled_matches_predict_proba(model):
+    X, y = _data()
+    model.fit(X, y)
+    compiled = compile_model(model)
+    assert verify_compiled(model, compiled, num_rows=512)
+    # batches below and above the python row walk
+    for rows in [X[:3], X]:
+        assert np.array_equal(compiled.predict_proba(rows), model.predict_proba(rows.astype(np.float32)))
+
+
+def test_compiled_pickles_without_lists():
+    X, y = _data(1)
+    model = tree.DecisionTreeClassifier(max_depth=4, random_state=0).fit(X, y)
+    compiled = compile_model(model)
+    assert "_left" not in compiled.__getstate__()
+    restored = pickle.loads(pickle.dumps(compiled))
+    assert verify_compiled(model, restored, num_rows=256)
+
+
+def test_compile_rejects_other_models():
+    with pytest.raises(ValueError):
+        compile_model(object())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+page ranges of the pdftext pool and the documents its workers keep open.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import io
+
+import pytest
+
+pdfium = pytest.importorskip("pypdfium2")
+pytest.importorskip("joblib")
+pytest.importorskip("numpy")
+
+from src.pdftext import pool
+from src.pdftext.pool import split_pages, share_bytes, open_shared_document
+
+
+def _pdf_bytes(num_pages: int) -> bytes:
+    """an empty pdf of num_pages pages"""
+    doc = pdfium.PdfDocument.new()
+    for _ in range(num_pages):
+        doc.new_page(612, 792)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    doc.close()
+    return buffer.getvalue()
+
+
+def test_split_pages_by_count():
+    assert split_pages(range(9), 3) == [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+    assert [len(pages) for pages in split_pages(range(10), 3)] == [3, 4, 3]
+    assert split_pages(range(4), 1) == [[0, 1, 2, 3]]
+
+
+def test_split_pages_fewer_pages_than_parts():
+    assert split_pages(range(2), 4) == [[0], [1]]
+    assert split_pages([], 3) == []
+
+
+def test_split_pages_by_weight():
+    # the heavy first page gets a range of its own, the light ones share the rest
+    assert split_pages(range(5), 2, {0: 100, 1: 1, 2: 1, 3: 1, 4: 1}) == [[0], [1, 2, 3, 4]]
+    # the heavy last page does too
+    assert split_pages(range(5), 2, {4: 100}) == [[0, 1, 2, 3], [4]]
+
+
+def test_split_pages_keeps_every_page_in_order():
+    weights = {pnum: (pnum * 37) % 11 for pnum in range(3, 40)}
+    ranges = split_pages(range(3, 40), 4, weights)
+    assert len(ranges) <= 4
+    assert [pnum for pages in ranges for pnum in pages] == list(range(3, 40))
+
+
+def test_split_pages_missing_weights_count_as_one():
+    assert split_pages(range(4), 2, {}) == split_pages(range(4), 2)
+    assert split_pages(range(4), 2, {0: 0}) == [[0, 1], [2, 3]]
+
+
+def test_open_shared_document_keeps_the_last_documents(monkeypatch):
+    monkeypatch.setattr(pool, "_documents", type(pool._documents)())
+    blocks = []
+    try:
+        docs = []
+        for num_pages in range(1, pool.WORKER_DOCUMENTS + 2):
+            data = _pdf_bytes(num_pages)
+            shm = share_bytes(data)
+            blocks.append(shm)
+            doc = open_shared_document(shm.name, len(data))
+            assert len(doc) == num_pages
+            assert open_shared_document(shm.name, len(data)) is doc
+            docs.append(doc)
+        # the first document was closed to keep WORKER_DOCUMENTS open
+        assert len(pool._documents) == pool.WORKER_DOCUMENTS
+        assert (blocks[0].name, len(_pdf_bytes(1))) not in pool._documents
+    finally:
+        for doc in pool._documents.values():
+            doc.close()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+stage overlapped pipeline: order, errors, early stop and the context of the stage threads.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import contextvars
+import threading
+from functools import partial
+
+import pytest
+
+pytest.importorskip("loguru")
+
+from src.jungle.pipeline import run_pipeline, run_sequential, stage_name
+
+
+def _add(value, item):
+    """add value to item"""
+    return item + value
+
+
+def _pipeline_threads():
+    """pipeline threads still alive"""
+    return [thread for thread in threading.enumerate() if thread.name.startswith("pipeline-")]
+
+
+@pytest.mark.parametrize("run", [run_pipeline, run_sequential])
+def test_outputs_in_source_order(run):
+    stages = [partial(_add, 1), lambda item: item * 10]
+    assert list(run(range(20), stages)) == [(i + 1) * 10 for i in range(20)]
+    assert list(run([], stages)) == []
+
+
+def test_stage_error_is_raised_in_the_consumer():
+    def fail_on_3(item):
+        if item == 3:
+            raise ValueError("bad page window")
+        return item
+
+    outputs = []
+    with pytest.raises(ValueError, match="bad page window"):
+        for item in run_pipeline(range(10), [fail_on_3, partial(_add, 1)]):
+            outputs.append(item)
+    # the items before the failure come out first
+    assert outputs == [1, 2, 3]
+    assert _pipeline_threads() == []
+
+
+def test_source_error_is_raised_in_the_consumer():
+    def source():
+        yield 1
+        raise RuntimeError("extraction failed")
+
+    with pytest.raises(RuntimeError, match="extraction failed"):
+        list(run_pipeline(source(), [partial(_add, 1)]))
+    assert _pipeline_threads() == []
+
+
+def test_stopping_early_stops_the_threads():
+    fed = []
+
+    def source():
+        for i in range(1000):
+            fed.append(i)
+            yield i
+
+    results = run_pipeline(source(), [partial(_add, 1), partial(_add, 1)], queue_size=1)
+    assert next(results) == 2
+    results.close()
+    assert _pipeline_threads() == []
+    # the bounded queues kept the source from running ahead
+    assert len(fed) < 10
+
+
+def test_stages_run_in_the_consumer_context():
+    document = contextvars.ContextVar("document", default=None)
+    document.set("a.pdf")
+    assert list(run_pipeline(range(3), [lambda item: (item, document.get())])) == [
+        (0, "a.pdf"), (1, "a.pdf"), (2, "a.pdf")]
+
+
+def test_stage_name():
+    assert stage_name(_add) == "_add"
+    assert stage_name(partial(_add, 1)) == "_add"
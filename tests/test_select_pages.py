@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2024 , Inc. All Rights Reserved
+#
+################################################################################
+"""
+pages parsed for a page range or a preview request.
+
+Authors: yushilin(1329239119@qq.com)
+Date:    2024/07/29 17:08:41
+"""
+
+import pytest
+
+convert = pytest.importorskip("src.jungle.convert")
+select_pages = convert.select_pages
+
+
+def test_all_pages_by_default():
+    assert select_pages(5) == range(0, 5)
+    # max_pages 0 is no limit, like an absent one
+    assert select_pages(5, max_pages=0) == range(0, 5)
+
+
+def test_page_range():
+    assert select_pages(10, start_page=2, max_pages=3) == range(2, 5)
+    assert select_pages(10, start_page=9) == range(9, 10)
+    assert select_pages(10, max_pages=4) == range(0, 4)
+
+
+def test_max_pages_past_the_end():
+    assert select_pages(10, start_page=8, max_pages=5) == range(8, 10)
+    assert select_pages(3, max_pages=100) == range(0, 3)
+
+
+def test_empty_document():
+    assert len(select_pages(0)) == 0
+    assert len(select_pages(0, max_pages=5)) == 0
+    with pytest.raises(ValueError):
+        select_pages(0, start_page=0)
+
+
+@pytest.mark.parametrize("start_page", [-1, 10, 11])
+def test_start_page_out_of_range(start_page):
+    with pytest.raises(ValueError):
+        select_pages(10, start_page=start_page)
+
+
+def test_negative_max_pages():
+    with pytest.raises(ValueError):
+        select_pages(10, max_pages=-1)